@@ -0,0 +1,154 @@
+import json
+import os
+import platform
+import sys
+import statistics
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List
+from unittest.mock import patch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# secret_santa.database needs it to build the default engines
+os.environ.setdefault("DATABASE_NAME", "db.sqlite3")
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from secret_santa.database import Base, set_sqlite_pragmas
+from secret_santa.models import Participant
+from telegram_bot import models
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+@asynccontextmanager
+async def temporary_database(pragmas: Dict[str, object] = None, pool_size: int = 5):
+    """Point telegram_bot.models at a new SQLite file for the benchmark.
+
+    `pragmas` defaults to the bot's SQLite profile; pass {} for the SQLite
+    defaults.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{directory}/benchmark.sqlite3",
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=0,
+        )
+        set_sqlite_pragmas(engine.sync_engine, pragmas)
+
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        session_factory = async_sessionmaker(
+            bind=engine, autoflush=False, expire_on_commit=False
+        )
+
+        with patch.object(models, "AsyncSession", session_factory), patch.object(
+            models, "cache", models.ParticipantCache()
+        ), patch.object(models, "name_index", models.NameIndex()):
+            try:
+                yield session_factory
+            finally:
+                await engine.dispose()
+
+
+async def add_participants(
+    session_factory: async_sessionmaker, game_id: int, count: int
+) -> List[int]:
+    """Insert `count` participants in one statement and return their ids.
+
+    Participant i has chat_id str(i) and name "Participant i".
+    """
+
+    async with session_factory() as session:
+        await session.execute(
+            insert(Participant),
+            [
+                {"game_id": game_id, "chat_id": str(i), "name": f"Participant {i}"}
+                for i in range(count)
+            ],
+        )
+        await session.commit()
+
+        ids = await session.scalars(
+            select(Participant.id)
+            .where(Participant.game_id == game_id)
+            .order_by(Participant.id)
+        )
+
+        return list(ids)
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Milliseconds per run of a list of timings."""
+
+    return {
+        "runs": len(seconds),
+        "min_ms": round(min(seconds) * 1000, 4),
+        "median_ms": round(statistics.median(seconds) * 1000, 4),
+        "max_ms": round(max(seconds) * 1000, 4),
+    }
+
+
+def measure(func: Callable[[], object], runs: int) -> Dict[str, float]:
+    seconds = []
+
+    for _ in range(runs):
+        start = perf_counter()
+        func()
+        seconds.append(perf_counter() - start)
+
+    return summarize(seconds)
+
+
+async def measure_async(
+    func: Callable[[], Awaitable[object]],
+    runs: int,
+    setup: Callable[[], Awaitable[object]] = None,
+) -> Dict[str, float]:
+    """Time `await func()`; `setup` runs before each call, outside the timer."""
+
+    seconds = []
+
+    for _ in range(runs):
+        if setup is not None:
+            await setup()
+
+        start = perf_counter()
+        await func()
+        seconds.append(perf_counter() - start)
+
+    return summarize(seconds)
+
+
+def save_results(name: str, results: List[Dict], output: str = None) -> Path:
+    """Write the results as JSON, by default to benchmarks/results/."""
+
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"{name}-{timestamp}.json"
+
+    output = Path(output)
+    output.write_text(
+        json.dumps(
+            {
+                "benchmark": name,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+    return output
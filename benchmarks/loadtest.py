@@ -0,0 +1,252 @@
+"""Registration rush against the real Application, with Telegram faked locally.
+
+python -m benchmarks.loadtest --users 1000 --arrival-rate 200 --latency 0.05 \
+    --parallelism 8
+
+Every simulated user sends /hola, types their name, then presses a few menu
+buttons, waiting for the bot to handle each message before thinking and
+sending the next one. Updates go through app.update_queue into the handlers
+built by run_telegram_bot.build_application, so they queue and run exactly
+as they do in production, and the bot's replies go to a FakeRequest.
+
+It reports the updates handled per second, the latency percentiles per
+conversation state (from the moment the update is queued until its handlers
+returned and their replies were sent) and how many queries and Bot API calls each state needed. With
+--parallelism above 1 those counts also take in whatever other chats ran at
+the same time, so only the totals are exact.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+from collections import defaultdict
+from itertools import count
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from benchmarks.common import save_results, temporary_database
+from secret_santa.database import QueryCounter
+from telegram_bot.processor import ChatUpdateProcessor
+from telegram_bot.settings import KeyboardOptions
+from telegram_bot.testing import FakeRequest, message_update
+
+import run_telegram_bot
+
+
+def scenario(user: int) -> List[Tuple[str, str]]:
+    """The (conversation state, message) pairs one user sends, in order."""
+
+    return [
+        ("START", "/hola"),
+        ("TYPING_NAME", f"Participant {user}"),
+        ("CHOOSING", KeyboardOptions.GET_PARTICIPANT.value),
+        ("CHOOSING", KeyboardOptions.EDIT_PREFS.value),
+        ("TYPING_REPLY", f"Talla M, le gusta el color {user % 7}"),
+        ("CHOOSING", KeyboardOptions.GET_RECIPIENT.value),
+        ("CHOOSING", KeyboardOptions.CONV_END.value),
+    ]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    cuts = statistics.quantiles(values, n=100) if len(values) > 1 else values * 99
+
+    return {
+        "count": len(values),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p90_ms": round(cuts[89] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+class LoadGenerator:
+    """Feed the users' updates to the app and time how each one is handled."""
+
+    def __init__(self, app: Application, request: FakeRequest, counter: QueryCounter):
+        self.app = app
+        self.request = request
+        self.counter = counter
+
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self.shed = defaultdict(int)
+
+        self._update_ids = count(1)
+        self._pending = {}
+
+        # Group -1 runs before the conversation handlers. An update is done
+        # once process_update returns, when its replies have been sent too
+        app.add_handler(TypeHandler(Update, self._on_start), group=-1)
+
+        process_update = app.process_update
+
+        async def timed_process_update(update: object) -> None:
+            try:
+                await process_update(update)
+            finally:
+                self._on_done(update)
+
+        app.process_update = timed_process_update
+
+    async def _on_start(self, update: Update, context) -> None:
+        pending = self._pending[update.update_id]
+        pending["queries"] = self.counter.count
+        pending["api_calls"] = len(self.request.calls)
+
+    def _on_done(self, update: Update) -> None:
+        pending = self._pending.pop(update.update_id)
+        state = pending["state"]
+        pending["handled"].set_result(None)
+
+        # Flood control stopped it before _on_start
+        if "queries" not in pending:
+            self.shed[state] += 1
+            return
+
+        self.latencies[state].append(perf_counter() - pending["queued_at"])
+        self.queries[state] += self.counter.count - pending["queries"]
+        self.api_calls[state] += len(self.request.calls) - pending["api_calls"]
+
+    async def send(self, chat_id: int, state: str, text: str) -> None:
+        update_id = next(self._update_ids)
+        handled = asyncio.get_running_loop().create_future()
+
+        self._pending[update_id] = {
+            "state": state,
+            "queued_at": perf_counter(),
+            "handled": handled,
+        }
+        await self.app.update_queue.put(
+            message_update(update_id, chat_id, text, self.app.bot)
+        )
+        await handled
+
+    async def user(self, user: int, delay: float, think_time: float) -> None:
+        await asyncio.sleep(delay)
+
+        for state, text in scenario(user):
+            await self.send(1_000_000 + user, state, text)
+
+            if think_time:
+                await asyncio.sleep(random.expovariate(1 / think_time))
+
+
+async def run(
+    users: int,
+    arrival_rate: float,
+    think_time: float,
+    latency: float,
+    parallelism: int = 1,
+) -> Dict:
+    random.seed(users)
+
+    async with temporary_database() as session_factory:
+        request = FakeRequest(latency)
+        builder = (
+            Application.builder()
+            .token("1:LOADTEST")
+            .request(request)
+            .get_updates_request(FakeRequest())
+        )
+
+        if parallelism > 1:
+            builder = builder.concurrent_updates(ChatUpdateProcessor(parallelism))
+
+        app = run_telegram_bot.build_application(builder)
+
+        # Users arrive as a Poisson process, all at once when the rate is 0
+        delays, arrival = [], 0.0
+        for _ in range(users):
+            delays.append(arrival)
+            if arrival_rate:
+                arrival += random.expovariate(arrival_rate)
+
+        with QueryCounter(session_factory.kw["bind"].sync_engine) as counter:
+            generator = LoadGenerator(app, request, counter)
+
+            async with app:
+                await app.start()
+
+                start = perf_counter()
+                await asyncio.gather(
+                    *(
+                        generator.user(user, delays[user], think_time)
+                        for user in range(users)
+                    )
+                )
+                seconds = perf_counter() - start
+
+                await app.stop()
+
+    handled = sum(len(values) for values in generator.latencies.values())
+
+    return {
+        "users": users,
+        "arrival_rate": arrival_rate,
+        "think_time": think_time,
+        "api_latency": latency,
+        "parallelism": parallelism,
+        "updates": handled,
+        "seconds": round(seconds, 3),
+        "updates_per_second": round(handled / seconds, 1),
+        "queries": counter.count,
+        "api_calls": len(request.calls),
+        "flood_control": app.bot_data["flood_control"].stats(),
+        "shed": dict(generator.shed),
+        "states": {
+            state: {
+                **percentiles(values),
+                "queries_per_update": round(generator.queries[state] / len(values), 2),
+                "api_calls_per_update": round(
+                    generator.api_calls[state] / len(values), 2
+                ),
+            }
+            for state, values in generator.latencies.items()
+        },
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    result = await run(
+        args.users, args.arrival_rate, args.think_time, args.latency, args.parallelism
+    )
+
+    print(
+        f"{result['updates']} updates in {result['seconds']} s: "
+        f"{result['updates_per_second']} updates/s, {result['queries']} queries"
+    )
+    print(f"Flood control: {result['flood_control']}")
+    for state, stats in result["states"].items():
+        print(
+            f"{state:>12}: p50 {stats['p50_ms']:>9} ms  p90 {stats['p90_ms']:>9} ms  "
+            f"p99 {stats['p99_ms']:>9} ms  {stats['queries_per_update']:>5} "
+            f"queries/update  {stats['api_calls_per_update']:>5} API calls/update"
+        )
+
+    print(f"Saved to {save_results('loadtest', [result], args.output)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--arrival-rate", type=float, default=100, help="new users per second"
+    )
+    parser.add_argument(
+        "--think-time", type=float, default=0.5, help="mean seconds between messages"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per Bot API call"
+    )
+    parser.add_argument(
+        "--parallelism", type=int, default=1, help="chats handled at the same time"
+    )
+    parser.add_argument("--output", help="JSON file for the results")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,66 @@
+"""Registration write throughput with and without the SQLite profile.
+
+python -m benchmarks.sqlite_profile --registrations 2000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+from time import perf_counter
+
+from benchmarks.common import save_results, temporary_database
+from secret_santa.database import SQLITE_PRAGMAS
+from telegram_bot import models
+
+PROFILES = {
+    "sqlite-defaults": {},
+    "bot-profile": SQLITE_PRAGMAS,
+}
+
+
+async def run_profile(name: str, registrations: int, concurrency: int) -> dict:
+    async with temporary_database(PROFILES[name], pool_size=concurrency):
+        game_id = (await models.get_or_create_game("Benchmark")).id
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def register(i: int) -> bool:
+            # Same as a /hola registration: one INSERT, the unique indexes
+            # reject taken names
+            async with semaphore:
+                return await models.create_participant(
+                    game_id, chat_id=str(i), name=f"Participant {i}"
+                )
+
+        start = perf_counter()
+        created = await asyncio.gather(*(register(i) for i in range(registrations)))
+        seconds = perf_counter() - start
+
+    return {
+        "profile": name,
+        "registrations": registrations,
+        "concurrency": concurrency,
+        "failed": created.count(False),
+        "seconds": round(seconds, 4),
+        "per_second": round(registrations / seconds, 1),
+    }
+
+
+async def main(registrations: int, concurrency: int, output: str = None) -> None:
+    results = [await run_profile(name, registrations, concurrency) for name in PROFILES]
+
+    for result in results:
+        print(
+            f"{result['profile']:>16}: {result['per_second']:>8} registrations/s "
+            f"({result['failed']} failed)"
+        )
+
+    print(f"Saved to {save_results('sqlite_profile', results, output)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--registrations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.registrations, args.concurrency, args.output))
@@ -0,0 +1,234 @@
+"""Time the draw, the data layer and the handlers at several game sizes.
+
+python -m benchmarks.suite --sizes 10 1000 10000 100000 --runs 5
+
+Every result has the group, the operation, the number of participants and
+the min/median/max milliseconds per run. Pass --compare with an earlier
+results file to print how much each median changed.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from itertools import count
+from typing import Dict, List
+
+from telegram.ext import Application, CallbackContext
+
+from benchmarks.common import (
+    add_participants,
+    measure,
+    measure_async,
+    save_results,
+    temporary_database,
+)
+from secret_santa.assignment import derangement, single_cycle
+from secret_santa.matching import solve
+from telegram_bot import models, settings
+from telegram_bot.testing import FakeRequest, message_update
+
+import run_telegram_bot
+
+SIZES = [10, 1000, 10000, 100000]
+
+
+def random_exclusions(ids: List[int], size: int, rng: random.Random):
+    pairs = set()
+
+    while len(pairs) < size:
+        pairs.add(tuple(rng.sample(ids, 2)))
+
+    return list(pairs)
+
+
+def bench_draw(size: int, runs: int) -> List[Dict]:
+    ids = list(range(size))
+    exclusions = random_exclusions(ids, size, random.Random(size))
+
+    return [
+        {"group": "draw", "name": name, **measure(func, runs)}
+        for name, func in [
+            ("derangement", lambda: derangement(ids)),
+            ("single_cycle", lambda: single_cycle(ids)),
+            ("solve", lambda: solve(ids)),
+            ("solve_with_exclusions", lambda: solve(ids, exclusions)),
+        ]
+    ]
+
+
+async def bench_models(game_id: int, ids: List[int], runs: int) -> List[Dict]:
+    assignment = derangement(ids)
+    new_chat_ids = count(len(ids))
+
+    chat_id = str(len(ids) // 2)
+    participant = await models.get_participant(game_id, chat_id=chat_id)
+
+    async def clear_cache():
+        models.cache.clear()
+
+    async def save():
+        await models.save_assignment(game_id, assignment)
+
+    async def clean():
+        await models.clean_recipients(game_id)
+
+    async def create():
+        new_chat_id = next(new_chat_ids)
+        await models.create_participant(game_id, str(new_chat_id), f"New {new_chat_id}")
+
+    await save()
+
+    operations = [
+        (
+            "models",
+            "get_participant_cold",
+            lambda: models.get_participant(game_id, chat_id=chat_id),
+            clear_cache,
+        ),
+        (
+            "models",
+            "get_participant_cached",
+            lambda: models.get_participant(game_id, chat_id=chat_id),
+            None,
+        ),
+        (
+            "models",
+            "get_participant_recipient",
+            lambda: models.get_participant_recipient(participant),
+            clear_cache,
+        ),
+        (
+            "models",
+            "get_participant_whose_recipient_is_participant",
+            lambda: models.get_participant_whose_recipient_is_participant(participant),
+            clear_cache,
+        ),
+        (
+            "models",
+            "get_all_participants",
+            lambda: models.get_all_participants(game_id),
+            None,
+        ),
+        ("models", "create_participant", create, None),
+        ("models", "save_assignment", save, clean),
+        ("clean_recipients", "clean_recipients", clean, save),
+    ]
+
+    return [
+        {"group": group, "name": name, **await measure_async(func, runs, setup)}
+        for group, name, func, setup in operations
+    ]
+
+
+async def bench_handlers(
+    app: Application, game_id: int, ids: List[int], runs: int
+) -> List[Dict]:
+    """Round trips through the handlers, from the Update to the replies."""
+
+    await models.save_assignment(game_id, derangement(ids))
+
+    update_ids = count(1)
+    new_chat_ids = count(2 * len(ids) + 1)
+    chat_id = len(ids) // 2
+
+    async def call(handler, chat_id: int, text: str):
+        update = message_update(next(update_ids), chat_id, text, app.bot)
+        app.chat_data[chat_id].game_id = game_id
+
+        return await handler(update, CallbackContext.from_update(update, app))
+
+    async def register():
+        new_chat_id = next(new_chat_ids)
+        await call(
+            run_telegram_bot.register_participant, new_chat_id, f"Late {new_chat_id}"
+        )
+
+    operations = [
+        (
+            "choice_reply_handler",
+            lambda: call(
+                run_telegram_bot.choice_reply_handler,
+                chat_id,
+                settings.KeyboardOptions.GET_RECIPIENT.value,
+            ),
+        ),
+        (
+            "start_command",
+            lambda: call(run_telegram_bot.start_command, chat_id, "/hola"),
+        ),
+        ("register_participant", register),
+    ]
+
+    return [
+        {"group": "handlers", "name": name, **await measure_async(func, runs)}
+        for name, func in operations
+    ]
+
+
+async def bench_size(size: int, runs: int) -> List[Dict]:
+    results = bench_draw(size, runs)
+
+    async with temporary_database() as session_factory:
+        game_id = (await models.get_or_create_game("Benchmark")).id
+        ids = await add_participants(session_factory, game_id, size)
+
+        results += await bench_models(game_id, ids, runs)
+
+        app = run_telegram_bot.build_application(
+            Application.builder()
+            .token("1:BENCHMARK")
+            .request(FakeRequest())
+            .get_updates_request(FakeRequest())
+        )
+        await app.initialize()
+
+        try:
+            results += await bench_handlers(app, game_id, ids, runs)
+        finally:
+            await app.shutdown()
+
+    return [{"size": size, **result} for result in results]
+
+
+def compare(results: List[Dict], previous: str) -> None:
+    with open(previous) as file:
+        before = {
+            (result["group"], result["name"], result["size"]): result["median_ms"]
+            for result in json.load(file)["results"]
+        }
+
+    for result in results:
+        key = (result["group"], result["name"], result["size"])
+
+        if key in before and before[key] > 0:
+            change = result["median_ms"] / before[key] - 1
+            print(f"{' / '.join(map(str, key)):>70}: {change:+.1%}")
+
+
+async def main(sizes: List[int], runs: int, output: str = None, previous=None):
+    results = []
+
+    for size in sizes:
+        for result in await bench_size(size, runs):
+            results.append(result)
+            print(
+                f"{result['size']:>7} {result['group']:>16} {result['name']:>46}: "
+                f"{result['median_ms']:>10.3f} ms"
+            )
+
+    print(f"Saved to {save_results('suite', results, output)}")
+
+    if previous is not None:
+        compare(results, previous)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.runs, args.output, args.compare))
@@ -1,53 +1,139 @@
-from random import choice, shuffle
+import asyncio
+import logging
+import warnings
 from re import sub as re_sub
 from os import getenv
-from multiprocessing import Process
+from functools import partial
+from typing import Dict, List
 
 from dotenv import load_dotenv
 from telegram import (
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     ReplyKeyboardRemove,
     Update,
 )
 from telegram.ext import (
     Application,
+    ApplicationBuilder,
+    CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     ConversationHandler,
+    InlineQueryHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
-from sqlalchemy import func
-from sqlalchemy.exc import IntegrityError
+from telegram.error import TelegramError
+from telegram.warnings import PTBUserWarning
+from telegram.request import HTTPXRequest
 
 from telegram_bot import settings
 from telegram_bot import models
-from telegram_bot.utils import create_keyboard
-from secret_santa.models import Participant
-from secret_santa.database import Session, engine, Base, DATABASE_URL
+from telegram_bot.utils import MessageChunker, create_keyboard, create_page_keyboard
+from telegram_bot.broadcast import Broadcaster, DeliveryStatus
+from telegram_bot.debounce import Debouncer
+from telegram_bot.floodcontrol import FLOOD_CONTROL_GROUP, FloodControl
+from telegram_bot.jobs import DrawJob, DrawRunner, DrawRunnerClosed, DrawStatus
+from telegram_bot.metrics import (
+    InstrumentedRequest,
+    Metrics,
+    MetricsServer,
+    QueryMetrics,
+    instrument_handlers,
+)
+from telegram_bot.persistence import ChatState, SQLitePersistence
+from telegram_bot.processor import ChatUpdateProcessor, UpdateQueue
+from telegram_bot.replies import ComposingApplication, reply
+from telegram_bot.webhook import WebhookServer, run_webhook
+from secret_santa.matching import InfeasibleAssignment
+from secret_santa.migrations import upgrade
+from secret_santa.database import async_engine, engine, Base, DATABASE_URL
+
+logger = logging.getLogger(__name__)
 
 
 load_dotenv()
 TOKEN = getenv("TELEGRAM_TOKEN")
 
+# Webhook mode, polling is used when WEBHOOK_URL is not set
+WEBHOOK_URL = getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = getenv("WEBHOOK_PATH", "/webhook")
+# A random one is used when empty, Telegram is given whichever it is
+WEBHOOK_SECRET_TOKEN = getenv("WEBHOOK_SECRET_TOKEN") or None
+WEBHOOK_QUEUE_SIZE = int(getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_MAX_CONNECTIONS = int(getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# Updates from different chats run concurrently, those of a chat in order
+UPDATE_PARALLELISM = int(getenv("UPDATE_PARALLELISM", 8))
+
+# Seconds between saves of the chat and conversation states
+PERSISTENCE_INTERVAL = float(getenv("PERSISTENCE_INTERVAL", 10))
+
+# Seconds a giver is told about their recipient's new preferences after the
+# first change, the changes made meanwhile go in the same notice
+PREFERENCES_NOTICE_DELAY = float(getenv("PREFERENCES_NOTICE_DELAY", 60))
+
+# Updates per second a chat may send after a burst, and all chats together;
+# past the global rate updates wait up to FLOOD_MAX_DELAY seconds
+CHAT_UPDATE_RATE = float(getenv("CHAT_UPDATE_RATE", 1))
+CHAT_UPDATE_BURST = float(getenv("CHAT_UPDATE_BURST", 20))
+GLOBAL_UPDATE_RATE = float(getenv("GLOBAL_UPDATE_RATE", 200))
+FLOOD_MAX_DELAY = float(getenv("FLOOD_MAX_DELAY", 2))
+
+# Prometheus metrics on http://METRICS_LISTEN:METRICS_PORT/metrics, off when
+# METRICS_PORT is not set; statements slower than SLOW_QUERY_SECONDS are logged
+METRICS_LISTEN = getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = getenv("METRICS_PORT")
+SLOW_QUERY_SECONDS = float(getenv("SLOW_QUERY_SECONDS", 0.1))
+
+
+async def get_game_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Return the game the chat is playing.
+
+    That is the one it picked with /juego, or else the one it registered in
+    last, or else the default game.
+    """
+
+    game_id = context.chat_data.game_id
+
+    if game_id is None:
+        game_id = await models.get_chat_game_id(update.effective_chat.id)
+
+    if game_id is None:
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+    context.chat_data.game_id = game_id
+
+    return game_id
+
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /hola is issued."""
 
-    participant = models.get_participant(update.effective_chat.id)
+    participant = await models.get_participant(
+        await get_game_id(update, context), chat_id=update.effective_chat.id
+    )
 
     if participant is None:
-        await update.message.reply_text(
+        await reply(
+            update,
             "¡Hola! Bienvenido al juego de Niño Jesús Secreto",
             reply_markup=ReplyKeyboardRemove(),
         )
-        await update.message.reply_text(
+        await reply(
+            update,
             "¿Cómo te llamas?",
             reply_markup=ReplyKeyboardRemove(),
         )
 
         return settings.TYPING_NAME
 
-    await update.message.reply_text(
+    await reply(
+        update,
         f"¡Hola {participant.name}! ¿Qué quieres hacer?",
         reply_markup=create_keyboard(),
     )
@@ -55,10 +141,38 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     return settings.CHOOSING
 
 
+async def game_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a message when the command /juego is issued."""
+
+    name = " ".join(context.args).strip()
+
+    if not name:
+        game = await models.get_game(await get_game_id(update, context))
+
+        await reply(
+            update,
+            f"Estás en el juego {game.name}. Para cambiar de juego envía: "
+            "/juego Nombre del juego",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return
+
+    game = await models.get_or_create_game(name)
+    context.chat_data.game_id = game.id
+
+    await reply(
+        update,
+        f"Ahora estás en el juego {game.name}. "
+        "Para registrarte o ver tu información envía /hola",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+
 async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Say goodbye"""
 
-    await update.message.reply_text(
+    await reply(
+        update,
         f"¡Hasta la próxima!",
         reply_markup=ReplyKeyboardRemove(),
     )
@@ -69,62 +183,148 @@ async def done_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /ayuda is issued."""
 
-    await update.message.reply_text(
+    await reply(
+        update,
         "Si tienes dudas de cómo funciona este chat, "
         "por favor contacta a Maria Fernanda 😄",
         reply_markup=ReplyKeyboardRemove(),
     )
 
 
-def assign_recipients(participants) -> None:
-    participants_copy = participants.copy()
-    shuffle(participants)
+draw_runner = DrawRunner()
 
-    for participant in participants:
-        possible_recipient = participant
+metrics = Metrics()
 
-        while possible_recipient == participant:
-            possible_recipient = choice(participants_copy)
+DRAW_STATUS_TEXT = {
+    DrawStatus.QUEUED: "en cola",
+    DrawStatus.RUNNING: "repartiendo las parejas",
+    DrawStatus.SAVING: "guardando las parejas",
+    DrawStatus.NOTIFYING: "avisando a los participantes",
+    DrawStatus.DONE: "terminado",
+    DrawStatus.FAILED: "falló",
+    DrawStatus.CANCELLED: "cancelado",
+}
+
+
+# Givers named when the draw is not possible, the rest are counted
+INFEASIBLE_NAMES = 20
 
-            # Add restriction to avoid Valen to be paired with Sergio Vargas
-            # Valen -> 1749651542
-            # Sergio Velez -> 5556702448
-            # Sergio Vargas ->
-            # Mafe -> 1310291616
-            participant_is_valen = int(participant.chat_id) == 1749651542
-            recipient_is_valen = int(possible_recipient.chat_id) == 1749651542
-            participant_is_sergio = (
-                "sergio" in participant.name.lower()
-                and int(participant.chat_id) != 5556702448
-            )
-            recipient_is_sergio = (
-                "sergio" in possible_recipient.name.lower()
-                and int(possible_recipient.chat_id) != 5556702448
-            )
 
-            if (participant_is_valen and recipient_is_sergio) or (
-                participant_is_sergio and recipient_is_valen
-            ):
-                possible_recipient = participant
+async def run_draw(job: DrawJob, admin_chat_id: str, broadcaster: Broadcaster) -> None:
+    """Draw, save and announce the pairs, reporting every step to the admin."""
 
-        models.update_participant_recipient(
-            participant=participant,
-            recipient=possible_recipient,
+    bot = broadcaster.bot
+
+    try:
+        assignment = await draw_runner.solve(job)
+
+        job.status = DrawStatus.SAVING
+        if not await models.save_assignment(job.game_id, assignment):
+            raise ValueError("No se guardaron las parejas")
+
+    except InfeasibleAssignment as error:
+        names = {
+            participant.id: participant.name
+            for participant in await models.get_all_participants(job.game_id)
+        }
+
+        # In a big game the list would not fit in a message, and somebody
+        # may have been deleted while the draw ran
+        givers = ", ".join(
+            names.get(giver, str(giver)) for giver in error.givers[:INFEASIBLE_NAMES]
+        )
+        if len(error.givers) > INFEASIBLE_NAMES:
+            givers += f" y {len(error.givers) - INFEASIBLE_NAMES} más"
+
+        await bot.send_message(
+            chat_id=admin_chat_id,
+            text=(
+                "No es posible repartir las parejas con las exclusiones actuales: "
+                f"{givers} solo pueden darle regalo a {len(error.recipients)} "
+                "personas entre todos"
+            ),
         )
+        raise
+
+    except asyncio.CancelledError:
+        raise
+
+    except Exception:
+        await bot.send_message(
+            chat_id=admin_chat_id,
+            text=(
+                "Hubo un error asignando las parejas, por favor intente eliminar "
+                "las parejas con /eliminar_parejas y repartirlas de nuevo con "
+                "/iniciar_juego"
+            ),
+        )
+        raise
+
+    await bot.send_message(chat_id=admin_chat_id, text="¡Se asignaron las parejas!")
+
+    job.status = DrawStatus.NOTIFYING
+    text = (
+        "Ya se te asignó una pareja, para consultar quién te tocó "
+        "inicia una conversación con /hola y pregúntame por tu pareja"
+    )
+    participants = await models.get_all_participants(job.game_id)
+    deliveries = await broadcaster.send(
+        (participant.chat_id, text) for participant in participants
+    )
+
+    not_notified = [
+        participant.name
+        for participant in participants
+        if deliveries[participant.chat_id].status != DeliveryStatus.SENT
+    ]
+
+    if not_notified:
+        await bot.send_message(
+            chat_id=admin_chat_id,
+            text=f"No pude avisarle a estos participantes: {', '.join(not_notified)}",
+        )
+
 
-        participants_copy.remove(possible_recipient)
+async def notify_new_recipients(
+    broadcaster: Broadcaster, game_id: int, givers: List[int]
+) -> None:
+    """Tell the givers whose pair changed after the draw to ask for it."""
+
+    text = (
+        "Hubo un cambio en el juego y ahora tienes otra pareja, para consultar "
+        "quién te tocó inicia una conversación con /hola y pregúntame por tu pareja"
+    )
+    participants = [
+        await models.get_participant(game_id, participant_id=giver) for giver in givers
+    ]
+
+    await broadcaster.send(
+        (participant.chat_id, text) for participant in participants if participant
+    )
 
 
 async def start_game_command(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
-    """Send a message when the command /ayuda is issued."""
+    """Send a message when the command /iniciar_juego is issued."""
 
-    models.clean_recipients()
-    participants = models.get_all_participants()
+    game_id = await get_game_id(update, context)
+
+    if draw_runner.busy(game_id):
+        await reply(
+            update,
+            "Ya se están repartiendo las parejas, puedes ver cómo va con "
+            "/estado_sorteo",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return
+
+    await models.clean_recipients(game_id)
+    participants = await models.get_all_participants(game_id)
 
     if len(participants) < 4:
-        await update.message.reply_text(
+        await reply(
+            update,
             "¡El juego no puede iniciar con menos de 4 personas! "
             "Para consultar la lista de participantes envíe /participantes",
             reply_markup=ReplyKeyboardRemove(),
@@ -132,53 +332,116 @@ async def start_game_command(
 
         return await done_command(update, context)
 
-    await update.message.reply_text(
-        "Repartiendo las parejas...",
+    admin_chat_id = update.effective_chat.id
+    try:
+        draw_runner.submit(
+            game_id,
+            [participant.id for participant in participants],
+            await models.get_exclusion_pairs(game_id),
+            lambda job: run_draw(job, admin_chat_id, context.bot_data["broadcaster"]),
+        )
+    except DrawRunnerClosed:
+        await reply(
+            update,
+            "El bot se está apagando y no puede repartir las parejas ahora. "
+            "Intenta de nuevo con /iniciar_juego en unos minutos",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return
+
+    await reply(
+        update,
+        "Repartiendo las parejas... te avisaré cuando termine. "
+        "Mientras tanto puedes consultar /estado_sorteo o detenerlo con "
+        "/cancelar_sorteo",
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    try:
-        process = Process(target=assign_recipients, args=(participants,))
-        process.start()
-        process.join(60)  # -> Esperar máximo 60 segundos
 
-        if process.is_alive():
-            process.terminate()
-            models.clean_recipients()
+async def draw_status_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Send a message when the command /estado_sorteo is issued."""
 
-            raise ValueError("Timeout asignando las parejas.")
+    job = draw_runner.get(await get_game_id(update, context))
 
-        if any(
-            [
-                participant.recipient_id is None
-                for participant in models.get_all_participants()
-            ]
-        ):
-            raise ValueError("No se asignaron todas las parejas")
+    if job is None:
+        text = "Todavía no se han repartido parejas"
+    else:
+        text = (
+            f"Sorteo de {len(job.ids)} participantes: "
+            f"{DRAW_STATUS_TEXT[job.status]} ({job.elapsed:.1f} s)"
+        )
 
-    except:
-        await update.message.reply_text(
-            "Hubo un error asignando las parejas, por favor intente eliminar "
-            "las parejas con /eliminar_parejas y repartirlas de nuevo con "
-            "/iniciar_juego",
+    await reply(update, text, reply_markup=ReplyKeyboardRemove())
+
+
+async def cancel_draw_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Send a message when the command /cancelar_sorteo is issued."""
+
+    job = draw_runner.get(await get_game_id(update, context))
+
+    if job is None or not job.cancel():
+        await reply(
+            update,
+            "No hay ningún sorteo en curso",
             reply_markup=ReplyKeyboardRemove(),
         )
-        ConversationHandler.END
+        return
 
-    else:
-        await update.message.reply_text(
-            "¡Se asignaron las parejas!",
+    await reply(
+        update,
+        "Se canceló el sorteo. Si alcanzaron a guardarse parejas puedes "
+        "eliminarlas con /eliminar_parejas",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+
+
+async def add_exclusion_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Send a message when the command /excluir_pareja is issued."""
+
+    names = [name.strip() for name in " ".join(context.args).split(",")]
+
+    if len(names) != 2 or not all(names):
+        await reply(
+            update,
+            "Para que dos participantes no se puedan tocar entre ellos envía: "
+            "/excluir_pareja Nombre 1, Nombre 2",
             reply_markup=ReplyKeyboardRemove(),
         )
+        return
 
-        for participant in models.get_all_participants():
-            await context.bot.send_message(
-                chat_id=participant.chat_id,
-                text=(
-                    "Ya se te asignó una pareja, para consultar quién te tocó "
-                    "inicia una conversación con /hola y pregúntame por tu pareja"
-                ),
-            )
+    game_id = await get_game_id(update, context)
+    participants = [
+        await models.get_participant(game_id, participant_name=name) for name in names
+    ]
+
+    if None in participants:
+        await reply(
+            update,
+            "No encontré a alguno de los participantes, revisa los nombres con "
+            "/participantes",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return
+
+    if await models.add_exclusion(*participants):
+        await reply(
+            update,
+            f"Listo, a {names[0]} y {names[1]} no se les asignarán como pareja",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+
+    else:
+        await reply(
+            update,
+            "No se pudo guardar la exclusión, es posible que ya exista",
+            reply_markup=ReplyKeyboardRemove(),
+        )
 
 
 async def get_commands_command(
@@ -188,15 +451,20 @@ async def get_commands_command(
 
     available_commands = (
         "/hola o /start -> Iniciar conversación"
+        "\n/juego -> Ver o cambiar el juego en el que estás"
         "\n/participantes -> Obtener lista de participantes"
         "\n/eliminar_participante -> Eliminar un participante"
         "\n/iniciar_juego -> Repartir las parejas"
+        "\n/estado_sorteo -> Ver cómo va el reparto de parejas"
+        "\n/cancelar_sorteo -> Detener el reparto de parejas"
         "\n/eliminar_parejas -> Eliminar las parejas"
+        "\n/excluir_pareja -> Evitar que dos participantes se toquen"
         "\n/ayuda -> Mensaje de ayuda"
         "\n/comandos -> Este menú con los comandos"
     )
 
-    await update.message.reply_text(
+    await reply(
+        update,
         available_commands,
         reply_markup=ReplyKeyboardRemove(),
     )
@@ -207,23 +475,28 @@ async def clean_recipients_command(
 ) -> None:
     """Send a message when the command /ayuda is issued."""
 
-    if len(models.get_all_participants()) == 1:
-        await update.message.reply_text(
+    game_id = await get_game_id(update, context)
+
+    if await models.count_participants(game_id) == 0:
+        await reply(
+            update,
             f"Todavía no hay participantes",
             reply_markup=ReplyKeyboardRemove(),
         )
         return
 
     try:
-        models.clean_recipients()
+        cleaned = await models.clean_recipients(game_id)
 
-        await update.message.reply_text(
-            f"Se limpiaron todas las parejas",
+        await reply(
+            update,
+            f"Se limpiaron todas las parejas ({cleaned})",
             reply_markup=ReplyKeyboardRemove(),
         )
 
     except:
-        await update.message.reply_text(
+        await reply(
+            update,
             "Parece que ocurrió un error y no se limpiaron todos los participantes. "
             "Por favor revisar manualmente",
             reply_markup=ReplyKeyboardRemove(),
@@ -235,22 +508,27 @@ async def get_all_participants_command(
 ) -> None:
     """Send a message when the command /ayuda is issued."""
 
-    participants = models.get_all_participants()
-    names = [
-        participant.name for participant in participants if participant.name is not None
-    ]
+    game_id = await get_game_id(update, context)
+    total = await models.count_participants(game_id)
 
-    if len(names) == 0:
-        await update.message.reply_text(
+    if total == 0:
+        await reply(
+            update,
             "Todavía no se han registrado participantes",
             reply_markup=ReplyKeyboardRemove(),
         )
+        return
 
-    else:
-        await update.message.reply_text(
-            f"Por ahora hay {len(names)} participantes: {', '.join(names)}",
-            reply_markup=ReplyKeyboardRemove(),
-        )
+    # Big games do not fit in one message. The messages are full already, so
+    # they go out as they fill up instead of waiting with the other replies
+    chunker = MessageChunker(prefix=f"Por ahora hay {total} participantes: ")
+
+    async for names in models.iter_participant_names(game_id):
+        for message in chunker.add(names):
+            await update.message.reply_text(message, reply_markup=ReplyKeyboardRemove())
+
+    for message in chunker.flush():
+        await update.message.reply_text(message, reply_markup=ReplyKeyboardRemove())
 
 
 async def delete_participant_command(
@@ -258,80 +536,192 @@ async def delete_participant_command(
 ) -> None:
     """Send a message when the command /ayuda is issued."""
 
-    participants = models.get_all_participants()
-
-    names = [
-        participant.name for participant in participants if participant.name is not None
-    ]
+    entries = await models.get_name_index(await get_game_id(update, context))
 
-    if len(names) == 0:
-        await update.message.reply_text(
+    if len(entries) == 0:
+        await reply(
+            update,
             "Todavía no se han registrado participantes",
             reply_markup=ReplyKeyboardRemove(),
         )
 
         return
 
-    await update.message.reply_text(
+    context.chat_data.participant_to_delete = None
+
+    await reply(
+        update,
         "Por favor selecciona el participante a eliminar",
-        reply_markup=create_keyboard(options=names),
+        reply_markup=create_page_keyboard(entries, 0, "delete"),
     )
 
     return settings.DELETE_PARTICIPANT
 
 
-async def register_participant(
+async def delete_participant_page_callback(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
-    """Save the participant name and chat_id on database."""
+    """Show another page of the participants to delete."""
 
-    name = update.message.text
-    chat_id = update.effective_chat.id
-    new_participant = Participant(chat_id=chat_id, name=name)
+    query = update.callback_query
+    page = int(query.data.rsplit(":", 1)[1])
+    entries = await models.get_name_index(await get_game_id(update, context))
 
-    try:
-        with Session() as session:
-            exists = (
-                session.query(Participant)
-                .filter(func.lower(Participant.name) == name.lower())
-                .all()
+    await query.answer()
+    await query.edit_message_reply_markup(
+        reply_markup=create_page_keyboard(entries, page, "delete")
+    )
+
+    return settings.DELETE_PARTICIPANT
+
+
+async def delete_participant_pick_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    """Ask to confirm the participant picked from the list."""
+
+    query = update.callback_query
+    participant = await models.get_participant(
+        await get_game_id(update, context),
+        participant_id=int(query.data.rsplit(":", 1)[1]),
+    )
+
+    await query.answer()
+
+    if participant is None:
+        await reply(
+            update,
+            "Ese participante ya no está en el juego",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+
+        return ConversationHandler.END
+
+    context.chat_data.participant_to_delete = participant.name
+
+    await reply(
+        update,
+        f"¿Seguro que quieres eliminar al participante {participant.name}?",
+        reply_markup=create_keyboard(["Si", "No"]),
+    )
+
+    return settings.CONFIRM_DELETE_PARTICIPANT
+
+
+async def search_participant_inline(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Answer "@bot <name>" with the participants that match it.
+
+    Picking one sends their name to the chat, so it works wherever a name
+    is expected, like when deleting a participant.
+    """
+
+    query = update.inline_query
+
+    # Inline queries come without a chat; use the user's private chat
+    chat_data = context.application.chat_data.get(query.from_user.id)
+    game_id = chat_data.game_id if chat_data is not None else None
+    if game_id is None:
+        game_id = await models.get_chat_game_id(query.from_user.id)
+    if game_id is None:
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+    # Remembered like get_game_id does, the user types a query per keystroke
+    if chat_data is not None:
+        chat_data.game_id = game_id
+
+    if query.query.strip():
+        entries = await models.search_participant_names(
+            game_id, query.query, limit=settings.INLINE_RESULTS
+        )
+    else:
+        entries = (await models.get_name_index(game_id))[: settings.INLINE_RESULTS]
+
+    await query.answer(
+        [
+            InlineQueryResultArticle(
+                id=str(participant_id),
+                title=name,
+                input_message_content=InputTextMessageContent(name),
             )
+            for _, name, participant_id in entries
+        ],
+        cache_time=0,
+        is_personal=True,
+    )
 
-        if exists:
-            raise ValueError("Name is already taken.")
 
-        session.add(new_participant)
-        session.commit()
+async def expired_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer buttons of lists whose conversation already ended."""
 
-    except (IntegrityError, ValueError):
-        try:
-            session.rollback()
-        except Exception:
-            pass
+    await update.callback_query.answer(
+        "Esta lista ya no está activa, envía el comando de nuevo"
+    )
+
+
+async def register_participant(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    """Save the participant name and chat_id on database."""
+
+    name = update.message.text
+    chat_id = update.effective_chat.id
 
-        await update.message.reply_text(
+    game_id = await get_game_id(update, context)
+
+    if not await models.create_participant(game_id, chat_id=chat_id, name=name):
+        await reply(
+            update,
             "Parece ser que ya alguien se registró con ese nombre",
             reply_markup=ReplyKeyboardRemove(),
         )
-        await update.message.reply_text(
+        await reply(
+            update,
             f"¿Me podrías indicar tu nombre completo?",
             reply_markup=ReplyKeyboardRemove(),
         )
 
         return settings.TYPING_NAME
 
-    else:
-        await update.message.reply_text(
-            f"Muchas gracias {name}, te acabo de registrar en el juego",
-            reply_markup=ReplyKeyboardRemove(),
-        )
+    await reply(
+        update,
+        f"Muchas gracias {name}, te acabo de registrar en el juego",
+        reply_markup=ReplyKeyboardRemove(),
+    )
 
-        await update.message.reply_text(
-            "¿Qué quieres hacer?",
-            reply_markup=create_keyboard(),
-        )
+    # When the pairs were already drawn, make room in the draw
+    if not draw_runner.busy(game_id):
+        participant = await models.get_participant(game_id, chat_id=chat_id)
+        repair = await models.add_to_draw(game_id, participant.id)
+
+        if repair.changes:
+            await notify_new_recipients(
+                context.bot_data["broadcaster"],
+                game_id,
+                [giver for giver in repair.changes if giver != participant.id],
+            )
+            await reply(
+                update,
+                "Las parejas ya se habían repartido, pero ya te asigné una, "
+                "pregúntame por tu pareja cuando quieras",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+        elif repair.redraw:
+            await reply(
+                update,
+                "Las parejas ya se habían repartido y no pude asignarte una, "
+                "pídele al organizador que las reparta de nuevo",
+                reply_markup=ReplyKeyboardRemove(),
+            )
 
-        return settings.CHOOSING
+    await reply(
+        update,
+        "¿Qué quieres hacer?",
+        reply_markup=create_keyboard(),
+    )
+
+    return settings.CHOOSING
 
 
 async def choice_reply_handler(
@@ -340,15 +730,15 @@ async def choice_reply_handler(
     """Ask the user for info about the selected predefined choice."""
 
     user_choice = update.message.text
-    context.bot_data["choice"] = user_choice
+    context.chat_data.choice = user_choice
 
-    participant = models.get_participant(chat_id=update.effective_chat.id)
+    participant = await models.get_participant(
+        await get_game_id(update, context), chat_id=update.effective_chat.id
+    )
 
     if user_choice in settings.conv_enders or participant is None:
         return await done_command(update, context)
 
-    participant = models.get_participant(chat_id=update.effective_chat.id)
-
     preferences = (
         f'tus preferencias son:\n"{participant.preferences}"'
         if participant.preferences is not None and len(participant.preferences) > 0
@@ -356,13 +746,15 @@ async def choice_reply_handler(
     )
 
     if user_choice == settings.KeyboardOptions.GET_PARTICIPANT.value:
-        await update.message.reply_text(
+        await reply(
+            update,
             f"Te llamas {participant.name} y {preferences}",
             reply_markup=ReplyKeyboardRemove(),
         )
 
     elif user_choice == settings.KeyboardOptions.EDIT_NAME.value:
-        await update.message.reply_text(
+        await reply(
+            update,
             "¿Me puedes decir cuál es tu nuevo nombre?",
             reply_markup=ReplyKeyboardRemove(),
         )
@@ -370,19 +762,22 @@ async def choice_reply_handler(
         return settings.TYPING_REPLY
 
     elif user_choice == settings.KeyboardOptions.EDIT_PREFS.value:
-        await update.message.reply_text(
+        await reply(
+            update,
             "En tus preferencias puedes indicar cosas como tu talla de ropa o de zapatos,"
             "o si tienes alguna preferencia en particular que pueda interesar "
             "a la persona que te tiene",
             reply_markup=ReplyKeyboardRemove(),
         )
 
-        await update.message.reply_text(
+        await reply(
+            update,
             preferences.capitalize(),
             reply_markup=ReplyKeyboardRemove(),
         )
 
-        await update.message.reply_text(
+        await reply(
+            update,
             "¿Me puedes decir cuáles son tus nuevas preferencias?",
             reply_markup=ReplyKeyboardRemove(),
         )
@@ -390,10 +785,11 @@ async def choice_reply_handler(
         return settings.TYPING_REPLY
 
     elif user_choice == settings.KeyboardOptions.GET_RECIPIENT.value:
-        recipient = models.get_participant_recipient(participant=participant)
+        recipient = await models.get_participant_recipient(participant=participant)
 
         if recipient is None:
-            await update.message.reply_text(
+            await reply(
+                update,
                 "Todavía no se han asignado las parejas",
                 reply_markup=ReplyKeyboardRemove(),
             )
@@ -405,33 +801,39 @@ async def choice_reply_handler(
                 else "todavía no tiene preferencias"
             )
 
-            await update.message.reply_text(
+            await reply(
+                update,
                 "Recuerda no decirle a nadie 🤫",
                 reply_markup=ReplyKeyboardRemove(),
             )
-            await update.message.reply_text(
+            await reply(
+                update,
                 f"Tu pareja es {recipient.name} y {preferences}",
                 reply_markup=ReplyKeyboardRemove(),
             )
 
     elif user_choice == settings.KeyboardOptions.INSTRUCTIONS.value:
-        await update.message.reply_text(
+        await reply(
+            update,
             settings.GAME_RULES,
             reply_markup=ReplyKeyboardRemove(),
         )
 
     else:
-        await update.message.reply_text(
+        await reply(
+            update,
             "Lo siento, no entiendo lo que dijiste"
             "¿Puedes seleccionar una de las opciones disponibles?",
             reply_markup=ReplyKeyboardRemove(),
         )
-        await update.message.reply_text(
+        await reply(
+            update,
             "También puedes decir /ayuda para ver las opciones disponibles",
             reply_markup=create_keyboard(),
         )
 
-    await update.message.reply_text(
+    await reply(
+        update,
         "¿Quieres hacer algo más?",
         reply_markup=create_keyboard(),
     )
@@ -458,51 +860,84 @@ async def delete_participant_handler(
     """Send a message when the command /ayuda is issued."""
 
     usr_response = update.message.text
-    participant_to_delete = context.bot_data.get("participant_to_delete")
+    participant_to_delete = context.chat_data.participant_to_delete
 
-    participants = models.get_all_participants()
-    names = [
-        participant.name for participant in participants if participant.name is not None
-    ]
-
-    if usr_response in settings.conv_enders or (
-        usr_response not in names and usr_response.lower() not in ["si", "no"]
-    ):
+    if usr_response in settings.conv_enders:
         return await done_command(update, context)
 
     if not participant_to_delete:
-        context.bot_data["participant_to_delete"] = usr_response
+        game_id = await get_game_id(update, context)
+        entry = await models.find_participant_name(game_id, usr_response)
+
+        if entry is None:
+            matches = await models.search_participant_names(game_id, usr_response)
+
+            if not matches:
+                return await done_command(update, context)
+
+            await reply(
+                update,
+                f"No encontré a {usr_response}, ¿es alguno de estos?",
+                reply_markup=create_page_keyboard(matches, 0, "delete"),
+            )
+
+            return settings.DELETE_PARTICIPANT
 
-        await update.message.reply_text(
-            f"¿Seguro que quieres eliminar al participante {usr_response}?",
+        _, name, _ = entry
+        context.chat_data.participant_to_delete = name
+
+        await reply(
+            update,
+            f"¿Seguro que quieres eliminar al participante {name}?",
             reply_markup=create_keyboard(["Si", "No"]),
         )
 
         return settings.CONFIRM_DELETE_PARTICIPANT
 
+    game_id = await get_game_id(update, context)
+
     try:
-        chat_id = models.get_participant(participant_name=participant_to_delete).chat_id
-        deleted = models.delete_participant(participant_name=participant_to_delete)
-        models.clean_recipients()
-    except:
-        deleted = False
+        repair = await models.remove_participant(
+            game_id, participant_name=participant_to_delete
+        )
     finally:
-        context.bot_data["participant_to_delete"] = None
+        context.chat_data.participant_to_delete = None
 
-    if deleted:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Fuiste eliminado del juego, si tienes dudas por favor contacta a Maria Fernanda",
+    if repair is not None:
+        # The givers have to hear about their new recipient even if the
+        # removed participant blocked the bot
+        await notify_new_recipients(
+            context.bot_data["broadcaster"], game_id, repair.changes
         )
 
-        await update.message.reply_text(
+        try:
+            await context.bot.send_message(
+                chat_id=repair.chat_id,
+                text="Fuiste eliminado del juego, si tienes dudas por favor contacta a Maria Fernanda",
+            )
+        except TelegramError as error:
+            logger.warning(
+                "Could not tell %s they were removed: %s", repair.chat_id, error
+            )
+
+        await reply(
+            update,
             f"El participante {participant_to_delete} fue eliminado. "
             "Si se quiere registrar nuevamente deberá mandar /hola al bot",
             reply_markup=ReplyKeyboardRemove(),
         )
 
+        if repair.redraw:
+            await reply(
+                update,
+                "No pude acomodar las parejas sin esta persona, así que las "
+                "eliminé. Repártelas de nuevo con /iniciar_juego",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+
     else:
-        await update.message.reply_text(
+        await reply(
+            update,
             "Hubo un error desconocido y el participante no se eliminó.",
             reply_markup=ReplyKeyboardRemove(),
         )
@@ -514,50 +949,51 @@ async def typing_response_handler(
     """Send a message when the command /ayuda is issued."""
 
     chat_id = update.effective_chat.id
-    choice = context.bot_data["choice"]
+    choice = context.chat_data.choice
     usr_response = update.message.text
 
-    participant = models.get_participant(chat_id=chat_id)
+    participant = await models.get_participant(
+        await get_game_id(update, context), chat_id=chat_id
+    )
 
     updated_reply = "Muchas gracias {}, acabo de actualizar {} en el juego"
 
+    error_reply = (
+        "Disculpa, parece que hubo un pequeño error, "
+        "¿Puedes intentar otra vez por favor?"
+    )
+
     if choice == settings.KeyboardOptions.EDIT_NAME.value:
         participant.name = usr_response
-        models.update_participant(participant)
 
-        updated_reply = updated_reply.format(participant.name, "tu nombre")
+        # The name is unique in the game, however it is written
+        if await models.update_participant(participant):
+            updated_reply = updated_reply.format(participant.name, "tu nombre")
+        else:
+            updated_reply = "Parece ser que ya alguien se registró con ese nombre"
 
     elif choice == settings.KeyboardOptions.EDIT_PREFS.value:
         participant.preferences = usr_response
-        models.update_participant(participant)
 
-        updated_reply = updated_reply.format(participant.name, "tus preferencias")
-
-        participant_whose_recipient_is_participant = (
-            models.get_participant_whose_recipient_is_participant(participant)
-        )
+        if await models.update_participant(participant):
+            updated_reply = updated_reply.format(participant.name, "tus preferencias")
 
-        if participant_whose_recipient_is_participant is not None:
-            await context.bot.send_message(
-                chat_id=participant_whose_recipient_is_participant.chat_id,
-                text=(
-                    "Tu pareja acaba de actualizar sus preferencias, "
-                    "puedes consultarlas diciendo /hola y luego en la opción de "
-                    "Ver mi pareja"
-                ),
+            context.bot_data["preference_notices"].add(
+                participant.id, participant.game_id
             )
+        else:
+            updated_reply = error_reply
     else:
-        updated_reply = (
-            "Disculpa, parece que hubo un pequeño error, "
-            "¿Puedes intentar otra vez por favor?"
-        )
+        updated_reply = error_reply
 
-    await update.message.reply_text(
+    await reply(
+        update,
         updated_reply,
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    await update.message.reply_text(
+    await reply(
+        update,
         "¿Quieres hacer algo más?",
         reply_markup=create_keyboard(),
     )
@@ -570,11 +1006,13 @@ async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     new_message = re_sub("[aeiouAEIOU]", "i", update.message.text)
 
-    await update.message.reply_text(
+    await reply(
+        update,
         new_message,
         reply_markup=ReplyKeyboardRemove(),
     )
-    await update.message.reply_text(
+    await reply(
+        update,
         "Para iniciar una nueva conversación envía un mensaje diciendo: /hola",
         reply_markup=ReplyKeyboardRemove(),
     )
@@ -586,20 +1024,98 @@ async def get_database_path(
     """Send a message when the command /ayuda is issued."""
 
 
-    await update.message.reply_text(
+    await reply(
+        update,
         f"La base de datos está ubicada en: {DATABASE_URL}",
         reply_markup=ReplyKeyboardRemove(),
     )
 
 
-def main() -> None:
-    """Start the bot."""
-    global TOKEN
+async def notify_preference_changes(
+    broadcaster: Broadcaster, changes: Dict[int, int]
+) -> None:
+    """Tell the givers of the participants who changed their preferences.
 
-    Base.metadata.create_all(engine)
+    `changes` maps the participants' ids to their games.
+    """
+
+    text = (
+        "Tu pareja acaba de actualizar sus preferencias, "
+        "puedes consultarlas diciendo /hola y luego en la opción de "
+        "Ver mi pareja"
+    )
+    chat_ids = []
+
+    for participant_id, game_id in changes.items():
+        participant = await models.get_participant(
+            game_id, participant_id=participant_id
+        )
+        giver = (
+            await models.get_participant_whose_recipient_is_participant(participant)
+            if participant is not None
+            else None
+        )
+
+        if giver is not None:
+            chat_ids.append(giver.chat_id)
+
+    await broadcaster.send((chat_id, text) for chat_id in chat_ids)
+
+
+async def post_init(app: Application) -> None:
+    """Start serving the metrics, when they are served."""
+
+    if "metrics_server" in app.bot_data:
+        await app.bot_data["metrics_server"].start()
+
+
+async def post_stop(app: Application) -> None:
+    """Send the pending notices while the bot can still send."""
+
+    await app.bot_data["preference_notices"].shutdown()
+
+    if "metrics_server" in app.bot_data:
+        await app.bot_data["metrics_server"].stop()
+
+
+async def post_shutdown(app: Application) -> None:
+    """Stop the draw workers when the bot stops."""
+
+    draw_runner.shutdown()
 
-    # Create the Application and pass it your bot's token.
-    app = Application.builder().token(TOKEN).build()
+
+def build_application(builder: ApplicationBuilder) -> Application:
+    """Build the bot's Application with all its handlers.
+
+    `builder` carries the token and transport, so the load tests can run the
+    same handlers against a local fake of Telegram.
+    """
+
+    app = (
+        builder.application_class(ComposingApplication)
+        .context_types(ContextTypes(chat_data=ChatState))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    # Every bulk send shares one broadcaster, and so Telegram's bot-wide limit
+    broadcaster = app.bot_data["broadcaster"] = Broadcaster(app.bot)
+    app.bot_data["preference_notices"] = Debouncer(
+        PREFERENCES_NOTICE_DELAY, partial(notify_preference_changes, broadcaster)
+    )
+
+    # Floods are shed before any handler touches the database
+    flood_control = app.bot_data["flood_control"] = FloodControl(
+        chat_rate=CHAT_UPDATE_RATE,
+        chat_burst=CHAT_UPDATE_BURST,
+        global_rate=GLOBAL_UPDATE_RATE,
+        max_delay=FLOOD_MAX_DELAY,
+    )
+    app.add_handler(TypeHandler(Update, flood_control.check), FLOOD_CONTROL_GROUP)
+
+    # The conversation states survive restarts when the app has a persistence
+    persistent = app.persistence is not None
 
     keyboard_options_reg = "|".join(
         [option.value for option in list(settings.KeyboardOptions)]
@@ -644,39 +1160,64 @@ def main() -> None:
         },
         fallbacks=[MessageHandler(filters.Regex(f"^{conv_enders_reg}$"), done_command)],
         allow_reentry=True,
+        name="main",
+        persistent=persistent,
     )
 
-    # Add delete participant conversation handler
-    conv_handler_delete_participant = ConversationHandler(
-        entry_points=[
-            CommandHandler("eliminar_participante", delete_participant_command)
-        ],
-        states={
-            settings.DELETE_PARTICIPANT: [
-                MessageHandler(
-                    filters.TEXT
-                    & ~(filters.COMMAND | filters.Regex(f"^{conv_enders_reg}$")),
-                    delete_participant_handler,
-                ),
+    # Add delete participant conversation handler. The state is per chat and
+    # user, not per message: the keyboard is paged by editing one message and
+    # the pick is confirmed by typing, so per_message=True would lose track
+    # of the text replies. PTB warns about exactly this combination.
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+            "ignore",
+            message="If 'per_message=False'",
+            category=PTBUserWarning,
+        )
+        conv_handler_delete_participant = ConversationHandler(
+            entry_points=[
+                CommandHandler("eliminar_participante", delete_participant_command)
             ],
-            settings.CONFIRM_DELETE_PARTICIPANT: [
-                MessageHandler(
-                    filters.TEXT
-                    & ~(filters.COMMAND | filters.Regex(f"^{conv_enders_reg}$")),
-                    confirm_delete_participant,
-                ),
+            states={
+                settings.DELETE_PARTICIPANT: [
+                    CallbackQueryHandler(
+                        delete_participant_page_callback, pattern=r"^delete:page:\d+$"
+                    ),
+                    CallbackQueryHandler(
+                        delete_participant_pick_callback, pattern=r"^delete:pick:\d+$"
+                    ),
+                    MessageHandler(
+                        filters.TEXT
+                        & ~(filters.COMMAND | filters.Regex(f"^{conv_enders_reg}$")),
+                        delete_participant_handler,
+                    ),
+                ],
+                settings.CONFIRM_DELETE_PARTICIPANT: [
+                    MessageHandler(
+                        filters.TEXT
+                        & ~(filters.COMMAND | filters.Regex(f"^{conv_enders_reg}$")),
+                        confirm_delete_participant,
+                    ),
+                ],
+            },
+            fallbacks=[
+                MessageHandler(filters.Regex(f"^{conv_enders_reg}$"), done_command)
             ],
-        },
-        fallbacks=[MessageHandler(filters.Regex(f"^{conv_enders_reg}$"), done_command)],
-        allow_reentry=True,
-    )
+            allow_reentry=True,
+            name="delete_participant",
+            persistent=persistent,
+        )
 
     app.add_handler(conv_handler)
     app.add_handler(conv_handler_delete_participant)
 
+    app.add_handler(CommandHandler("juego", game_command))
     app.add_handler(CommandHandler("participantes", get_all_participants_command))
     app.add_handler(CommandHandler("iniciar_juego", start_game_command))
+    app.add_handler(CommandHandler("estado_sorteo", draw_status_command))
+    app.add_handler(CommandHandler("cancelar_sorteo", cancel_draw_command))
     app.add_handler(CommandHandler("eliminar_parejas", clean_recipients_command))
+    app.add_handler(CommandHandler("excluir_pareja", add_exclusion_command))
     app.add_handler(CommandHandler("ayuda", help_command))
     app.add_handler(CommandHandler("comandos", get_commands_command))
     app.add_handler(CommandHandler("get_database", get_database_path))
@@ -687,10 +1228,91 @@ def main() -> None:
             echo,
         )
     )
+    app.add_handler(CallbackQueryHandler(expired_callback))
+    app.add_handler(InlineQueryHandler(search_participant_inline))
+
+    instrument_handlers(app, metrics, settings.STATE_NAMES)
+
+    notices = app.bot_data["preference_notices"]
+    metrics.gauges(
+        "flood_control",
+        "Updates admitted and dropped by flood control",
+        flood_control.stats,
+    )
+    metrics.gauges(
+        "preference_notices",
+        "Notices about changed preferences waiting to be sent",
+        lambda: {"pending": len(notices), "merged": notices.merged},
+    )
+    metrics.gauges("participant_cache", "Participant cache lookups", models.cache.stats)
+
+    if isinstance(app.update_processor, ChatUpdateProcessor):
+        metrics.gauges(
+            "update_processor",
+            "Updates running and waiting for a slot",
+            app.update_processor.stats,
+        )
+
+    return app
+
+
+def main() -> None:
+    """Start the bot."""
+    global TOKEN
+
+    Base.metadata.create_all(engine)
+    upgrade(engine, settings.DEFAULT_GAME_NAME)
+
+    # Start the draw workers before the first /iniciar_juego needs them
+    draw_runner.start()
+
+    # Every statement and Bot API call of the bot is timed
+    QueryMetrics(metrics, slow=SLOW_QUERY_SECONDS).attach(async_engine.sync_engine)
+
+    # Create the Application and pass it your bot's token.
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .request(InstrumentedRequest(HTTPXRequest(connection_pool_size=256), metrics))
+        .concurrent_updates(ChatUpdateProcessor(UPDATE_PARALLELISM))
+        .persistence(SQLitePersistence(update_interval=PERSISTENCE_INTERVAL))
+    )
+
+    if WEBHOOK_URL:
+        # Past WEBHOOK_QUEUE_SIZE updates queued or being handled the server
+        # answers 503 so Telegram retries
+        builder = builder.update_queue(UpdateQueue(WEBHOOK_QUEUE_SIZE))
+
+    app = build_application(builder)
+
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = MetricsServer(
+            app, metrics, listen=METRICS_LISTEN, port=int(METRICS_PORT)
+        )
 
     # Run the bot until the user presses Ctrl-C
     print("App started")
-    app.run_polling(allowed_updates=Update.ALL_TYPES, timeout=120)
+
+    if WEBHOOK_URL:
+        server = WebhookServer(
+            app,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+        )
+        metrics.gauges(
+            "webhook",
+            "Updates Telegram posted to the webhook",
+            lambda: {"received": server.received, "rejected": server.rejected},
+        )
+        asyncio.run(
+            run_webhook(
+                app, server, WEBHOOK_URL, max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        )
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES, timeout=120)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+from random import Random
+from typing import Dict, Hashable, List, Sequence
+
+_default_rng = Random()
+
+
+def _check_ids(ids: Sequence[Hashable]) -> List[Hashable]:
+    ids = list(ids)
+
+    if len(ids) < 2:
+        raise ValueError("At least two participants are needed for a draw.")
+
+    if len(set(ids)) != len(ids):
+        raise ValueError("Participant ids must be unique.")
+
+    return ids
+
+
+def single_cycle(
+    ids: Sequence[Hashable], rng: Random = None
+) -> Dict[Hashable, Hashable]:
+    """Return a uniformly random single loop giver -> recipient (Sattolo)."""
+
+    rng = rng or _default_rng
+    ids = _check_ids(ids)
+    perm = list(range(len(ids)))
+
+    for i in range(len(perm) - 1, 0, -1):
+        j = rng.randrange(i)
+        perm[i], perm[j] = perm[j], perm[i]
+
+    return {ids[giver]: ids[recipient] for giver, recipient in enumerate(perm)}
+
+
+def derangement(
+    ids: Sequence[Hashable], rng: Random = None
+) -> Dict[Hashable, Hashable]:
+    """Return a uniformly random giver -> recipient derangement.
+
+    Uses the algorithm of Martínez, Panholzer and Prodinger, which runs in
+    expected linear time and, unlike picking recipients one by one, can never
+    get stuck without a valid recipient.
+    """
+
+    rng = rng or _default_rng
+    ids = _check_ids(ids)
+    n = len(ids)
+
+    # close[u] = (u - 1) * D(u - 2) / D(u) is the probability of closing a
+    # cycle when u items are left, D(u) being the number of derangements of u
+    # items. Computed through the ratio D(u - 1) / D(u - 2) so it does not
+    # overflow for big games.
+    close = [0.0] * (n + 1)
+    close[2] = 1.0
+    ratio = 2.0  # D(3) / D(2)
+    for u in range(4, n + 1):
+        close[u] = 1 / (1 + ratio)
+        ratio = (u - 1) * (1 + 1 / ratio)
+
+    perm = list(range(n))
+    marked = [False] * n
+    i = n - 1
+    unmarked = n
+
+    while unmarked >= 2:
+        if not marked[i]:
+            j = rng.randrange(i)
+            while marked[j]:
+                j = rng.randrange(i)
+
+            perm[i], perm[j] = perm[j], perm[i]
+
+            if rng.random() < close[unmarked]:
+                marked[j] = True
+                unmarked -= 1
+
+            unmarked -= 1
+
+        i -= 1
+
+    return {ids[giver]: ids[recipient] for giver, recipient in enumerate(perm)}
+
+
+def assign(
+    ids: Sequence[Hashable], single_loop: bool = False, rng: Random = None
+) -> Dict[Hashable, Hashable]:
+    """Pair every participant id with a recipient id other than itself."""
+
+    if single_loop:
+        return single_cycle(ids, rng=rng)
+
+    return derangement(ids, rng=rng)
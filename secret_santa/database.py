@@ -1,9 +1,13 @@
 from os import getenv
 from pathlib import Path
+from typing import Dict
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 
 load_dotenv()
@@ -11,14 +15,77 @@ load_dotenv()
 # Environment variables
 PROJECT_DIR = Path(__file__).resolve().parent.parent
 DATABASE_NAME = getenv("DATABASE_NAME")
+DATABASE_POOL_SIZE = int(getenv("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(getenv("DATABASE_MAX_OVERFLOW", 10))
 
 DATABASE_URL = f"sqlite:///{PROJECT_DIR / DATABASE_NAME}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{PROJECT_DIR / DATABASE_NAME}"
+
+# SQLite performance profile, applied to every new connection. WAL lets
+# readers and the writer work at the same time, NORMAL only syncs at
+# checkpoints (safe with WAL), and busy_timeout waits for the lock instead of
+# failing with "database is locked".
+SQLITE_PRAGMAS = {
+    "journal_mode": getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(getenv("SQLITE_BUSY_TIMEOUT", 5000)),  # ms
+    "cache_size": int(getenv("SQLITE_CACHE_SIZE", -64000)),  # KiB when negative
+    "mmap_size": int(getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),  # bytes
+    "temp_store": getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+def set_sqlite_pragmas(engine: Engine, pragmas: Dict[str, object] = None) -> None:
+    """Run the PRAGMA statements on every new connection of the engine."""
+
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+        cursor.close()
+
+
+class QueryCounter:
+    """Count the statements an engine runs while the counter is active.
+
+    with QueryCounter(async_engine.sync_engine) as counter:
+        ...
+    counter.count
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def _on_execute(
+        self, connection, cursor, statement, parameters, context, executemany
+    ):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
 
 # SQLAlchemy
 engine = create_engine(
     url=DATABASE_URL,
     connect_args={"check_same_thread": False},
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_pre_ping=True,
 )
+set_sqlite_pragmas(engine)
 
 Session = sessionmaker(
     bind=engine,
@@ -26,4 +93,21 @@ Session = sessionmaker(
     autoflush=False,
 )
 
+# Used by the bot handlers so database calls do not block the event loop.
+# aiosqlite opens a new connection and thread per session unless it is pooled.
+async_engine = create_async_engine(
+    url=ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_pre_ping=True,
+)
+set_sqlite_pragmas(async_engine.sync_engine)
+
+AsyncSession = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
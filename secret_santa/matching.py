@@ -0,0 +1,286 @@
+from random import Random
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+from secret_santa.assignment import derangement
+
+_default_rng = Random()
+
+
+class InfeasibleAssignment(ValueError):
+    """The exclusion rules leave a group of givers with too few recipients."""
+
+    def __init__(self, givers: List[Hashable], recipients: List[Hashable]):
+        self.givers = givers
+        self.recipients = recipients
+
+        super().__init__(
+            f"{len(givers)} participants can only give to {len(recipients)} "
+            "participants, the exclusion rules cannot be satisfied."
+        )
+
+    def __reduce__(self):
+        # Keeps the error intact when a draw runs on another process
+        return (InfeasibleAssignment, (self.givers, self.recipients))
+
+
+def _layers(
+    free: List[int], forbidden: List[Set[int]], match_recipient: List[int]
+) -> List[List[int]]:
+    """Build the Hopcroft-Karp layers from the free givers.
+
+    Returns the recipients found from each layer of givers, or None when no
+    augmenting path exists. The allowed graph is nearly complete, so instead
+    of walking edges it keeps the set of recipients not seen yet: every check
+    either discovers a recipient or hits an exclusion, which keeps each phase
+    in O(n + number of exclusions).
+    """
+
+    unvisited = set(range(len(forbidden)))
+    buckets = []
+    frontier = free
+
+    while frontier and unvisited:
+        bucket = []
+        next_frontier = []
+        found_free = False
+
+        for giver in frontier:
+            for recipient in list(unvisited):
+                if recipient in forbidden[giver]:
+                    continue
+
+                unvisited.remove(recipient)
+                bucket.append(recipient)
+
+                if match_recipient[recipient] is None:
+                    found_free = True
+                else:
+                    next_frontier.append(match_recipient[recipient])
+
+        buckets.append(bucket)
+
+        if found_free:
+            return buckets
+
+        frontier = next_frontier
+
+    return None
+
+
+def _augment(
+    giver: int,
+    buckets: List[List[int]],
+    forbidden: List[Set[int]],
+    match_giver: List[int],
+    match_recipient: List[int],
+) -> bool:
+    """Look for one augmenting path from a free giver through the layers."""
+
+    last = len(buckets) - 1
+    stack = [(giver, [])]
+    path = []
+
+    while stack:
+        layer = len(stack) - 1
+        current, skipped = stack[-1]
+        bucket = buckets[layer]
+        recipient = None
+
+        while bucket:
+            candidate = bucket.pop()
+
+            if candidate in forbidden[current]:
+                skipped.append(candidate)
+                continue
+
+            if match_recipient[candidate] is None or layer < last:
+                recipient = candidate
+                break
+
+        if recipient is None:
+            # Dead end, the excluded recipients are left for other givers
+            bucket.extend(skipped)
+            stack.pop()
+            if path:
+                path.pop()
+            continue
+
+        path.append(recipient)
+
+        if match_recipient[recipient] is None:
+            for depth, (path_giver, path_skipped) in enumerate(stack):
+                match_giver[path_giver] = path[depth]
+                match_recipient[path[depth]] = path_giver
+                buckets[depth].extend(path_skipped)
+
+            return True
+
+        stack.append((match_recipient[recipient], []))
+
+    return False
+
+
+def _hall_violation(
+    giver: int, forbidden: List[Set[int]], match_giver: List[int]
+) -> Tuple[List[int], List[int]]:
+    """Return the givers reachable from an unmatched giver and their recipients.
+
+    With a maximum matching every reachable recipient is taken, so this is a
+    set of givers with fewer allowed recipients than members.
+    """
+
+    unvisited = set(range(len(forbidden)))
+    givers = [giver]
+    recipients = []
+    match_recipient = {
+        recipient: owner
+        for owner, recipient in enumerate(match_giver)
+        if recipient is not None
+    }
+
+    for current in givers:
+        for recipient in list(unvisited):
+            if recipient in forbidden[current]:
+                continue
+
+            unvisited.remove(recipient)
+            recipients.append(recipient)
+            givers.append(match_recipient[recipient])
+
+    return givers, recipients
+
+
+def solve(
+    ids: Sequence[Hashable],
+    exclusions: Iterable[Tuple[Hashable, Hashable]] = (),
+    rng: Random = None,
+) -> Dict[Hashable, Hashable]:
+    """Return a random giver -> recipient assignment that follows the rules.
+
+    `exclusions` are (giver, recipient) pairs that must not be drawn. The draw
+    starts from a random derangement and repairs the pairs that break a rule
+    with Hopcroft-Karp, so it either returns a valid assignment or raises
+    InfeasibleAssignment right away with the group of givers at fault.
+    """
+
+    rng = rng or _default_rng
+
+    # Random labels, so the index order carries no bias into the matching
+    ids = list(ids)
+    rng.shuffle(ids)
+    n = len(ids)
+    index = {participant_id: i for i, participant_id in enumerate(ids)}
+
+    forbidden = [{i} for i in range(n)]
+    for giver, recipient in exclusions:
+        if giver in index and recipient in index:
+            forbidden[index[giver]].add(index[recipient])
+
+    # Cheapest Hall checks: somebody who can give to nobody, or receive from
+    # nobody
+    blocked_givers = [0] * n
+    for giver in range(n):
+        if len(forbidden[giver]) == n:
+            raise InfeasibleAssignment([ids[giver]], [])
+
+        for recipient in forbidden[giver]:
+            blocked_givers[recipient] += 1
+
+    for recipient in range(n):
+        if blocked_givers[recipient] == n:
+            raise InfeasibleAssignment(
+                ids, [ids[other] for other in range(n) if other != recipient]
+            )
+
+    match_giver = [None] * n
+    match_recipient = [None] * n
+
+    for giver, recipient in derangement(range(n), rng=rng).items():
+        if recipient not in forbidden[giver]:
+            match_giver[giver] = recipient
+            match_recipient[recipient] = giver
+
+    while True:
+        free = [giver for giver in range(n) if match_giver[giver] is None]
+
+        if not free:
+            break
+
+        buckets = _layers(free, forbidden, match_recipient)
+
+        if buckets is None:
+            givers, recipients = _hall_violation(free[0], forbidden, match_giver)
+
+            raise InfeasibleAssignment(
+                [ids[giver] for giver in givers],
+                [ids[recipient] for recipient in recipients],
+            )
+
+        for bucket in buckets:
+            rng.shuffle(bucket)
+
+        rng.shuffle(free)
+        for giver in free:
+            _augment(giver, buckets, forbidden, match_giver, match_recipient)
+
+    return {ids[giver]: ids[recipient] for giver, recipient in enumerate(match_giver)}
+
+
+def splice_out(
+    giver: Hashable,
+    recipient: Hashable,
+    pairs: Iterable[Tuple[Hashable, Hashable]],
+    exclusions: Iterable[Tuple[Hashable, Hashable]] = (),
+) -> Optional[Dict[Hashable, Hashable]]:
+    """Close the gap left in a draw by a participant who leaves.
+
+    `giver` gave a gift to the participant and the participant to
+    `recipient`. The giver takes the recipient over, unless that breaks a
+    rule: they are the same person when the participant was in a pair of
+    two, or they exclude each other. Then the giver trades recipients with
+    the first of `pairs`, other (giver, recipient) pairs of the draw, that
+    allows it.
+
+    Returns the {giver: new recipient} changes, or None when no pair works.
+    """
+
+    forbidden = set(exclusions)
+
+    if giver != recipient and (giver, recipient) not in forbidden:
+        return {giver: recipient}
+
+    for other, other_recipient in pairs:
+        if (
+            giver not in (other, other_recipient)
+            and other != recipient
+            and (giver, other_recipient) not in forbidden
+            and (other, recipient) not in forbidden
+        ):
+            return {giver: other_recipient, other: recipient}
+
+    return None
+
+
+def splice_in(
+    participant: Hashable,
+    pairs: Iterable[Tuple[Hashable, Hashable]],
+    exclusions: Iterable[Tuple[Hashable, Hashable]] = (),
+) -> Optional[Dict[Hashable, Hashable]]:
+    """Add a participant to a draw between the two of one of `pairs`.
+
+    The first (giver, recipient) pair that the rules allow is split: the
+    giver gives to the participant and the participant to the recipient.
+    Returns those changes, or None when no pair works.
+    """
+
+    forbidden = set(exclusions)
+
+    for giver, recipient in pairs:
+        if (
+            participant not in (giver, recipient)
+            and (giver, participant) not in forbidden
+            and (participant, recipient) not in forbidden
+        ):
+            return {giver: participant, participant: recipient}
+
+    return None
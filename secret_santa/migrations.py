@@ -0,0 +1,95 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from secret_santa.models import Participant, normalize_name
+
+
+class MigrationError(Exception):
+    """The database can not be upgraded without somebody fixing it first."""
+
+
+def upgrade(engine: Engine, default_game: str) -> None:
+    """Bring a database made by an older version up to the current schema.
+
+    Run it after Base.metadata.create_all, which creates the missing tables
+    but leaves the existing ones as they are. Databases from before games
+    get their participants table rebuilt: everybody joins `default_game`,
+    names are normalized, and the uniques become per game. Indexes added
+    since are created. Running it again changes nothing.
+    """
+
+    with engine.begin() as connection:
+        columns = {
+            column["name"] for column in inspect(connection).get_columns("participants")
+        }
+
+        if not {"game_id", "normalized_name"} <= columns:
+            _rebuild_participants(connection, columns, default_game)
+
+        for index in Participant.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _rebuild_participants(
+    connection: Connection, columns: set, default_game: str
+) -> None:
+    rows = [
+        dict(row)
+        for row in connection.execute(text("SELECT * FROM participants")).mappings()
+    ]
+
+    if "game_id" not in columns:
+        connection.execute(
+            text("INSERT OR IGNORE INTO games (name) VALUES (:name)"),
+            {"name": default_game},
+        )
+        game_id = connection.execute(
+            text("SELECT id FROM games WHERE name = :name"), {"name": default_game}
+        ).scalar_one()
+
+        for row in rows:
+            row["game_id"] = game_id
+
+    # Names only had to be exactly unique, "José" and "jose" would clash now
+    names: Dict[tuple, List[str]] = defaultdict(list)
+    for row in rows:
+        row["normalized_name"] = normalize_name(row["name"])
+        names[row["game_id"], row["normalized_name"]].append(row["name"])
+
+    clashes = [group for group in names.values() if len(group) > 1]
+    if clashes:
+        raise MigrationError(
+            "Rename these participants so their names differ in more than "
+            "accents, case or spaces: "
+            + "; ".join(", ".join(group) for group in clashes)
+        )
+
+    # SQLite can not change constraints in place, so the table is made
+    # again and the rows copied with their ids, recipients included. The
+    # rename must not rewrite the exclusions' references to participants.
+    connection.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+
+    try:
+        connection.exec_driver_sql(
+            "ALTER TABLE participants RENAME TO participants_old"
+        )
+        Participant.__table__.create(connection)
+
+        if rows:
+            connection.execute(
+                Participant.__table__.insert(),
+                [
+                    {
+                        column.name: row.get(column.name)
+                        for column in Participant.__table__.columns
+                    }
+                    for row in rows
+                ],
+            )
+
+        connection.exec_driver_sql("DROP TABLE participants_old")
+    finally:
+        connection.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
@@ -1,5 +1,16 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey
-from sqlalchemy.orm import relationship
+import unicodedata
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    Text,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+)
+from sqlalchemy.orm import relationship, validates
 
 from secret_santa.database import Base
 
@@ -7,11 +18,60 @@ from secret_santa.database import Base
 # max_length, blank...
 
 
+def normalize_name(name: str) -> str:
+    """The form of a name used to tell participants apart.
+
+    "  José   Pérez" and "jose perez" are the same participant: accents are
+    removed, case is folded and whitespace is collapsed.
+    """
+
+    decomposed = unicodedata.normalize("NFKD", name)
+    without_accents = "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    )
+
+    return " ".join(without_accents.casefold().split())
+
+
+def _default_normalized_name(context) -> str:
+    return normalize_name(context.get_current_parameters()["name"])
+
+
+class Game(Base):
+    """A game with its own participants, exclusions and pairs."""
+
+    __tablename__ = "games"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), unique=True, nullable=False)
+
+    participants = relationship("Participant", back_populates="game")
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return self.name
+
+
 class Participant(Base):
     __tablename__ = "participants"
+    __table_args__ = (
+        # Both also serve as the (game_id, ...) lookup indexes
+        UniqueConstraint("game_id", "chat_id"),
+        UniqueConstraint("game_id", "normalized_name"),
+        Index("ix_participants_game_id_recipient_id", "game_id", "recipient_id"),
+        # The game a chat registered in, without knowing the game
+        Index("ix_participants_chat_id", "chat_id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(255), unique=True, nullable=False)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+    name = Column(String(255), nullable=False)
+    # Filled from name, also by bulk inserts that leave it out
+    normalized_name = Column(
+        String(255), nullable=False, default=_default_normalized_name
+    )
     recipient_id = Column(
         Integer,
         ForeignKey("participants.id"),
@@ -19,10 +79,18 @@ class Participant(Base):
         nullable=True,
     )
     preferences = Column(Text, nullable=True)
-    chat_id = Column(String, nullable=False, unique=True)
+    chat_id = Column(String, nullable=False)
 
+    game = relationship("Game", back_populates="participants")
     recipient = relationship("Participant", remote_side=[id], uselist=False)
 
+    @validates("name")
+    def validate_name(self, key, name):
+        if name is not None:
+            self.normalized_name = normalize_name(name)
+
+        return name
+
     def __eq__(self, other):
         return (
             self.id == other.id
@@ -36,3 +104,35 @@ class Participant(Base):
 
     def __repr__(self):
         return self.name
+
+
+class Exclusion(Base):
+    """A pair of participants that must not give a gift to each other."""
+
+    __tablename__ = "exclusions"
+    __table_args__ = (UniqueConstraint("participant_id", "excluded_id"),)
+
+    id = Column(Integer, primary_key=True)
+    participant_id = Column(Integer, ForeignKey("participants.id"), nullable=False)
+    excluded_id = Column(Integer, ForeignKey("participants.id"), nullable=False)
+
+
+class ChatData(Base):
+    """What the bot remembers about a chat between its messages."""
+
+    __tablename__ = "chat_data"
+
+    chat_id = Column(Integer, primary_key=True, autoincrement=False)
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=True)
+    choice = Column(String(255), nullable=True)
+    participant_to_delete = Column(String(255), nullable=True)
+
+
+class ConversationState(Base):
+    """The state a chat is in within one of the bot's conversations."""
+
+    __tablename__ = "conversation_states"
+
+    name = Column(String(255), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    state = Column(Integer, nullable=False)
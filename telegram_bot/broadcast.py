@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from enum import Enum
+from typing import Dict, Iterable, Tuple
+
+from telegram import Bot
+from telegram.error import (
+    BadRequest,
+    Forbidden,
+    NetworkError,
+    RetryAfter,
+    TelegramError,
+)
+
+from telegram_bot.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and one per second to
+# the same chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+
+
+class DeliveryStatus(Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    BLOCKED = "blocked"
+    FAILED = "failed"
+
+
+class Delivery:
+    def __init__(self, chat_id: str, text: str):
+        self.chat_id = chat_id
+        self.text = text
+        self.status = DeliveryStatus.PENDING
+        self.attempts = 0
+        self.error = None
+
+    def __repr__(self):
+        return f"Delivery({self.chat_id}, {self.status.value})"
+
+
+class Broadcaster:
+    """Send messages to many chats with a pool of workers.
+
+    Every send waits for the global and the per-chat token buckets. A
+    RetryAfter from Telegram pauses every worker for the time it asks for,
+    network errors are retried with exponential backoff, and chats that
+    blocked the bot are not retried.
+
+    The global limit is the bot's, so a bot keeps one Broadcaster and every
+    bulk send goes through it, also when several run at once. Chat buckets
+    are dropped once they are idle long enough to be full again.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = 8,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        max_attempts: int = 4,
+        backoff: float = 1,
+    ):
+        self.bot = bot
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+        self._chat_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._resume_at = 0.0
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        now = self.global_bucket.clock()
+
+        while self._chat_buckets:
+            oldest_id, oldest = next(iter(self._chat_buckets.items()))
+            if now - oldest.updated < 1 / self.chat_rate:
+                break
+
+            del self._chat_buckets[oldest_id]
+
+        bucket = self._chat_buckets.get(chat_id)
+
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, capacity=1
+            )
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+
+        return bucket
+
+    async def _wait_flood_control(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while loop.time() < self._resume_at:
+            await asyncio.sleep(self._resume_at - loop.time())
+
+    async def _deliver(self, delivery: Delivery) -> None:
+        loop = asyncio.get_running_loop()
+
+        while delivery.attempts < self.max_attempts:
+            await self._wait_flood_control()
+            await self.global_bucket.acquire()
+            await self._chat_bucket(delivery.chat_id).acquire()
+
+            delivery.attempts += 1
+
+            try:
+                await self.bot.send_message(
+                    chat_id=delivery.chat_id, text=delivery.text
+                )
+
+            except RetryAfter as error:
+                delivery.error = error
+                self._resume_at = max(self._resume_at, loop.time() + error.retry_after)
+
+            except Forbidden as error:
+                delivery.error = error
+                delivery.status = DeliveryStatus.BLOCKED
+                return
+
+            except BadRequest as error:
+                delivery.error = error
+                delivery.status = DeliveryStatus.FAILED
+                return
+
+            except NetworkError as error:
+                delivery.error = error
+                await asyncio.sleep(self.backoff * 2 ** (delivery.attempts - 1))
+
+            except TelegramError as error:
+                delivery.error = error
+                delivery.status = DeliveryStatus.FAILED
+                return
+
+            else:
+                delivery.error = None
+                delivery.status = DeliveryStatus.SENT
+                return
+
+        delivery.status = DeliveryStatus.FAILED
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            delivery = await queue.get()
+
+            try:
+                await self._deliver(delivery)
+            except Exception as error:
+                delivery.error = error
+                delivery.status = DeliveryStatus.FAILED
+                logger.exception("Could not send message to %s", delivery.chat_id)
+            finally:
+                queue.task_done()
+
+    async def send(self, messages: Iterable[Tuple[str, str]]) -> Dict[str, Delivery]:
+        """Send every (chat_id, text) message and return the delivery of each."""
+
+        deliveries = {}
+        queue = asyncio.Queue()
+
+        for chat_id, text in messages:
+            deliveries[chat_id] = Delivery(chat_id, text)
+            queue.put_nowait(deliveries[chat_id])
+
+        workers = [
+            asyncio.create_task(self._worker(queue))
+            for _ in range(min(self.workers, len(deliveries)))
+        ]
+
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        return deliveries
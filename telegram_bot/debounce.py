@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import logging
+from time import monotonic
+from typing import Awaitable, Callable, Dict, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Debouncer:
+    """Merge bursts of events per key into one call after a delay.
+
+    The first event of a key schedules it `delay` seconds later, and the
+    events of the key that come before then are merged into it; the last
+    value given wins. Keys that come due together are handed to `callback`
+    in one dict, so it can look them all up and send at once.
+
+    Pending keys are a dict entry and a heap item each. A single task sleeps
+    until the earliest one is due, and only while there is something
+    pending, so no timer is kept per key.
+    """
+
+    def __init__(
+        self,
+        delay: float,
+        callback: Callable[[Dict[Hashable, object]], Awaitable[None]],
+    ):
+        self.delay = delay
+        self.callback = callback
+        self.merged = 0
+
+        self._pending: Dict[Hashable, object] = {}
+        self._deadlines: List[Tuple[float, Hashable]] = []
+        self._task: asyncio.Task = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: Hashable, value: object = None) -> bool:
+        """Schedule the key, return False when it was pending already."""
+
+        merged = key in self._pending
+        self._pending[key] = value
+
+        if merged:
+            self.merged += 1
+            return False
+
+        # Every key waits the same delay, so the heap's head never moves
+        # ahead of what the task is sleeping for
+        heapq.heappush(self._deadlines, (monotonic() + self.delay, key))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+        return True
+
+    async def flush(self) -> None:
+        """Call back right away with everything pending."""
+
+        batch, self._pending = self._pending, {}
+        self._deadlines.clear()
+
+        if batch:
+            await self.callback(batch)
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await self.flush()
+
+    async def _run(self) -> None:
+        while self._deadlines:
+            await asyncio.sleep(max(0, self._deadlines[0][0] - monotonic()))
+
+            now = monotonic()
+            batch = {}
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, key = heapq.heappop(self._deadlines)
+                batch[key] = self._pending.pop(key)
+
+            try:
+                await self.callback(batch)
+            except Exception:
+                logger.exception("A debounced callback failed")
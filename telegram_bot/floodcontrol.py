@@ -0,0 +1,128 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Dict, Hashable
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from telegram_bot.processor import chat_key
+from telegram_bot.ratelimit import TokenBucket
+from telegram_bot.replies import reply
+
+# Handler group of the check, before every other handler
+FLOOD_CONTROL_GROUP = -100
+
+
+class FloodControl:
+    """Admit updates into the handlers at a per-chat and a global rate.
+
+    An update needs a token from its chat's bucket first: a chat that sends
+    faster than `chat_rate` (after a burst of `chat_burst`) has the extra
+    updates dropped, and is told once. Then it needs a token from the
+    global bucket: when all chats together go over `global_rate` the
+    update waits for its turn, and is dropped when that would take more
+    than `max_delay` seconds.
+
+    Chat buckets are kept in least recently used order. A bucket not used
+    for as long as it takes to refill is full, the same as a new one, so it
+    is dropped; only the chats active lately take memory.
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = 1,
+        chat_burst: float = 10,
+        global_rate: float = 200,
+        max_delay: float = 2,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_delay = max_delay
+        self.idle = chat_burst / chat_rate
+        self.clock = clock
+
+        self.global_bucket = TokenBucket(global_rate, clock=clock)
+
+        self.admitted = 0
+        self.delayed = 0
+        self.dropped_chat = 0
+        self.dropped_global = 0
+
+        self._chats: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self._warned = set()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "chats": len(self._chats),
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "dropped_chat": self.dropped_chat,
+            "dropped_global": self.dropped_global,
+        }
+
+    def _chat_bucket(self, key: Hashable) -> TokenBucket:
+        now = self.clock()
+
+        while self._chats:
+            oldest_key, oldest = next(iter(self._chats.items()))
+            if now - oldest.updated < self.idle:
+                break
+
+            del self._chats[oldest_key]
+            self._warned.discard(oldest_key)
+
+        bucket = self._chats.get(key)
+
+        if bucket is None:
+            bucket = self._chats[key] = TokenBucket(
+                self.chat_rate, capacity=self.chat_burst, clock=self.clock
+            )
+        else:
+            self._chats.move_to_end(key)
+
+        return bucket
+
+    async def admit(self, key: Hashable) -> bool:
+        """Wait for the update's turn, return False when it must be dropped."""
+
+        if key is not None and not self._chat_bucket(key).try_acquire():
+            self.dropped_chat += 1
+            return False
+
+        if self.global_bucket.delay() > self.max_delay:
+            self.dropped_global += 1
+            return False
+
+        self._warned.discard(key)
+        self.admitted += 1
+
+        wait = self.global_bucket.reserve()
+        if wait:
+            self.delayed += 1
+            await asyncio.sleep(wait)
+
+        return True
+
+    async def check(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        """TypeHandler callback that stops the updates that are not admitted."""
+
+        key = chat_key(update)
+
+        if await self.admit(key):
+            return
+
+        if (
+            key is not None
+            and key not in self._warned
+            and isinstance(update, Update)
+            and update.effective_chat is not None
+        ):
+            self._warned.add(key)
+            await reply(
+                update,
+                "Estás enviando mensajes muy rápido, por favor espera un momento",
+            )
+
+        raise ApplicationHandlerStop
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from enum import Enum
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from secret_santa.matching import solve
+
+logger = logging.getLogger(__name__)
+
+
+class DrawRunnerClosed(RuntimeError):
+    """The runner was shut down and takes no more draws."""
+
+
+class DrawStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SAVING = "saving"
+    NOTIFYING = "notifying"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class DrawJob:
+    """A draw over a snapshot of participant ids and exclusion pairs."""
+
+    def __init__(
+        self, game_id: int, ids: List[int], exclusions: List[Tuple[int, int]]
+    ):
+        self.game_id = game_id
+        self.ids = ids
+        self.exclusions = exclusions
+        self.status = DrawStatus.QUEUED
+        self.error = None
+        self.started_at = monotonic()
+        self.finished_at = None
+        self.task = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (
+            DrawStatus.DONE,
+            DrawStatus.FAILED,
+            DrawStatus.CANCELLED,
+        )
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or monotonic()) - self.started_at
+
+    def cancel(self) -> bool:
+        """Stop waiting for the draw; see DrawRunner for what that means."""
+
+        if self.done:
+            return False
+
+        self.task.cancel()
+        return True
+
+
+def _warm_up() -> None:
+    pass
+
+
+class DrawRunner:
+    """Run draws in the background on a pool of worker processes.
+
+    The pool is started before the first draw, so a draw only pays for
+    sending the ids to a worker and reading the assignment back. Each game runs
+    one draw at a time, and the event loop keeps serving other chats
+    meanwhile.
+
+    Cancelling a draw abandons its result. A draw still queued for the pool
+    never runs, but one a worker already took runs to the end, since a
+    worker process can not be interrupted; solve takes polynomial time, so
+    the worker is soon free again, and the assignment is thrown away.
+    """
+
+    def __init__(self, workers: int = 1, executor: Executor = None):
+        self.workers = workers
+        self.jobs = {}
+        self.closed = False
+
+        self._executor = executor
+
+    def start(self) -> None:
+        if self.closed:
+            raise DrawRunnerClosed("The draw runner was shut down.")
+
+        if self._executor is not None:
+            return
+
+        # Spawned workers do not inherit the bot's threads and connections
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+        for _ in range(self.workers):
+            self._executor.submit(_warm_up)
+
+    def shutdown(self) -> None:
+        self.closed = True
+
+        for job in self.jobs.values():
+            job.cancel()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get(self, game_id: int) -> DrawJob:
+        """Return the last draw of the game, if any."""
+
+        return self.jobs.get(game_id)
+
+    def busy(self, game_id: int) -> bool:
+        return game_id in self.jobs and not self.jobs[game_id].done
+
+    async def solve(self, job: DrawJob) -> Dict[int, int]:
+        """Solve the draw of the job on the pool and return the assignment."""
+
+        self.start()
+        job.status = DrawStatus.RUNNING
+
+        future = self._executor.submit(solve, job.ids, job.exclusions)
+
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def submit(
+        self,
+        game_id: int,
+        ids: List[int],
+        exclusions: List[Tuple[int, int]],
+        pipeline: Callable[[DrawJob], Awaitable[None]],
+    ) -> DrawJob:
+        """Run `pipeline(job)` as a background task and return the job."""
+
+        if self.closed:
+            raise DrawRunnerClosed("The draw runner was shut down.")
+
+        if self.busy(game_id):
+            raise RuntimeError("A draw is already running for this game.")
+
+        job = DrawJob(game_id, ids, exclusions)
+        job.task = asyncio.get_running_loop().create_task(self._run(job, pipeline))
+        self.jobs[game_id] = job
+
+        return job
+
+    async def _run(
+        self, job: DrawJob, pipeline: Callable[[DrawJob], Awaitable[None]]
+    ) -> None:
+        try:
+            await pipeline(job)
+            job.status = DrawStatus.DONE
+
+        except asyncio.CancelledError:
+            job.status = DrawStatus.CANCELLED
+
+        except Exception as error:
+            logger.exception("The draw failed")
+            job.error = error
+            job.status = DrawStatus.FAILED
+
+        finally:
+            job.finished_at = monotonic()
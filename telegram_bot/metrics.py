@@ -0,0 +1,343 @@
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+from http import HTTPStatus
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from telegram.ext import Application, BaseHandler, ConversationHandler
+from telegram.request import BaseRequest, RequestData
+
+from telegram_bot.webhook import Response, WebhookServer, response
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a fast query to a slow Bot API call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Counts of observed values per bucket, plus their sum and count."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels: Labels, **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+
+    if not pairs:
+        return ""
+
+    values = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for _, value in pairs
+    )
+
+    return (
+        "{"
+        + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, values))
+        + "}"
+    )
+
+
+class Metrics:
+    """Counters and histograms kept in memory and rendered for Prometheus.
+
+    Recording is a dict lookup and an addition, cheap enough for every
+    update and query. Gauges are read from `stats()` callables only when
+    the metrics are rendered, so the bot's parts keep their own counters.
+    """
+
+    def __init__(self):
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._gauges: Dict[str, Callable[[], Mapping[str, float]]] = {}
+
+    def counter(self, name: str, help: str) -> None:
+        self._help[name] = ("counter", help)
+        self._counters.setdefault(name, {})
+
+    def histogram(
+        self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self._help[name] = ("histogram", help)
+        self._histograms.setdefault(name, {})
+        self._buckets[name] = buckets
+
+    def gauges(
+        self, prefix: str, help: str, stats: Callable[[], Mapping[str, float]]
+    ) -> None:
+        """Render each key of `stats()` as the gauge `<prefix>_<key>`."""
+
+        self._help[prefix] = ("gauge", help)
+        self._gauges[prefix] = stats
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        series = self._counters[name]
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self._histograms[name]
+        key = tuple(labels.items())
+
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self._buckets[name])
+
+        histogram.observe(value)
+
+    def get(self, name: str, **labels: str) -> Optional[float | Histogram]:
+        """The counter value or histogram of the labels, None if unseen."""
+
+        key = tuple(labels.items())
+
+        if name in self._counters:
+            return self._counters[name].get(key)
+
+        return self._histograms[name].get(key)
+
+    def render(self) -> str:
+        lines = []
+
+        for name, series in self._counters.items():
+            lines += [
+                f"# HELP {name} {self._help[name][1]}",
+                f"# TYPE {name} counter",
+            ]
+            lines += [
+                f"{name}{_labels(labels)} {value}" for labels, value in series.items()
+            ]
+
+        for name, series in self._histograms.items():
+            lines += [
+                f"# HELP {name} {self._help[name][1]}",
+                f"# TYPE {name} histogram",
+            ]
+
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(
+                    histogram.buckets + ("+Inf",), histogram.counts
+                ):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_labels(labels, le=bound)} {cumulative}"
+                    )
+
+                lines += [
+                    f"{name}_sum{_labels(labels)} {histogram.sum}",
+                    f"{name}_count{_labels(labels)} {histogram.count}",
+                ]
+
+        for prefix, stats in self._gauges.items():
+            help = self._help[prefix][1]
+
+            for key, value in stats().items():
+                lines += [
+                    f"# HELP {prefix}_{key} {help}",
+                    f"# TYPE {prefix}_{key} gauge",
+                    f"{prefix}_{key} {value}",
+                ]
+
+        return "\n".join(lines) + "\n"
+
+
+class _HandlerRun:
+    __slots__ = ("state", "handler", "queries")
+
+    def __init__(self, state: str, handler: str):
+        self.state = state
+        self.handler = handler
+        self.queries = 0
+
+
+# The handler callback running in the current task, for the query hooks
+_handler_run: ContextVar[Optional[_HandlerRun]] = ContextVar(
+    "handler_run", default=None
+)
+
+
+def _timed(callback: Callable, metrics: Metrics, state: str) -> Callable:
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    async def timed(update, context):
+        run = _HandlerRun(state, name)
+        token = _handler_run.set(run)
+        start = perf_counter()
+
+        try:
+            return await callback(update, context)
+        finally:
+            _handler_run.reset(token)
+            metrics.observe(
+                "handler_seconds", perf_counter() - start, state=state, handler=name
+            )
+            metrics.observe("handler_queries", run.queries, state=state, handler=name)
+
+    timed.__name__ = name
+
+    return timed
+
+
+def instrument_handlers(
+    app: Application, metrics: Metrics, state_names: Mapping[object, str] = {}
+) -> None:
+    """Time every handler callback of the app and count its queries.
+
+    Callbacks of a ConversationHandler are labelled with the state they
+    handle, or ENTRY and FALLBACK; the rest with NONE. Call it once all the
+    handlers are added.
+    """
+
+    metrics.histogram(
+        "handler_seconds", "Seconds a handler callback took, by conversation state"
+    )
+    metrics.histogram(
+        "handler_queries",
+        "Database queries a handler callback ran, by conversation state",
+        QUERY_COUNT_BUCKETS,
+    )
+
+    def instrument(handlers: Iterable[BaseHandler], state: str) -> None:
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                instrument(handler.entry_points, "ENTRY")
+                for key, state_handlers in handler.states.items():
+                    instrument(state_handlers, state_names.get(key, str(key)))
+                instrument(handler.fallbacks, "FALLBACK")
+            else:
+                handler.callback = _timed(handler.callback, metrics, state)
+
+    for handlers in app.handlers.values():
+        instrument(handlers, "NONE")
+
+
+class QueryMetrics:
+    """Engine event hooks that time every statement and log the slow ones.
+
+    Statements run by a handler instrumented with `instrument_handlers` are
+    also counted for it, and logged with its name when slow.
+    """
+
+    def __init__(self, metrics: Metrics, slow: float = 0.1):
+        self.metrics = metrics
+        self.slow = slow
+        self.engine: Engine = None
+
+        metrics.counter("db_slow_queries_total", "Statements slower than the limit")
+        metrics.histogram("db_query_seconds", "Seconds a database statement took")
+
+    def attach(self, engine: Engine) -> None:
+        self.engine = engine
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def detach(self) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._before)
+        event.remove(self.engine, "after_cursor_execute", self._after)
+        self.engine = None
+
+    def _before(self, connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("query_start", []).append(perf_counter())
+
+    def _after(self, connection, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - connection.info["query_start"].pop()
+        self.metrics.observe("db_query_seconds", elapsed)
+
+        run = _handler_run.get()
+        if run is not None:
+            run.queries += 1
+
+        if elapsed >= self.slow:
+            self.metrics.inc("db_slow_queries_total")
+            logger.warning(
+                "Slow query, %.3f s in %s: %s",
+                elapsed,
+                f"{run.handler} ({run.state})" if run is not None else "no handler",
+                statement,
+            )
+
+
+class InstrumentedRequest(BaseRequest):
+    """Bot API transport that times the calls of the one it wraps."""
+
+    def __init__(self, request: BaseRequest, metrics: Metrics):
+        self.request = request
+        self.metrics = metrics
+
+        metrics.histogram(
+            "telegram_api_seconds", "Seconds a Bot API call took, by method"
+        )
+
+    async def initialize(self) -> None:
+        await self.request.initialize()
+
+    async def shutdown(self) -> None:
+        await self.request.shutdown()
+
+    async def do_request(
+        self, url: str, method: str, request_data: RequestData = None, **timeouts
+    ) -> Tuple[int, bytes]:
+        status = "error"
+        start = perf_counter()
+
+        try:
+            status, payload = await self.request.do_request(
+                url, method, request_data, **timeouts
+            )
+        finally:
+            self.metrics.observe(
+                "telegram_api_seconds",
+                perf_counter() - start,
+                method=url.rsplit("/", 1)[-1],
+                status=str(status),
+            )
+
+        return status, payload
+
+
+class MetricsServer(WebhookServer):
+    """Serve the metrics as Prometheus text on GET `path`.
+
+    It is meant to be scraped locally, so it listens on localhost unless
+    told otherwise.
+    """
+
+    def __init__(
+        self,
+        app: Application,
+        metrics: Metrics,
+        path: str = "/metrics",
+        listen: str = "127.0.0.1",
+        port: int = 9100,
+    ):
+        super().__init__(app, path=path, listen=listen, port=port)
+        self.metrics = metrics
+
+    async def handle(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        if path != self.path:
+            return response(HTTPStatus.NOT_FOUND)
+
+        if method != "GET":
+            return response(HTTPStatus.METHOD_NOT_ALLOWED, Allow="GET")
+
+        return response(HTTPStatus.OK, self.metrics.render().encode())
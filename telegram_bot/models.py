@@ -1,136 +1,930 @@
-from typing import List
+import asyncio
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from random import Random
+from difflib import get_close_matches
+from time import monotonic
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from weakref import WeakValueDictionary
+
+from sqlalchemy import bindparam, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased, make_transient_to_detached
+
+from secret_santa.matching import splice_in, splice_out
+from secret_santa.models import Game, Participant, Exclusion, normalize_name
+from secret_santa.database import AsyncSession
+
+
+class ParticipantCache:
+    """Bounded LRU cache of participants that also expires entries by age.
+
+    Keys are scoped by game, as chat ids and names are only unique inside
+    one. It stores the column values only and hands out a new detached Participant
+    on every hit, so a handler changing an object never changes the cache.
+    Every write path in this module invalidates the rows it touches, and bumps
+    `version` so a read that started before the write does not put the old
+    row back.
+    """
+
+    columns = ("id", "game_id", "name", "recipient_id", "preferences", "chat_id")
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+
+        self._entries = OrderedDict()
+        self._by_chat_id = {}
+        self._by_name = {}
+        self._by_recipient_id = {}
+
+    def get(
+        self,
+        game_id: int = None,
+        chat_id: str = None,
+        name: str = None,
+        recipient_id: int = None,
+    ) -> Participant:
+        if chat_id is not None:
+            participant_id = self._by_chat_id.get((game_id, str(chat_id)))
+        elif name is not None:
+            participant_id = self._by_name.get((game_id, normalize_name(name)))
+        else:
+            participant_id = self._by_recipient_id.get(recipient_id)
+
+        return self.get_by_id(participant_id)
+
+    def get_by_id(self, participant_id: int) -> Participant:
+        entry = self._entries.get(participant_id)
+
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                self.invalidate(participant_id)
+
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(participant_id)
+        self.hits += 1
+
+        participant = Participant(**dict(zip(self.columns, entry[1])))
+        make_transient_to_detached(participant)
+
+        return participant
+
+    def put(self, participant: Participant, version: int = None) -> None:
+        if participant is None or (version is not None and version != self.version):
+            return
+
+        self.invalidate(participant.id)
+
+        self._entries[participant.id] = (
+            monotonic() + self.ttl,
+            tuple(getattr(participant, column) for column in self.columns),
+        )
+        self._by_chat_id[(participant.game_id, str(participant.chat_id))] = (
+            participant.id
+        )
+        self._by_name[(participant.game_id, normalize_name(participant.name))] = (
+            participant.id
+        )
+        if participant.recipient_id is not None:
+            self._by_recipient_id[participant.recipient_id] = participant.id
+
+        while len(self._entries) > self.max_size:
+            self.invalidate(next(iter(self._entries)))
+
+    def invalidate(self, participant_id: int) -> None:
+        self.version += 1
+        entry = self._entries.pop(participant_id, None)
+
+        if entry is None:
+            return
+
+        _, game_id, name, recipient_id, _, chat_id = entry[1]
+        for index, key in (
+            (self._by_chat_id, (game_id, str(chat_id))),
+            (self._by_name, (game_id, normalize_name(name))),
+            (self._by_recipient_id, recipient_id),
+        ):
+            if index.get(key) == participant_id:
+                del index[key]
+
+    def clear(self) -> None:
+        self.version += 1
+        self._entries.clear()
+        self._by_chat_id.clear()
+        self._by_name.clear()
+        self._by_recipient_id.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class NameIndex:
+    """Alphabetical (normalized_name, name, id) list of each game.
+
+    A game is loaded with one query the first time it is needed and from
+    then on kept in step with the writes of this module, which insert and
+    remove single entries with bisect. Normalized names are unique in a
+    game, so an exact lookup is a binary search and a prefix search a
+    binary search plus a slice.
+    """
+
+    def __init__(self):
+        self.version = 0
+
+        self._games: Dict[int, List[Tuple[str, str, int]]] = {}
+
+    def get(self, game_id: int) -> List[Tuple[str, str, int]]:
+        return self._games.get(game_id)
+
+    def put(self, game_id: int, entries: List[Tuple[str, str, int]], version: int):
+        if version == self.version:
+            self._games[game_id] = entries
+
+    def add(self, game_id: int, name: str, participant_id: int) -> None:
+        self.version += 1
+        entries = self._games.get(game_id)
+
+        if entries is not None:
+            insort(entries, (normalize_name(name), name, participant_id))
+
+    def remove(self, game_id: int, name: str, participant_id: int) -> None:
+        self.version += 1
+        entries = self._games.get(game_id)
+
+        if entries is None:
+            return
+
+        i = bisect_left(entries, (normalize_name(name),))
+
+        if i < len(entries) and entries[i][2] == participant_id:
+            del entries[i]
+        else:
+            # Out of step with the database, load it again next time
+            del self._games[game_id]
+
+    def invalidate(self, game_id: int) -> None:
+        self.version += 1
+        self._games.pop(game_id, None)
+
+    def clear(self) -> None:
+        self.version += 1
+        self._games.clear()
+
+
+def find_name(
+    entries: List[Tuple[str, str, int]], name: str
+) -> Optional[Tuple[str, str, int]]:
+    """The entry of the name however it is written, None if there is none."""
+
+    normalized = normalize_name(name)
+    i = bisect_left(entries, (normalized,))
+
+    if i < len(entries) and entries[i][0] == normalized:
+        return entries[i]
+
+    return None
+
+
+# Names around the text's place in the list that the typo search compares
+FUZZY_CANDIDATES = 200
+
+
+def search_names(
+    entries: List[Tuple[str, str, int]], text: str, limit: int = 10
+) -> List[Tuple[str, str, int]]:
+    """Entries whose name starts with the text, then the closest ones.
+
+    The prefix matches come in alphabetical order; when there are fewer than
+    `limit` of them, the rest are names that look alike, for typos. To keep
+    that cheap in big games, only the FUZZY_CANDIDATES names alphabetically
+    nearest to the text are compared, and only those whose length can give
+    a close enough match, so a typo in the first letter may go unmatched.
+    """
+
+    normalized = normalize_name(text)
+    start = bisect_left(entries, (normalized,))
+    found = []
+
+    for entry in entries[start : start + limit]:
+        if not entry[0].startswith(normalized):
+            break
+        found.append(entry)
+
+    if len(found) < limit and normalized:
+        # A ratio of 0.6 needs the lengths within 3/7 and 7/3 of each other
+        low, high = len(normalized) * 3 / 7, len(normalized) * 7 / 3
+        half = FUZZY_CANDIDATES // 2
+        nearby = entries[max(0, start - half) : start + half]
+
+        by_name = {entry[0]: entry for entry in nearby if low <= len(entry[0]) <= high}
+        for close in get_close_matches(normalized, by_name, n=limit, cutoff=0.6):
+            if by_name[close] not in found:
+                found.append(by_name[close])
+
+    return found[:limit]
+
+
+cache = ParticipantCache()
+name_index = NameIndex()
+_rng = Random()
+
+# Mending a draw reads some pairs and then rewrites a few of them, and SQLite
+# takes no lock for the read. Changes to a game's draw take turns, or two
+# could rewrite the same pair and leave somebody without a giver.
+_draw_locks: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
+
+
+def _draw_lock(game_id: int) -> asyncio.Lock:
+    """The lock of the game's draw, kept only while somebody holds it."""
 
-from secret_santa.models import Participant
-from secret_santa.database import Session
+    lock = _draw_locks.get(game_id)
 
+    if lock is None:
+        lock = _draw_locks[game_id] = asyncio.Lock()
 
-def update_participant(new_participant: Participant) -> bool:
+    return lock
+
+
+async def get_or_create_game(name: str) -> Game:
+    async with AsyncSession() as session:
+        game = await session.scalar(select(Game).where(Game.name == name))
+
+        if game is None:
+            try:
+                game = Game(name=name)
+                session.add(game)
+                await session.commit()
+            except IntegrityError:
+                # Somebody else created it at the same time
+                await session.rollback()
+                game = await session.scalar(select(Game).where(Game.name == name))
+
+    return game
+
+
+async def get_game(game_id: int) -> Game:
+    async with AsyncSession() as session:
+        game = await session.get(Game, game_id)
+
+    return game
+
+
+async def get_chat_game_id(chat_id: str) -> int:
+    """Return the game the chat registered in last, if any."""
+
+    async with AsyncSession() as session:
+        game_id = await session.scalar(
+            select(Participant.game_id)
+            .where(Participant.chat_id == chat_id)
+            .order_by(Participant.id.desc())
+            .limit(1)
+        )
+
+    return game_id
+
+
+async def create_participant(game_id: int, chat_id: str, name: str) -> bool:
+    """Register a participant with one INSERT.
+
+    The unique indexes on (game_id, normalized_name) and (game_id, chat_id)
+    reject names that are already taken, however they are written, and
+    chats that are already registered.
+    """
+
+    created = False
+
+    async with AsyncSession() as session:
+        try:
+            participant = Participant(game_id=game_id, chat_id=chat_id, name=name)
+            session.add(participant)
+            await session.commit()
+            name_index.add(game_id, name, participant.id)
+
+            created = True
+        except IntegrityError:
+            await session.rollback()
+
+    return created
+
+
+async def update_participant(new_participant: Participant) -> bool:
     updated = False
 
-    with Session() as session:
+    async with AsyncSession() as session:
         try:
-            participant = (
-                session.query(Participant)
-                .filter(Participant.id == new_participant.id)
-                .first()
-            )
+            participant = await session.get(Participant, new_participant.id)
+            old_name = participant.name
 
             participant.name = new_participant.name
             participant.preferences = new_participant.preferences
             participant.recipient_id = new_participant.recipient_id
 
             session.add(participant)
-            session.commit()
+            await session.commit()
+            cache.invalidate(participant.id)
+            if participant.name != old_name:
+                name_index.remove(participant.game_id, old_name, participant.id)
+                name_index.add(participant.game_id, participant.name, participant.id)
 
             updated = True
         except:
             try:
-                session.rollback()
+                await session.rollback()
             except:
                 pass
 
     return updated
 
 
-def get_participant(chat_id: str = None, participant_name: str = None) -> Participant:
-    with Session() as session:
-        if chat_id:
-            participant = (
-                session.query(Participant)
-                .filter(Participant.chat_id == chat_id)
-                .first()
-            )
-        elif participant_name:
-            participant = (
-                session.query(Participant)
-                .filter(Participant.name == participant_name)
-                .first()
-            )
-        else:
-            return None
+async def get_participant(
+    game_id: int,
+    chat_id: str = None,
+    participant_name: str = None,
+    participant_id: int = None,
+) -> Participant:
+    if not chat_id and not participant_name and not participant_id:
+        return None
+
+    if participant_id:
+        participant = cache.get_by_id(participant_id)
+        if participant is not None and participant.game_id != game_id:
+            participant = None
+
+        query = select(Participant).where(
+            Participant.game_id == game_id, Participant.id == participant_id
+        )
+    elif chat_id:
+        participant = cache.get(game_id, chat_id=chat_id)
+        query = select(Participant).where(
+            Participant.game_id == game_id, Participant.chat_id == chat_id
+        )
+    else:
+        participant = cache.get(game_id, name=participant_name)
+        query = select(Participant).where(
+            Participant.game_id == game_id,
+            Participant.normalized_name == normalize_name(participant_name),
+        )
+
+    if participant is not None:
+        return participant
+
+    version = cache.version
+
+    async with AsyncSession() as session:
+        participant = await session.scalar(query)
+
+    cache.put(participant, version)
 
     return participant
 
 
-def get_participant_recipient(participant: Participant) -> Participant:
-    with Session() as session:
-        participant = (
-            session.query(Participant)
-            .filter(Participant.chat_id == participant.chat_id)
-            .first()
+async def get_participant_recipient(participant: Participant) -> Participant:
+    """Return who the participant gives a gift to, in at most one query.
+
+    The giver is looked up by chat, as the given object may be stale, and
+    joined with its recipient.
+    """
+
+    giver = cache.get(participant.game_id, chat_id=participant.chat_id)
+
+    if giver is not None:
+        if giver.recipient_id is None:
+            return None
+
+        recipient = cache.get_by_id(giver.recipient_id)
+
+        if recipient is not None:
+            return recipient
+
+    version = cache.version
+    Giver = aliased(Participant)
+
+    async with AsyncSession() as session:
+        recipient = await session.scalar(
+            select(Participant)
+            .join(Giver, Giver.recipient_id == Participant.id)
+            .where(
+                Giver.game_id == participant.game_id,
+                Giver.chat_id == participant.chat_id,
+            )
         )
 
-        recipient = participant.recipient
+    cache.put(recipient, version)
 
     return recipient
 
 
-def get_participant_whose_recipient_is_participant(
+async def get_participant_whose_recipient_is_participant(
     participant: Participant,
 ) -> Participant:
-    with Session() as session:
-        participant = (
-            session.query(Participant)
-            .filter(Participant.chat_id == participant.chat_id)
-            .first()
-        )
+    """Return who gives a gift to the participant, in at most one query."""
 
-        participant_whose_recipient_is_participant = (
-            session.query(Participant)
-            .filter(Participant.recipient_id == participant.id)
-            .first()
+    recipient = cache.get(participant.game_id, chat_id=participant.chat_id)
+
+    if recipient is not None:
+        giver = cache.get(recipient_id=recipient.id)
+
+        if giver is not None:
+            return giver
+
+    version = cache.version
+    Recipient = aliased(Participant)
+
+    async with AsyncSession() as session:
+        giver = await session.scalar(
+            select(Participant)
+            .join(Recipient, Participant.recipient_id == Recipient.id)
+            .where(
+                Recipient.game_id == participant.game_id,
+                Recipient.chat_id == participant.chat_id,
+            )
         )
 
-        return participant_whose_recipient_is_participant
+    cache.put(giver, version)
+
+    return giver
 
 
-def get_all_participants() -> List[Participant]:
-    with Session() as session:
-        participants = session.query(Participant).all()
+async def get_all_participants(game_id: int) -> List[Participant]:
+    async with AsyncSession() as session:
+        participants = (
+            await session.scalars(
+                select(Participant).where(Participant.game_id == game_id)
+            )
+        ).all()
 
     return participants
 
 
-def delete_participant(chat_id: str = None, participant_name: str = None):
-    deleted = False
+async def count_participants(game_id: int) -> int:
+    async with AsyncSession() as session:
+        return await session.scalar(
+            select(func.count(Participant.id)).where(Participant.game_id == game_id)
+        )
+
+
+async def get_participant_names(
+    game_id: int, after: str = None, limit: int = None
+) -> List[str]:
+    """Names in alphabetical order, one page at a time.
+
+    Pages are read from the (game_id, normalized_name) index: pass the
+    normalized form of the last name of a page as `after` to get the next
+    one.
+    """
+
+    query = (
+        select(Participant.name)
+        .where(Participant.game_id == game_id)
+        .order_by(Participant.normalized_name)
+        .limit(limit)
+    )
+
+    if after is not None:
+        query = query.where(Participant.normalized_name > after)
+
+    async with AsyncSession() as session:
+        return list(await session.scalars(query))
+
+
+async def get_name_index(game_id: int) -> List[Tuple[str, str, int]]:
+    """The game's (normalized_name, name, id) entries, sorted by name.
+
+    Served from memory after the first call and kept up to date by the
+    writes; do not modify the list.
+    """
+
+    entries = name_index.get(game_id)
+
+    if entries is None:
+        version = name_index.version
+
+        async with AsyncSession() as session:
+            rows = await session.execute(
+                select(Participant.normalized_name, Participant.name, Participant.id)
+                .where(Participant.game_id == game_id)
+                .order_by(Participant.normalized_name)
+            )
+            entries = [tuple(row) for row in rows]
+
+        name_index.put(game_id, entries, version)
+
+    return entries
+
+
+async def find_participant_name(
+    game_id: int, name: str
+) -> Optional[Tuple[str, str, int]]:
+    """The (normalized_name, name, id) of the participant with that name."""
+
+    return find_name(await get_name_index(game_id), name)
+
+
+async def search_participant_names(
+    game_id: int, text: str, limit: int = 10
+) -> List[Tuple[str, str, int]]:
+    """Participants whose name starts with the text or looks like it."""
+
+    return search_names(await get_name_index(game_id), text, limit)
+
+
+async def iter_participant_names(
+    game_id: int, batch_size: int = 500
+) -> AsyncIterator[List[str]]:
+    """Yield the names in alphabetical order, `batch_size` at a time.
+
+    Every batch is its own short query, so memory does not grow with the
+    game and no read stays open while the caller sends messages.
+    """
+
+    after = None
+
+    while True:
+        names = await get_participant_names(game_id, after=after, limit=batch_size)
+
+        if names:
+            yield names
+
+        if len(names) < batch_size:
+            return
 
-    with Session() as session:
+        after = normalize_name(names[-1])
+
+
+class DrawRepair:
+    """How a participant joining or leaving changed the game's draw.
+
+    `changes` maps the givers whose recipient changed to their new one.
+    `redraw` is set when the draw could not be mended and has to be made
+    again: it was cleared, or the new participant was left out of it.
+    """
+
+    def __init__(
+        self,
+        participant_id: int,
+        chat_id: str,
+        changes: Dict[int, int] = None,
+        redraw: bool = False,
+    ):
+        self.participant_id = participant_id
+        self.chat_id = chat_id
+        self.changes = changes or {}
+        self.redraw = redraw
+
+
+# Pairs read around a random point when a change in the draw needs another
+# pair to trade with; any of them almost always works
+SAMPLE_PAIRS = 16
+
+
+async def _sample_pairs(
+    session, game_id: int, skip: List[int], count: int = SAMPLE_PAIRS
+) -> List[Tuple[int, int]]:
+    """Up to `count` (giver, recipient) pairs of the draw, in random order.
+
+    They are read in recipient order from a random recipient id on, through
+    the (game_id, recipient_id) index, so it costs the same in any game.
+    Pairs with a participant in `skip` are left out; count=None reads them
+    all.
+    """
+
+    query = select(Participant.id, Participant.recipient_id).where(
+        Participant.game_id == game_id,
+        Participant.recipient_id.is_not(None),
+        Participant.id.not_in(skip),
+        Participant.recipient_id.not_in(skip),
+    )
+
+    if count is None:
+        pairs = [tuple(row) for row in await session.execute(query)]
+        _rng.shuffle(pairs)
+        return pairs
+
+    # One subquery each, so SQLite reads both ends of the index and not
+    # every row of the game
+    low, high = (
+        await session.execute(
+            select(
+                *(
+                    select(aggregate(Participant.recipient_id))
+                    .where(Participant.game_id == game_id)
+                    .scalar_subquery()
+                    for aggregate in (func.min, func.max)
+                )
+            )
+        )
+    ).one()
+
+    if low is None:
+        return []
+
+    start = _rng.randint(low, high)
+    query = query.order_by(Participant.recipient_id)
+
+    pairs = [
+        tuple(row)
+        for row in await session.execute(
+            query.where(Participant.recipient_id >= start).limit(count)
+        )
+    ]
+    if len(pairs) < count:
+        pairs += [
+            tuple(row)
+            for row in await session.execute(
+                query.where(Participant.recipient_id < start).limit(count - len(pairs))
+            )
+        ]
+
+    _rng.shuffle(pairs)
+
+    return pairs
+
+
+async def _exclusions_of(session, ids: List[int]) -> List[Tuple[int, int]]:
+    """The (giver, recipient) pairs ruled out for the participants, both ways."""
+
+    rows = await session.execute(
+        select(Exclusion.participant_id, Exclusion.excluded_id).where(
+            or_(Exclusion.participant_id.in_(ids), Exclusion.excluded_id.in_(ids))
+        )
+    )
+
+    return [pair for a, b in rows for pair in ((a, b), (b, a))]
+
+
+async def remove_participant(
+    game_id: int, chat_id: str = None, participant_name: str = None
+) -> Optional[DrawRepair]:
+    """Delete the participant and their exclusions, and mend the draw.
+
+    The participant's giver takes over their recipient, or trades with
+    another pair when that is not allowed, so at most two rows change and
+    nobody else's pair does. Only when no pair works is the whole draw
+    cleared. Returns None when there was no such participant.
+    """
+
+    repair = None
+
+    if chat_id:
+        condition = Participant.chat_id == chat_id
+    else:
+        condition = Participant.normalized_name == normalize_name(participant_name)
+
+    async with _draw_lock(game_id), AsyncSession() as session:
         try:
-            if chat_id:
-                participant = get_participant(chat_id=chat_id)
-            else:
-                participant = get_participant(participant_name=participant_name)
+            row = (
+                await session.execute(
+                    delete(Participant)
+                    .where(Participant.game_id == game_id, condition)
+                    .returning(
+                        Participant.id,
+                        Participant.name,
+                        Participant.chat_id,
+                        Participant.recipient_id,
+                    )
+                )
+            ).first()
+
+            if row is None:
+                raise ValueError("The participant does not exist.")
+
+            participant_id, name, chat_id, recipient_id = row
+            repair = DrawRepair(participant_id, chat_id)
+
+            await session.execute(
+                delete(Exclusion).where(
+                    or_(
+                        Exclusion.participant_id == participant_id,
+                        Exclusion.excluded_id == participant_id,
+                    )
+                )
+            )
 
-            session.delete(participant)
-            session.commit()
-            deleted = True
+            if recipient_id is not None:
+                giver_id = await session.scalar(
+                    select(Participant.id).where(
+                        Participant.game_id == game_id,
+                        Participant.recipient_id == participant_id,
+                    )
+                )
+                changes = None
+
+                if giver_id is not None:
+                    exclusions = await _exclusions_of(session, [giver_id, recipient_id])
+                    changes = splice_out(giver_id, recipient_id, (), exclusions)
+
+                    for count in (SAMPLE_PAIRS, None):
+                        if changes is None:
+                            pairs = await _sample_pairs(
+                                session, game_id, [giver_id], count
+                            )
+                            changes = splice_out(
+                                giver_id, recipient_id, pairs, exclusions
+                            )
+
+                if changes is None:
+                    await session.execute(
+                        update(Participant)
+                        .where(Participant.game_id == game_id)
+                        .values(recipient_id=None)
+                    )
+                    repair.redraw = True
+                else:
+                    await _save_pairs(session, game_id, changes)
+                    repair.changes = changes
+
+            await session.commit()
+
+            if repair.redraw:
+                cache.clear()
+            for changed_id in [participant_id, *repair.changes]:
+                cache.invalidate(changed_id)
+            name_index.remove(game_id, name, participant_id)
 
         except:
+            repair = None
             try:
-                session.rollback()
+                await session.rollback()
             except:
                 pass
 
-    return deleted
+    return repair
+
+
+async def delete_participant(
+    game_id: int, chat_id: str = None, participant_name: str = None
+):
+    """Delete the participant and their exclusions in one transaction."""
 
+    repair = await remove_participant(
+        game_id, chat_id=chat_id, participant_name=participant_name
+    )
 
-def update_participant_recipient(participant: Participant, recipient: Participant):
-    with Session() as session:
-        participant = (
-            session.query(Participant).filter(Participant.id == participant.id).first()
+    return repair is not None
+
+
+async def add_to_draw(game_id: int, participant_id: int) -> DrawRepair:
+    """Give a participant who joined late a place in the game's draw.
+
+    One pair of the draw is split to take them in, so two rows change. When
+    the game has no draw yet nothing changes; when no pair allows it the
+    participant is left out and `redraw` is set.
+    """
+
+    repair = DrawRepair(participant_id, None)
+
+    async with _draw_lock(game_id), AsyncSession() as session:
+        try:
+            pairs = await _sample_pairs(session, game_id, [participant_id])
+
+            if pairs:
+                exclusions = await _exclusions_of(session, [participant_id])
+                changes = splice_in(participant_id, pairs, exclusions)
+
+                if changes is None:
+                    pairs = await _sample_pairs(
+                        session, game_id, [participant_id], None
+                    )
+                    changes = splice_in(participant_id, pairs, exclusions)
+
+                if changes is None:
+                    repair.redraw = True
+                else:
+                    await _save_pairs(session, game_id, changes)
+                    await session.commit()
+                    repair.changes = changes
+
+            for changed_id in repair.changes:
+                cache.invalidate(changed_id)
+
+        except:
+            repair.redraw = True
+            try:
+                await session.rollback()
+            except:
+                pass
+
+    return repair
+
+
+async def add_exclusion(participant: Participant, excluded: Participant) -> bool:
+    added = False
+
+    async with AsyncSession() as session:
+        try:
+            if participant.game_id != excluded.game_id:
+                raise ValueError("Participants are not in the same game.")
+
+            session.add(
+                Exclusion(participant_id=participant.id, excluded_id=excluded.id)
+            )
+            await session.commit()
+
+            added = True
+        except:
+            try:
+                await session.rollback()
+            except:
+                pass
+
+    return added
+
+
+async def get_exclusion_pairs(game_id: int) -> List[Tuple[int, int]]:
+    """Return the (giver_id, recipient_id) pairs that can not be drawn.
+
+    Exclusions go both ways, so every rule is returned in both directions.
+    """
+
+    async with AsyncSession() as session:
+        exclusions = await session.execute(
+            select(Exclusion.participant_id, Exclusion.excluded_id)
+            .join(Participant, Participant.id == Exclusion.participant_id)
+            .where(Participant.game_id == game_id)
         )
 
-        participant.recipient_id = recipient.id
-        session.commit()
-        session.refresh(participant)
+        pairs = []
+        for participant_id, excluded_id in exclusions:
+            pairs.append((participant_id, excluded_id))
+            pairs.append((excluded_id, participant_id))
 
+    return pairs
 
-def clean_recipients():
-    for participant in get_all_participants():
-        participant.recipient_id = None
-        update_participant(participant)
 
-    if any(
-        [participant.recipient_id is not None for participant in get_all_participants()]
-    ):
-        raise ValueError("No se limpiaron todos las parejas")
+async def save_assignment(game_id: int, assignment: Dict[int, int]) -> bool:
+    """Save a whole participant_id -> recipient_id draw in one transaction.
+
+    Each statement runs once with all the pairs (executemany). Whoever has one
+    of the new recipients loses it first, so the unique recipient_id can not
+    fail halfway through. Both lookups go through an index.
+    """
+
+    saved = False
+
+    async with _draw_lock(game_id), AsyncSession() as session:
+        try:
+            await _save_pairs(session, game_id, assignment)
+            await session.commit()
+            cache.clear()
+
+            saved = True
+        except:
+            try:
+                await session.rollback()
+            except:
+                pass
+
+    return saved
+
+
+async def _save_pairs(session, game_id: int, assignment: Dict[int, int]) -> None:
+    participants = Participant.__table__
+
+    pairs = [
+        {"game": game_id, "giver": giver, "recipient": recipient}
+        for giver, recipient in assignment.items()
+    ]
+
+    await session.execute(
+        update(participants)
+        .where(
+            participants.c.game_id == bindparam("game"),
+            participants.c.recipient_id == bindparam("recipient"),
+        )
+        .values(recipient_id=None),
+        pairs,
+    )
+    await session.execute(
+        update(participants)
+        .where(
+            participants.c.game_id == bindparam("game"),
+            participants.c.id == bindparam("giver"),
+        )
+        .values(recipient_id=bindparam("recipient")),
+        pairs,
+    )
+
+
+async def clean_recipients(game_id: int) -> int:
+    """Remove every pair with a single UPDATE and return how many were removed."""
+
+    async with _draw_lock(game_id), AsyncSession() as session:
+        result = await session.execute(
+            update(Participant)
+            .where(
+                Participant.game_id == game_id,
+                Participant.recipient_id.is_not(None),
+            )
+            .values(recipient_id=None)
+        )
+        await session.commit()
+
+    cache.clear()
+
+    return result.rowcount
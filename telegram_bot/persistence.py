@@ -0,0 +1,221 @@
+import asyncio
+import json
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram.ext import BasePersistence, PersistenceInput
+
+from secret_santa.database import AsyncSession
+from secret_santa.models import ChatData, ConversationState
+
+
+class ChatState:
+    """Per-chat data, the bot's context.chat_data.
+
+    A fixed set of slots instead of a dict: it takes less memory per chat
+    and maps one to one to a row of chat_data.
+    """
+
+    __slots__ = ("game_id", "choice", "participant_to_delete")
+
+    def __init__(
+        self,
+        game_id: int = None,
+        choice: str = None,
+        participant_to_delete: str = None,
+    ):
+        self.game_id = game_id
+        self.choice = choice
+        self.participant_to_delete = participant_to_delete
+
+    def __eq__(self, other):
+        return isinstance(other, ChatState) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"ChatState({values})"
+
+    def to_row(self, chat_id: int) -> Dict:
+        return {
+            "chat_id": chat_id,
+            **{name: getattr(self, name) for name in self.__slots__},
+        }
+
+
+class SQLitePersistence(BasePersistence):
+    """Keep chat states and conversation states in the bot's database.
+
+    Everything is loaded once at startup and then lives in memory. Changes
+    are written behind: the Application hands them over every
+    `update_interval` seconds (and when it stops), and they are saved
+    together, one upsert per table in a single transaction. Only the chats
+    and conversations that changed are written.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = None,
+        update_interval: float = 10,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=True, user_data=False, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+
+        self.session_factory = session_factory or AsyncSession
+
+        self._chats: Dict[int, Optional[ChatState]] = {}
+        self._conversations: Dict[Tuple[str, str], Optional[int]] = {}
+        self._lock = asyncio.Lock()
+
+    async def get_chat_data(self) -> Dict[int, ChatState]:
+        async with self.session_factory() as session:
+            rows = await session.scalars(select(ChatData))
+
+            return {
+                row.chat_id: ChatState(
+                    game_id=row.game_id,
+                    choice=row.choice,
+                    participant_to_delete=row.participant_to_delete,
+                )
+                for row in rows
+            }
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        async with self.session_factory() as session:
+            rows = await session.scalars(
+                select(ConversationState).where(ConversationState.name == name)
+            )
+
+            return {tuple(json.loads(row.key)): row.state for row in rows}
+
+    async def update_chat_data(self, chat_id: int, data: ChatState) -> None:
+        self._chats[chat_id] = data
+        await self._write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._chats[chat_id] = None
+        await self._write()
+
+    async def update_conversation(
+        self, name: str, key: tuple, new_state: Optional[object]
+    ) -> None:
+        self._conversations[(name, json.dumps(key))] = new_state
+        await self._write()
+
+    async def flush(self) -> None:
+        await self._write()
+
+    async def _write(self) -> None:
+        # The Application gathers the update methods at once. Yielding first
+        # lets all of them queue their change, then the first one to get the
+        # lock saves everything in one transaction and the rest find nothing
+        await asyncio.sleep(0)
+
+        async with self._lock:
+            chats, self._chats = self._chats, {}
+            conversations, self._conversations = self._conversations, {}
+
+            if not chats and not conversations:
+                return
+
+            try:
+                async with self.session_factory() as session:
+                    await self._save_chats(session, chats)
+                    await self._save_conversations(session, conversations)
+                    await session.commit()
+            except:
+                # Keep them for the next write, unless they changed meanwhile
+                for chat_id, state in chats.items():
+                    self._chats.setdefault(chat_id, state)
+                for key, state in conversations.items():
+                    self._conversations.setdefault(key, state)
+                raise
+
+    async def _save_chats(self, session, chats: Dict[int, Optional[ChatState]]):
+        updated = [
+            state.to_row(chat_id)
+            for chat_id, state in chats.items()
+            if state is not None
+        ]
+        dropped = [chat_id for chat_id, state in chats.items() if state is None]
+
+        if updated:
+            statement = insert(ChatData)
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[ChatData.chat_id],
+                    set_={
+                        name: statement.excluded[name] for name in ChatState.__slots__
+                    },
+                ),
+                updated,
+            )
+
+        if dropped:
+            await session.execute(delete(ChatData).where(ChatData.chat_id.in_(dropped)))
+
+    async def _save_conversations(
+        self, session, conversations: Dict[Tuple[str, str], Optional[int]]
+    ):
+        updated = [
+            {"name": name, "key": key, "state": state}
+            for (name, key), state in conversations.items()
+            if state is not None
+        ]
+        ended = [key for key, state in conversations.items() if state is None]
+
+        if updated:
+            statement = insert(ConversationState)
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[ConversationState.name, ConversationState.key],
+                    set_={"state": statement.excluded.state},
+                ),
+                updated,
+            )
+
+        if ended:
+            await session.execute(
+                delete(ConversationState).where(
+                    tuple_(ConversationState.name, ConversationState.key).in_(ended)
+                )
+            )
+
+    # Only chat data and conversations are stored
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
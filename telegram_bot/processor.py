@@ -0,0 +1,154 @@
+import asyncio
+from contextlib import nullcontext
+from time import monotonic
+from typing import Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update: object) -> Optional[Hashable]:
+    """The chat whose updates must run in order, None if there is none."""
+
+    if not isinstance(update, Update):
+        return None
+
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+
+    return None
+
+
+class UpdateQueue(asyncio.Queue):
+    """Update queue bounded by its updates plus those still being processed.
+
+    With concurrent updates the application empties its queue as fast as it
+    can, starting a task per update, so a plain maxsize is never reached.
+    Here an update counts from when it is put until the application marks
+    it done after processing it: put_nowait raises QueueFull, and put
+    waits, while `maxsize` updates are unfinished.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+
+        self.limit = maxsize
+        self.unfinished = 0
+        self._finished = asyncio.Event()
+
+    def full(self) -> bool:
+        return 0 < self.limit <= self.unfinished
+
+    def put_nowait(self, item: object) -> None:
+        # Queue.put_nowait checks full() first
+        super().put_nowait(item)
+        self.unfinished += 1
+
+    async def put(self, item: object) -> None:
+        while self.full():
+            self._finished.clear()
+            await self._finished.wait()
+
+        self.put_nowait(item)
+
+    def task_done(self) -> None:
+        super().task_done()
+        self.unfinished -= 1
+        self._finished.set()
+
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """Run updates from different chats concurrently, each chat in order.
+
+    An update waits for the previous update of its chat to finish, and then
+    for one of `parallelism` slots. A chat sending many messages only ever
+    holds one slot, so it can not slow down the others, and the
+    conversation states and chat_data of a chat never see two updates at
+    once.
+
+    `max_pending` bounds the updates waiting for a chat or a slot here. The
+    application takes every update off its queue right away and starts a
+    task for it, so the updates past that wait as tasks and the queue never
+    fills; to bound them, build the application with an UpdateQueue.
+    """
+
+    def __init__(self, parallelism: int = 8, max_pending: int = 256):
+        super().__init__(max(max_pending, parallelism))
+
+        if parallelism < 1:
+            raise ValueError("parallelism must be a positive integer")
+
+        self.parallelism = parallelism
+
+        self.running = 0
+        self.waiting = 0
+        self.waiting_max = 0
+        self.processed = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+        self._slots = asyncio.Semaphore(parallelism)
+        self._chats: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_pending: Dict[Hashable, int] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "parallelism": self.parallelism,
+            "running": self.running,
+            "waiting": self.waiting,
+            "waiting_max": self.waiting_max,
+            "chats": len(self._chats),
+            "processed": self.processed,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max,
+        }
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = chat_key(update)
+        lock = nullcontext()
+
+        if key is not None:
+            # The lock is created by the first pending update of the chat and
+            # dropped with the last one, so idle chats cost nothing
+            lock = self._chats.setdefault(key, asyncio.Lock())
+            self._chat_pending[key] = self._chat_pending.get(key, 0) + 1
+
+        queued_at = monotonic()
+        started = False
+        self.waiting += 1
+        self.waiting_max = max(self.waiting_max, self.waiting)
+
+        try:
+            async with lock, self._slots:
+                started = True
+                waited = monotonic() - queued_at
+                self.waiting -= 1
+                self.running += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+                    self.processed += 1
+
+        finally:
+            if not started:
+                self.waiting -= 1
+
+            if key is not None:
+                self._chat_pending[key] -= 1
+
+                if not self._chat_pending[key]:
+                    del self._chat_pending[key]
+                    del self._chats[key]
@@ -0,0 +1,56 @@
+import asyncio
+from time import monotonic
+from typing import Callable
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float = None,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` are available, 0 if they already are."""
+
+        self._refill()
+
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        self._refill()
+
+        if self.tokens < tokens:
+            return False
+
+        self.tokens -= tokens
+        return True
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take the tokens now, even on credit, and return the seconds to wait.
+
+        Callers that reserve one after the other are given growing waits, so
+        they go through at `rate` without racing for the same tokens.
+        """
+
+        self._refill()
+        self.tokens -= tokens
+
+        return max(0.0, -self.tokens / self.rate)
+
+    async def acquire(self, tokens: float = 1) -> None:
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
@@ -0,0 +1,123 @@
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+from telegram import Bot, InlineKeyboardMarkup, TelegramObject, Update
+from telegram.ext import Application
+
+from telegram_bot.utils import MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+_composer: ContextVar[Optional["ReplyComposer"]] = ContextVar(
+    "reply_composer", default=None
+)
+
+
+class ReplyComposer:
+    """Merge the messages a chat is sent in a row into as few as fit.
+
+    Texts are joined with a blank line while they fit in one message. A
+    reply keyboard, or its removal, changes the chat and not the message,
+    so a merged message takes the last one it was given. An inline keyboard
+    belongs to its message: it is only merged with the texts before it and
+    the next text starts a new message.
+
+    Telegram counts the length limit in UTF-16 code units, so an emoji
+    outside the BMP counts twice.
+    """
+
+    def __init__(self, separator: str = "\n\n", limit: int = MAX_MESSAGE_LENGTH):
+        self.separator = separator
+        self.limit = limit
+        self.closed = False
+
+        self.messages = []
+
+    def add(self, chat_id: int, text: str, reply_markup: TelegramObject = None):
+        if self.messages:
+            message = self.messages[-1]
+            last_chat_id, last_text, last_markup = message
+
+            if (
+                last_chat_id == chat_id
+                and _length(last_text + self.separator + text) <= self.limit
+                and not isinstance(last_markup, InlineKeyboardMarkup)
+                and (
+                    last_markup is None
+                    or not isinstance(reply_markup, InlineKeyboardMarkup)
+                )
+            ):
+                message[1] = last_text + self.separator + text
+                if reply_markup is not None:
+                    message[2] = reply_markup
+
+                return
+
+        self.messages.append([chat_id, text, reply_markup])
+
+    async def flush(self, bot: Bot) -> int:
+        """Send the pending messages and return how many were sent.
+
+        A message that fails is logged and the rest are still sent.
+        """
+
+        messages, self.messages = self.messages, []
+        sent = 0
+
+        for chat_id, text, reply_markup in messages:
+            try:
+                await bot.send_message(
+                    chat_id=chat_id, text=text, reply_markup=reply_markup
+                )
+                sent += 1
+            except Exception:
+                logger.exception("Could not send the reply to %s", chat_id)
+
+        return sent
+
+
+def _length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+async def reply(update: Update, text: str, reply_markup: TelegramObject = None):
+    """Reply in the chat of the update, merged with the update's other replies.
+
+    The replies are sent when the handlers of the update are done. Outside
+    of a ComposingApplication, or from a task that outlives the update, the
+    reply goes out right away.
+    """
+
+    composer = _composer.get()
+
+    if composer is None or composer.closed:
+        await update.get_bot().send_message(
+            chat_id=update.effective_chat.id, text=text, reply_markup=reply_markup
+        )
+    else:
+        composer.add(update.effective_chat.id, text, reply_markup)
+
+
+class ComposingApplication(Application):
+    """Application that sends the replies of each update together.
+
+    Handlers reply with `reply`; once every handler of the update ran, the
+    replies are merged and sent, usually as a single message, which saves a
+    round trip to Telegram for each message that was merged.
+    """
+
+    async def process_update(self, update: object) -> None:
+        composer = ReplyComposer()
+        token = _composer.set(composer)
+
+        try:
+            await super().process_update(update)
+        finally:
+            _composer.reset(token)
+            composer.closed = True
+
+            try:
+                await composer.flush(self.bot)
+            except Exception as error:
+                await self.process_error(update, error)
@@ -9,6 +9,21 @@ from enum import Enum
     CONFIRM_DELETE_PARTICIPANT,
 ) = range(5)
 
+# Labels of the states in the metrics
+STATE_NAMES = {
+    CHOOSING: "CHOOSING",
+    TYPING_REPLY: "TYPING_REPLY",
+    TYPING_NAME: "TYPING_NAME",
+    DELETE_PARTICIPANT: "DELETE_PARTICIPANT",
+    CONFIRM_DELETE_PARTICIPANT: "CONFIRM_DELETE_PARTICIPANT",
+}
+
+# Game for the chats that have not picked one with /juego
+DEFAULT_GAME_NAME = "Niño Jesús Secreto"
+
+# Telegram shows at most 50 results of an inline query
+INLINE_RESULTS = 50
+
 conv_enders = [
     "Adios",
     "adios",
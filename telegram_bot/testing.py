@@ -0,0 +1,169 @@
+"""Offline stand-ins for Telegram, for tests, benchmarks and load tests."""
+
+import asyncio
+import json
+from collections import Counter
+from itertools import count
+from time import time
+from typing import Dict, List, Tuple
+
+from telegram import Bot, Update
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Secret Santa",
+    "username": "secret_santa_bot",
+}
+
+
+class FakeRequest(BaseRequest):
+    """Bot API transport that answers every call locally.
+
+    Messages sent through it are recorded in `calls`, and `latency` simulates
+    the round trip to Telegram. Sending to a chat in `blocked` fails the way
+    it does when the user blocked the bot.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.blocked = set()
+        self.calls = []
+        self.counts = Counter()
+
+        self._message_ids = count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def sent_messages(self) -> List[Dict]:
+        return [params for method, params in self.calls if method == "sendMessage"]
+
+    def _message(self, params: Dict) -> Dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def _result(self, method: str, params: Dict):
+        if method == "getMe":
+            return BOT_USER
+
+        if method == "getUpdates":
+            return []
+
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            return self._message(params)
+
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+
+        self.calls.append((api_method, params))
+        self.counts[api_method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if str(params.get("chat_id")) in self.blocked:
+            body = {
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            }
+            return 403, json.dumps(body).encode()
+
+        body = {"ok": True, "result": self._result(api_method, params)}
+
+        return 200, json.dumps(body).encode()
+
+
+def message_update_data(update_id: int, chat_id: int, text: str) -> Dict:
+    """Return the JSON Telegram would send for a private text message."""
+
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+    message = {
+        "message_id": update_id,
+        "date": int(time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+        "from": user,
+        "text": text,
+    }
+
+    if text.startswith("/"):
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+        ]
+
+    return {"update_id": update_id, "message": message}
+
+
+def message_update(update_id: int, chat_id: int, text: str, bot: Bot) -> Update:
+    return Update.de_json(message_update_data(update_id, chat_id, text), bot)
+
+
+def callback_query_update_data(
+    update_id: int, chat_id: int, data: str, message_id: int = 1
+) -> Dict:
+    """Return the JSON Telegram would send when an inline button is pressed."""
+
+    user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+    message = {
+        "message_id": message_id,
+        "date": int(time()),
+        "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+        "from": BOT_USER,
+        "text": "",
+    }
+
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(chat_id),
+            "message": message,
+            "data": data,
+        },
+    }
+
+
+def callback_query_update(update_id: int, chat_id: int, data: str, bot: Bot) -> Update:
+    return Update.de_json(callback_query_update_data(update_id, chat_id, data), bot)
+
+
+def inline_query_update_data(update_id: int, user_id: int, query: str) -> Dict:
+    """Return the JSON Telegram would send for "@bot <query>"."""
+
+    return {
+        "update_id": update_id,
+        "inline_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "query": query,
+            "offset": "",
+        },
+    }
+
+
+def inline_query_update(update_id: int, user_id: int, query: str, bot: Bot) -> Update:
+    return Update.de_json(inline_query_update_data(update_id, user_id, query), bot)
@@ -1,6 +1,12 @@
-from typing import List
+from functools import lru_cache
+from typing import Iterable, List, Sequence, Tuple
 
-from telegram import ReplyKeyboardMarkup, KeyboardButton
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
 
 from telegram_bot.settings import KeyboardOptions
 
@@ -8,15 +14,22 @@ from telegram_bot.settings import KeyboardOptions
 def create_keyboard(
     options: List[str | KeyboardOptions] = list(KeyboardOptions),
 ):
-    keyboard = []
-    row = []
-
     options = (
         [option.value for option in options]
         if isinstance(options[0], KeyboardOptions)
         else options
     )
 
+    return _create_keyboard(tuple(options))
+
+
+# The main menu goes out with almost every reply. Telegram objects are
+# immutable, so the same markup can be sent again and again.
+@lru_cache(maxsize=32)
+def _create_keyboard(options: Tuple[str, ...]) -> ReplyKeyboardMarkup:
+    keyboard = []
+    row = []
+
     for i, item in enumerate(options):
         row.append(KeyboardButton(item))
 
@@ -28,3 +41,96 @@ def create_keyboard(
         keyboard.append(row)
 
     return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
+
+
+def create_page_keyboard(
+    entries: Sequence[Tuple[str, str, int]],
+    page: int,
+    prefix: str,
+    page_size: int = 8,
+) -> InlineKeyboardMarkup:
+    """One page of an inline keyboard over a sorted (_, name, id) list.
+
+    Picking a name sends "<prefix>:pick:<id>" and the arrows send
+    "<prefix>:page:<page>". Only the entries of the page are read.
+    """
+
+    pages = max(1, -(-len(entries) // page_size))
+    page = min(max(page, 0), pages - 1)
+
+    keyboard = [
+        [InlineKeyboardButton(name, callback_data=f"{prefix}:pick:{participant_id}")]
+        for _, name, participant_id in entries[
+            page * page_size : (page + 1) * page_size
+        ]
+    ]
+
+    arrows = []
+    if page > 0:
+        arrows.append(
+            InlineKeyboardButton(
+                "« Anterior", callback_data=f"{prefix}:page:{page - 1}"
+            )
+        )
+    if page < pages - 1:
+        arrows.append(
+            InlineKeyboardButton(
+                "Siguiente »", callback_data=f"{prefix}:page:{page + 1}"
+            )
+        )
+    if arrows:
+        keyboard.append(arrows)
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# Telegram rejects longer text messages
+MAX_MESSAGE_LENGTH = 4096
+
+
+class MessageChunker:
+    """Join parts into as few messages as fit Telegram's length limit.
+
+    Parts are fed in as they arrive and every message is handed back as soon
+    as it is full, so a long list never has to be in memory at once. A part
+    longer than a whole message is split.
+    """
+
+    def __init__(
+        self, prefix: str = "", separator: str = ", ", limit: int = MAX_MESSAGE_LENGTH
+    ):
+        self.separator = separator
+        self.limit = limit
+
+        self._message = prefix
+        self._empty = True
+
+    def add(self, parts: Iterable[str]) -> List[str]:
+        """Add the parts and return the messages that got full."""
+
+        full = []
+
+        for part in parts:
+            separator = "" if self._empty else self.separator
+
+            if len(self._message) + len(separator) + len(part) > self.limit:
+                if not self._empty:
+                    full.append(self._message)
+                    self._message, separator = "", ""
+
+                while len(self._message) + len(part) > self.limit:
+                    cut = self.limit - len(self._message)
+                    full.append(self._message + part[:cut])
+                    self._message, part = "", part[cut:]
+
+            self._message += separator + part
+            self._empty = False
+
+        return full
+
+    def flush(self) -> List[str]:
+        """Return the last message, if anything is left."""
+
+        message, self._message, self._empty = self._message, "", True
+
+        return [message] if message else []
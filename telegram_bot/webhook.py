@@ -0,0 +1,205 @@
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+from http import HTTPStatus
+from typing import Dict, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1024 * 1024
+
+Response = Tuple[HTTPStatus, Dict[str, str], bytes]
+
+
+def response(status: HTTPStatus, body: bytes = b"", **headers: str) -> Response:
+    return status, headers, body or status.phrase.encode()
+
+
+class WebhookServer:
+    """Receive updates from Telegram over HTTP and queue them for the app.
+
+    Updates are put straight into app.update_queue. When it is bounded (an
+    UpdateQueue, if updates run concurrently) and full, the server answers
+    503 with Retry-After, and Telegram sends the update again later instead
+    of the bot running out of memory. Requests without the secret token set
+    with setWebhook get a 403. Without a token, or with an empty one, a
+    random one is made, so the webhook is never open to anybody.
+    """
+
+    def __init__(
+        self,
+        app: Application,
+        path: str = "/webhook",
+        secret_token: str = None,
+        listen: str = "0.0.0.0",
+        port: int = 8443,
+        retry_after: int = 1,
+    ):
+        self.app = app
+        self.path = path
+        self.secret_token = secret_token or secrets.token_urlsafe(32)
+        self.listen = listen
+        self.port = port
+        self.retry_after = retry_after
+
+        self.received = 0
+        self.rejected = 0
+
+        self._server = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._serve_connection, self.listen, self.port
+        )
+
+        # The actual port when it was 0
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Listening on %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def handle(
+        self, method: str, path: str, headers: Dict[str, str], body: bytes
+    ) -> Response:
+        """Answer one request; `headers` have lowercase names."""
+
+        if path != self.path:
+            return response(HTTPStatus.NOT_FOUND)
+
+        if method != "POST":
+            return response(HTTPStatus.METHOD_NOT_ALLOWED, Allow="POST")
+
+        if not hmac.compare_digest(
+            headers.get(SECRET_TOKEN_HEADER, "").encode(), self.secret_token.encode()
+        ):
+            return response(HTTPStatus.FORBIDDEN)
+
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except Exception:
+            return response(HTTPStatus.BAD_REQUEST)
+
+        if update is None:
+            return response(HTTPStatus.BAD_REQUEST)
+
+        try:
+            self.app.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return response(
+                HTTPStatus.SERVICE_UNAVAILABLE, **{"Retry-After": str(self.retry_after)}
+            )
+
+        self.received += 1
+
+        return response(HTTPStatus.OK)
+
+    async def _serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # HTTP/1.1 with keep-alive, Telegram reuses its connections
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+
+                if length > MAX_BODY_SIZE:
+                    status, response_headers, body = response(
+                        HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+                    )
+                    response_headers["Connection"] = "close"
+                else:
+                    status, response_headers, body = await self.handle(
+                        method,
+                        path.split("?", 1)[0],
+                        headers,
+                        await reader.readexactly(length),
+                    )
+
+                head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+                head += [f"{name}: {value}" for name, value in response_headers.items()]
+                head += ["Content-Type: text/plain", f"Content-Length: {len(body)}"]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+
+                if (
+                    response_headers.get("Connection") == "close"
+                    or headers.get("connection", "").lower() == "close"
+                ):
+                    break
+
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+
+async def run_webhook(
+    app: Application,
+    server: WebhookServer,
+    url: str,
+    max_connections: int = 40,
+) -> None:
+    """Run the bot behind `server` until SIGINT or SIGTERM.
+
+    `url` is the public address Telegram posts to, usually a reverse proxy in
+    front of the server.
+    """
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    async with app:
+        await app.bot.set_webhook(
+            url=url,
+            secret_token=server.secret_token,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        # Called at the same points as run_polling does
+        if app.post_init is not None:
+            await app.post_init(app)
+
+        await app.start()
+        await server.start()
+
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+
+            if app.post_stop is not None:
+                await app.post_stop(app)
+
+    if app.post_shutdown is not None:
+        await app.post_shutdown(app)
@@ -1,5 +1,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(DATABASE_URL)
@@ -10,3 +12,13 @@ Session = sessionmaker(
     bind=engine,
     expire_on_commit=False,
 )
+
+# A single shared connection, otherwise every session gets its own empty
+# in-memory database
+async_engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+
+AsyncSession = async_sessionmaker(
+    autoflush=False,
+    bind=async_engine,
+    expire_on_commit=False,
+)
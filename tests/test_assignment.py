@@ -0,0 +1,73 @@
+import unittest
+from collections import Counter
+from pathlib import Path
+from random import Random
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from secret_santa.assignment import assign, derangement, single_cycle
+
+
+class TestAssignment(unittest.TestCase):
+    def setUp(self):
+        self.rng = Random(1234)
+        self.ids = list(range(1, 11))
+
+    def assert_valid_assignment(self, ids, assignment):
+        self.assertEqual(set(assignment), set(ids))
+        self.assertEqual(set(assignment.values()), set(ids))
+        self.assertTrue(
+            all(giver != recipient for giver, recipient in assignment.items())
+        )
+
+    def count_loops(self, assignment):
+        loops = 0
+        pending = set(assignment)
+
+        while pending:
+            loops += 1
+            participant = pending.pop()
+
+            while assignment[participant] in pending:
+                participant = assignment[participant]
+                pending.remove(participant)
+
+        return loops
+
+    def test_derangement_is_valid(self):
+        for _ in range(100):
+            self.assert_valid_assignment(self.ids, derangement(self.ids, rng=self.rng))
+
+    def test_single_cycle_is_one_loop(self):
+        for _ in range(100):
+            assignment = single_cycle(self.ids, rng=self.rng)
+
+            self.assert_valid_assignment(self.ids, assignment)
+            self.assertEqual(self.count_loops(assignment), 1)
+
+    def test_derangement_is_uniform(self):
+        # There are 9 derangements of 4 participants
+        draws = Counter(
+            tuple(sorted(derangement(range(4), rng=self.rng).items()))
+            for _ in range(9000)
+        )
+
+        self.assertEqual(len(draws), 9)
+        self.assertTrue(all(800 < count < 1200 for count in draws.values()))
+
+    def test_two_participants_swap(self):
+        self.assertEqual(assign(["a", "b"], rng=self.rng), {"a": "b", "b": "a"})
+
+    def test_large_draw(self):
+        ids = list(range(50_000))
+
+        self.assert_valid_assignment(ids, assign(ids, rng=self.rng))
+        self.assert_valid_assignment(ids, assign(ids, single_loop=True, rng=self.rng))
+
+    def test_invalid_ids(self):
+        with self.assertRaises(ValueError):
+            assign([1])
+
+        with self.assertRaises(ValueError):
+            assign([1, 2, 2])
@@ -0,0 +1,438 @@
+import asyncio
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram.ext import Application
+
+from secret_santa.database import Base, QueryCounter
+from secret_santa.matching import InfeasibleAssignment
+from telegram_bot import models, settings
+from telegram_bot.jobs import DrawJob, DrawRunner
+from telegram_bot.metrics import QueryMetrics
+from telegram_bot.testing import (
+    FakeRequest,
+    callback_query_update,
+    inline_query_update,
+    message_update,
+)
+from tests.database import AsyncSession, async_engine
+
+import run_telegram_bot
+
+
+class TestBot(unittest.IsolatedAsyncioTestCase):
+    """Conversations through the Application, with Telegram faked locally."""
+
+    async def asyncSetUp(self):
+        async with async_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        patcher = patch("telegram_bot.models.AsyncSession", AsyncSession)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("telegram_bot.models.cache", models.ParticipantCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("telegram_bot.models.name_index", models.NameIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.request = FakeRequest()
+        self.app = run_telegram_bot.build_application(
+            Application.builder()
+            .token("1:TEST")
+            .request(self.request)
+            .get_updates_request(FakeRequest())
+        )
+        await self.app.initialize()
+
+        self.update_id = 0
+
+    async def asyncTearDown(self):
+        await self.app.shutdown()
+        await async_engine.dispose()
+
+    async def send(self, chat_id: int, text: str) -> list:
+        """Process a message and return the texts the bot replied with."""
+
+        sent = len(self.request.sent_messages)
+        self.update_id += 1
+
+        await self.app.process_update(
+            message_update(self.update_id, chat_id, text, self.app.bot)
+        )
+
+        return [message["text"] for message in self.request.sent_messages[sent:]]
+
+    async def test_registration(self):
+        # Both lines of the greeting go out in one message
+        replies = await self.send(10, "/hola")
+        self.assertEqual(
+            replies,
+            ["¡Hola! Bienvenido al juego de Niño Jesús Secreto\n\n¿Cómo te llamas?"],
+        )
+
+        replies = await self.send(10, "Ana")
+        self.assertIn("te acabo de registrar", replies[0])
+
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+        participant = await models.get_participant(game_id, chat_id=10)
+        self.assertEqual(participant.name, "Ana")
+
+        replies = await self.send(10, settings.KeyboardOptions.GET_PARTICIPANT.value)
+        self.assertEqual(
+            replies,
+            [
+                "Te llamas Ana y todavía no tienes preferencias\n\n¿Quieres hacer algo más?"
+            ],
+        )
+
+    async def test_get_recipient_queries(self):
+        for chat_id, name in enumerate(["Ana", "Beto", "Carla"], start=10):
+            await self.send(chat_id, "/hola")
+            await self.send(chat_id, name)
+
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+        ids = [
+            participant.id for participant in await models.get_all_participants(game_id)
+        ]
+        await models.save_assignment(game_id, dict(zip(ids, ids[1:] + ids[:1])))
+        models.cache.clear()
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            replies = await self.send(10, settings.KeyboardOptions.GET_RECIPIENT.value)
+
+        # The participant, then the participant joined with their recipient
+        self.assertEqual(counter.count, 2)
+        self.assertIn("Tu pareja es Beto y todavía no tiene preferencias", replies[0])
+
+    async def test_long_participant_list(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for i in range(400):
+            await models.create_participant(
+                game_id, chat_id=str(i), name=f"Participante con nombre largo {i:03}"
+            )
+
+        replies = await self.send(10, "/participantes")
+
+        self.assertGreater(len(replies), 1)
+        self.assertTrue(all(len(reply) <= 4096 for reply in replies))
+        self.assertTrue(replies[0].startswith("Por ahora hay 400 participantes: "))
+        self.assertTrue(replies[-1].endswith("Participante con nombre largo 399"))
+
+    async def press(self, chat_id: int, data: str) -> list:
+        """Press an inline button and return the texts the bot replied with."""
+
+        sent = len(self.request.sent_messages)
+        self.update_id += 1
+
+        await self.app.process_update(
+            callback_query_update(self.update_id, chat_id, data, self.app.bot)
+        )
+
+        return [message["text"] for message in self.request.sent_messages[sent:]]
+
+    async def test_delete_participant_from_pages(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for i in range(20):
+            await models.create_participant(
+                game_id, chat_id=str(i), name=f"Participante {i:02}"
+            )
+
+        await self.send(10, "/eliminar_participante")
+        keyboard = self.request.sent_messages[-1]["reply_markup"]["inline_keyboard"]
+        self.assertEqual(keyboard[0][0]["text"], "Participante 00")
+        self.assertEqual(keyboard[-1][0]["callback_data"], "delete:page:1")
+
+        await self.press(10, "delete:page:2")
+        method, params = self.request.calls[-1]
+        self.assertEqual(method, "editMessageReplyMarkup")
+        self.assertEqual(
+            params["reply_markup"]["inline_keyboard"][0][0]["text"], "Participante 16"
+        )
+
+        participant = await models.get_participant(game_id, chat_id="17")
+        replies = await self.press(10, f"delete:pick:{participant.id}")
+        self.assertEqual(
+            replies, ["¿Seguro que quieres eliminar al participante Participante 17?"]
+        )
+
+        replies = await self.send(10, "Si")
+        self.assertTrue(replies[-1].startswith("El participante Participante 17 fue"))
+        self.assertIsNone(await models.get_participant(game_id, chat_id="17"))
+        self.assertEqual(len(await models.get_name_index(game_id)), 19)
+
+        # The buttons of the old list are still answered
+        await self.press(10, "delete:page:0")
+        self.assertEqual(self.request.calls[-1][0], "answerCallbackQuery")
+
+    async def test_delete_participant_by_typed_name(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for chat_id, name in enumerate(["Ana María", "Andrés", "Beto"]):
+            await models.create_participant(game_id, chat_id=str(chat_id), name=name)
+
+        await self.send(10, "/eliminar_participante")
+        await models.get_name_index(game_id)
+
+        # Written differently, found without going to the database
+        with QueryCounter(async_engine.sync_engine) as counter:
+            replies = await self.send(10, "andres")
+
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(
+            replies, ["¿Seguro que quieres eliminar al participante Andrés?"]
+        )
+        await self.send(10, "No")
+
+        # Unknown names get the closest ones to pick from
+        await self.send(10, "/eliminar_participante")
+        replies = await self.send(10, "Bato")
+        self.assertEqual(replies, ["No encontré a Bato, ¿es alguno de estos?"])
+        keyboard = self.request.sent_messages[-1]["reply_markup"]["inline_keyboard"]
+        self.assertEqual([row[0]["text"] for row in keyboard], ["Beto"])
+
+    async def test_rename_to_a_taken_name(self):
+        for chat_id, name in [(10, "Ana"), (11, "José")]:
+            await self.send(chat_id, "/hola")
+            await self.send(chat_id, name)
+
+        await self.send(10, settings.KeyboardOptions.EDIT_NAME.value)
+        replies = await self.send(10, "jose")
+
+        self.assertIn("ya alguien se registró con ese nombre", replies[0])
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+        ana = await models.get_participant(game_id, chat_id="10")
+        self.assertEqual(ana.name, "Ana")
+
+    async def test_delete_participant_keeps_the_draw(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for chat_id, name in enumerate(["Ana", "Beto", "Carla", "Dani"], start=1):
+            await models.create_participant(game_id, chat_id=str(chat_id), name=name)
+
+        a, b, c, d = [
+            (await models.get_participant(game_id, chat_id=str(chat_id))).id
+            for chat_id in range(1, 5)
+        ]
+        await models.save_assignment(game_id, {a: b, b: c, c: d, d: a})
+
+        await self.send(10, "/eliminar_participante")
+        await self.send(10, "Carla")
+        sent = len(self.request.sent_messages)
+        await self.send(10, "Si")
+
+        # Carla and Beto, who gave to her, hear about it; nobody else does
+        self.assertEqual(
+            sorted(
+                str(message["chat_id"]) for message in self.request.sent_messages[sent:]
+            ),
+            ["10", "2", "3"],
+        )
+        beto = await models.get_participant(game_id, chat_id="2")
+        self.assertEqual(beto.recipient_id, d)
+
+    async def test_delete_participant_who_blocked_the_bot(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for chat_id, name in enumerate(["Ana", "Beto", "Carla", "Dani"], start=1):
+            await models.create_participant(game_id, chat_id=str(chat_id), name=name)
+
+        a, b, c, d = [
+            (await models.get_participant(game_id, chat_id=str(chat_id))).id
+            for chat_id in range(1, 5)
+        ]
+        await models.save_assignment(game_id, {a: b, b: c, c: d, d: a})
+        self.request.blocked.add("3")
+
+        await self.send(10, "/eliminar_participante")
+        await self.send(10, "Carla")
+        with self.assertLogs("run_telegram_bot", "WARNING"):
+            replies = await self.send(10, "Si")
+
+        # Beto still hears about Dani and the admin gets the confirmation
+        self.assertIn("fue eliminado", replies[-1])
+        self.assertIn(
+            "2", [str(message["chat_id"]) for message in self.request.sent_messages]
+        )
+
+    async def test_late_registration_joins_the_draw(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for chat_id, name in enumerate(["Ana", "Beto", "Carla", "Dani"], start=1):
+            await models.create_participant(game_id, chat_id=str(chat_id), name=name)
+
+        ids = [
+            (await models.get_participant(game_id, chat_id=str(chat_id))).id
+            for chat_id in range(1, 5)
+        ]
+        await models.save_assignment(game_id, dict(zip(ids, ids[1:] + ids[:1])))
+
+        await self.send(10, "/hola")
+        sent = len(self.request.sent_messages)
+        await self.send(10, "Eva")
+        messages = self.request.sent_messages[sent:]
+
+        replies = [m["text"] for m in messages if str(m["chat_id"]) == "10"]
+        self.assertIn("ya te asigné una", replies[0])
+        eva = await models.get_participant(game_id, chat_id=10)
+        self.assertIsNotNone(await models.get_participant_recipient(eva))
+
+        # Besides Eva, only whoever now gives to her is told
+        giver = await models.get_participant_whose_recipient_is_participant(eva)
+        self.assertEqual(
+            [str(m["chat_id"]) for m in messages if str(m["chat_id"]) != "10"],
+            [giver.chat_id],
+        )
+
+    async def test_preference_changes_are_notified_once(self):
+        for chat_id, name in enumerate(["Ana", "Beto", "Carla"], start=10):
+            await self.send(chat_id, "/hola")
+            await self.send(chat_id, name)
+
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+        ids = [
+            participant.id for participant in await models.get_all_participants(game_id)
+        ]
+        await models.save_assignment(game_id, dict(zip(ids, ids[1:] + ids[:1])))
+
+        notices = self.app.bot_data["preference_notices"]
+        notices.delay = 0.3
+        sent = len(self.request.sent_messages)
+
+        # Beto edits three times in a row
+        for preferences in ("Talla M", "Talla M, libros", "Talla L, libros"):
+            await self.send(11, settings.KeyboardOptions.EDIT_PREFS.value)
+            await self.send(11, preferences)
+
+        to_ana = lambda: [
+            message
+            for message in self.request.sent_messages[sent:]
+            if str(message["chat_id"]) == "10"
+        ]
+        self.assertEqual(to_ana(), [])
+
+        await asyncio.sleep(0.4)
+
+        self.assertEqual(len(to_ana()), 1)
+        self.assertIn("actualizar sus preferencias", to_ana()[0]["text"])
+        self.assertEqual(notices.merged, 2)
+
+    async def test_search_participant_inline(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+
+        for chat_id, name in enumerate(["Ana María", "Andrés", "Beto"]):
+            await models.create_participant(game_id, chat_id=str(chat_id), name=name)
+
+        self.update_id += 1
+        await self.app.process_update(
+            inline_query_update(self.update_id, 10, "an", self.app.bot)
+        )
+
+        method, params = self.request.calls[-1]
+        self.assertEqual(method, "answerInlineQuery")
+        self.assertEqual(
+            [result["title"] for result in params["results"]], ["Ana María", "Andrés"]
+        )
+        self.assertEqual(
+            params["results"][1]["input_message_content"]["message_text"], "Andrés"
+        )
+
+    async def test_flood_is_dropped(self):
+        burst = int(run_telegram_bot.CHAT_UPDATE_BURST)
+
+        for _ in range(burst):
+            await self.send(10, "hola")
+
+        self.assertIn("muy rápido", (await self.send(10, "hola"))[0])
+        self.assertEqual(await self.send(10, "hola"), [])
+
+        # Others still get their replies
+        self.assertEqual(len(await self.send(20, "hola")), 1)
+        self.assertEqual(self.app.bot_data["flood_control"].dropped_chat, 2)
+
+    async def test_handler_metrics(self):
+        metrics = run_telegram_bot.metrics
+        query_metrics = QueryMetrics(metrics)
+        query_metrics.attach(async_engine.sync_engine)
+        self.addCleanup(query_metrics.detach)
+
+        def runs(state, handler):
+            histogram = metrics.get("handler_queries", state=state, handler=handler)
+            return (histogram.count, histogram.sum) if histogram else (0, 0)
+
+        before = runs("TYPING_NAME", "register_participant")
+
+        await self.send(10, "/hola")
+        await self.send(10, "Ana")
+
+        count, queries = runs("TYPING_NAME", "register_participant")
+        self.assertEqual(count, before[0] + 1)
+        self.assertGreater(queries, before[1])
+        self.assertIn(
+            'handler_seconds_count{state="ENTRY",handler="start_command"}',
+            metrics.render(),
+        )
+
+    async def test_infeasible_draw_names_some_givers(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+        for i in range(200):
+            await models.create_participant(
+                game_id, chat_id=str(i), name=f"Participante con un nombre largo {i}"
+            )
+        ids = [
+            participant.id for participant in await models.get_all_participants(game_id)
+        ]
+
+        async def solve(job):
+            # The first giver was deleted while the draw ran
+            raise InfeasibleAssignment([-1] + ids[1:], ids[:1])
+
+        with patch.object(run_telegram_bot.draw_runner, "solve", solve):
+            with self.assertRaises(InfeasibleAssignment):
+                await run_telegram_bot.run_draw(
+                    DrawJob(game_id, ids, []), "10", self.app.bot_data["broadcaster"]
+                )
+
+        text = self.request.sent_messages[-1]["text"]
+        self.assertLess(len(text), 4096)
+        self.assertIn("exclusiones actuales: -1, Participante", text)
+        self.assertIn("y 180 más solo pueden darle regalo a 1 personas", text)
+
+    async def test_start_game_while_shutting_down(self):
+        game_id = (await models.get_or_create_game(settings.DEFAULT_GAME_NAME)).id
+        for i in range(4):
+            await models.create_participant(game_id, chat_id=str(i), name=f"P{i}")
+
+        runner = DrawRunner()
+        runner.shutdown()
+
+        with patch.object(run_telegram_bot, "draw_runner", runner):
+            replies = await self.send(10, "/iniciar_juego")
+
+        self.assertIn("El bot se está apagando", replies[0])
+        self.assertIsNone(runner.get(game_id))
+
+    async def test_query_counter(self):
+        await self.send(10, "/hola")
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            await self.send(10, "Ana")
+
+        self.assertGreater(counter.count, 0)
+        self.assertEqual(counter.count, len(counter.statements))
+        self.assertTrue(
+            any(statement.startswith("INSERT") for statement in counter.statements)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,608 @@
+import asyncio
+import tempfile
+import unittest
+from difflib import get_close_matches
+from pathlib import Path
+from unittest.mock import patch
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from secret_santa.models import Participant, normalize_name
+from secret_santa.database import Base, QueryCounter
+from telegram_bot import models
+from tests.database import AsyncSession, async_engine
+
+
+class TestBotModels(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        async with async_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        patcher = patch("telegram_bot.models.AsyncSession", AsyncSession)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("telegram_bot.models.cache", models.ParticipantCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("telegram_bot.models.name_index", models.NameIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.game_id = (await models.get_or_create_game("Some game")).id
+
+        for i in range(1, 6):
+            await models.create_participant(
+                self.game_id, chat_id=str(i), name=f"Participant {i}"
+            )
+
+        self.ids = [
+            participant.id
+            for participant in await models.get_all_participants(self.game_id)
+        ]
+
+    async def asyncTearDown(self):
+        await async_engine.dispose()
+
+    async def get_pairs(self):
+        async with AsyncSession() as session:
+            pairs = await session.execute(
+                select(Participant.id, Participant.recipient_id)
+            )
+
+            return dict(pairs.all())
+
+    async def test_create_participant_with_taken_name(self):
+        self.assertFalse(
+            await models.create_participant(
+                self.game_id, chat_id="6", name="participant 1"
+            )
+        )
+        self.assertEqual(
+            len(await models.get_all_participants(self.game_id)), len(self.ids)
+        )
+
+    async def test_create_participant_with_name_written_differently(self):
+        for name in ("PARTICIPANT 1", "  participant   1 ", "Pártícipant 1"):
+            self.assertFalse(
+                await models.create_participant(self.game_id, chat_id="6", name=name)
+            )
+
+        self.assertTrue(
+            await models.create_participant(self.game_id, chat_id="6", name="Ana")
+        )
+
+    async def test_create_participant_twice_in_same_chat(self):
+        self.assertFalse(
+            await models.create_participant(self.game_id, chat_id="1", name="Ana")
+        )
+
+    async def test_get_participant(self):
+        participant = await models.get_participant(self.game_id, chat_id="2")
+
+        self.assertEqual(participant.name, "Participant 2")
+        self.assertEqual(
+            await models.get_participant(
+                self.game_id, participant_name="Participant 2"
+            ),
+            participant,
+        )
+        self.assertIsNone(await models.get_participant(self.game_id, chat_id="100"))
+        self.assertEqual(
+            await models.get_participant(
+                self.game_id, participant_name="participant  2"
+            ),
+            participant,
+        )
+
+    async def test_participant_names(self):
+        await models.create_participant(self.game_id, chat_id="6", name="Ana")
+        await models.create_participant(self.game_id, chat_id="7", name="Álvaro")
+
+        names = ["Álvaro", "Ana"] + [f"Participant {i}" for i in range(1, 6)]
+
+        self.assertEqual(await models.count_participants(self.game_id), 7)
+        self.assertEqual(await models.get_participant_names(self.game_id), names)
+        self.assertEqual(
+            await models.get_participant_names(self.game_id, after="ana", limit=2),
+            names[2:4],
+        )
+        self.assertEqual(
+            [
+                batch
+                async for batch in models.iter_participant_names(
+                    self.game_id, batch_size=3
+                )
+            ],
+            [names[:3], names[3:6], names[6:]],
+        )
+
+    async def test_name_index(self):
+        with QueryCounter(async_engine.sync_engine) as counter:
+            entries = await models.get_name_index(self.game_id)
+            self.assertIs(await models.get_name_index(self.game_id), entries)
+
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(
+            [name for _, name, _ in entries], [f"Participant {i}" for i in range(1, 6)]
+        )
+
+        await models.create_participant(self.game_id, chat_id="6", name="Ana")
+        entries = await models.get_name_index(self.game_id)
+        self.assertEqual(entries[0][:2], ("ana", "Ana"))
+
+        participant = await models.get_participant(
+            self.game_id, participant_id=entries[0][2]
+        )
+        self.assertEqual(participant.chat_id, "6")
+        self.assertIsNone(
+            await models.get_participant(self.game_id + 1, participant_id=entries[0][2])
+        )
+
+        await models.delete_participant(self.game_id, chat_id="6")
+        self.assertEqual(len(await models.get_name_index(self.game_id)), 5)
+
+    async def test_name_index_follows_writes(self):
+        await models.get_name_index(self.game_id)
+
+        await models.create_participant(self.game_id, chat_id="6", name="Ana")
+        participant = await models.get_participant(self.game_id, chat_id="1")
+        participant.name = "Zoe"
+        await models.update_participant(participant)
+        await models.delete_participant(self.game_id, participant_name="participant 2")
+
+        # Kept in step without loading the game again
+        with QueryCounter(async_engine.sync_engine) as counter:
+            names = [name for _, name, _ in await models.get_name_index(self.game_id)]
+
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(
+            names, ["Ana", "Participant 3", "Participant 4", "Participant 5", "Zoe"]
+        )
+        self.assertEqual(
+            (await models.find_participant_name(self.game_id, "ZOE"))[2],
+            participant.id,
+        )
+        self.assertIsNone(
+            await models.find_participant_name(self.game_id, "Participant 1")
+        )
+
+    async def test_search_participant_names(self):
+        await models.create_participant(self.game_id, chat_id="6", name="Participante")
+
+        search = models.search_participant_names
+        names = lambda entries: [name for _, name, _ in entries]
+
+        self.assertEqual(
+            names(await search(self.game_id, "PARTICIPANT", limit=3)),
+            ["Participant 1", "Participant 2", "Participant 3"],
+        )
+        self.assertEqual(
+            names(await search(self.game_id, "participante", limit=1)),
+            ["Participante"],
+        )
+        # Typos fall back to the names that look alike
+        self.assertEqual(
+            names(await search(self.game_id, "Partisipant 4", limit=1)),
+            ["Participant 4"],
+        )
+        self.assertEqual(await search(self.game_id, "xyz"), [])
+
+    async def test_update_participant(self):
+        participant = await models.get_participant(self.game_id, chat_id="1")
+        participant.preferences = "I like chocolate"
+
+        self.assertTrue(await models.update_participant(participant))
+        self.assertEqual(
+            (await models.get_participant(self.game_id, chat_id="1")).preferences,
+            "I like chocolate",
+        )
+
+    async def test_delete_participant(self):
+        self.assertTrue(await models.delete_participant(self.game_id, chat_id="1"))
+        self.assertIsNone(await models.get_participant(self.game_id, chat_id="1"))
+        self.assertFalse(await models.delete_participant(self.game_id, chat_id="1"))
+
+    async def test_delete_participant_by_name(self):
+        await models.add_exclusion(
+            await models.get_participant(self.game_id, chat_id="1"),
+            await models.get_participant(self.game_id, chat_id="2"),
+        )
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            self.assertTrue(
+                await models.delete_participant(
+                    self.game_id, participant_name="participant 1"
+                )
+            )
+
+        # The participant and their exclusions go in one transaction
+        self.assertEqual(counter.count, 2)
+        self.assertEqual(await models.get_exclusion_pairs(self.game_id), [])
+
+    async def test_pair_lookups_take_one_query(self):
+        assignment = dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        await models.save_assignment(self.game_id, assignment)
+        giver = await models.get_participant(self.game_id, chat_id="1")
+        models.cache.clear()
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            recipient = await models.get_participant_recipient(giver)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(recipient.id, assignment[giver.id])
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            self.assertEqual(
+                await models.get_participant_whose_recipient_is_participant(recipient),
+                giver,
+            )
+        self.assertEqual(counter.count, 1)
+
+        # Answered from the cache once both are known
+        await models.get_participant(self.game_id, chat_id="1")
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            await models.get_participant_recipient(giver)
+        self.assertEqual(counter.count, 0)
+
+    async def test_save_assignment(self):
+        assignment = dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+
+        self.assertTrue(await models.save_assignment(self.game_id, assignment))
+        self.assertEqual(await self.get_pairs(), assignment)
+
+        giver = await models.get_participant(self.game_id, chat_id="1")
+        recipient = await models.get_participant_recipient(giver)
+
+        self.assertEqual(recipient.id, assignment[giver.id])
+        self.assertEqual(
+            await models.get_participant_whose_recipient_is_participant(recipient),
+            giver,
+        )
+
+    def assert_valid_draw(self, pairs):
+        self.assertEqual(sorted(pairs), sorted(pairs.values()))
+        self.assertTrue(all(giver != recipient for giver, recipient in pairs.items()))
+
+    async def test_remove_participant_mends_the_draw(self):
+        a, b, c, d, e = self.ids
+        await models.save_assignment(self.game_id, {a: b, b: c, c: d, d: e, e: a})
+        # b can not give to d, so when c leaves b trades with somebody else
+        await models.add_exclusion(
+            await models.get_participant(self.game_id, participant_id=b),
+            await models.get_participant(self.game_id, participant_id=d),
+        )
+
+        repair = await models.remove_participant(self.game_id, chat_id="3")
+
+        self.assertEqual(repair.participant_id, c)
+        self.assertEqual(repair.chat_id, "3")
+        self.assertFalse(repair.redraw)
+        self.assertEqual(len(repair.changes), 2)
+        self.assertIn(b, repair.changes)
+
+        pairs = await self.get_pairs()
+        self.assert_valid_draw(pairs)
+        self.assertNotEqual(pairs[b], d)
+        # Who did not trade keeps their pair
+        unchanged = {a: b, d: e, e: a}
+        for giver in set(unchanged) - set(repair.changes):
+            self.assertEqual(pairs[giver], unchanged[giver])
+
+    async def test_remove_participant_giver_takes_recipient(self):
+        a, b, c, d, e = self.ids
+        await models.save_assignment(self.game_id, {a: b, b: c, c: d, d: e, e: a})
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            repair = await models.remove_participant(self.game_id, chat_id="3")
+
+        self.assertEqual(repair.changes, {b: d})
+        self.assertEqual(await self.get_pairs(), {a: b, b: d, d: e, e: a})
+        # No pair had to be sampled
+        self.assertEqual(counter.count, 6)
+
+    async def test_remove_participant_from_pair_of_two(self):
+        a, b, c, d, e = self.ids
+        await models.save_assignment(self.game_id, {a: b, b: a, c: d, d: e, e: c})
+
+        repair = await models.remove_participant(self.game_id, chat_id="1")
+
+        self.assertEqual(len(repair.changes), 2)
+        self.assert_valid_draw(await self.get_pairs())
+
+    async def test_remove_participant_clears_draw_that_can_not_be_mended(self):
+        a, b = self.ids[:2]
+        for chat_id in ("3", "4", "5"):
+            await models.delete_participant(self.game_id, chat_id=chat_id)
+        await models.save_assignment(self.game_id, {a: b, b: a})
+
+        repair = await models.remove_participant(self.game_id, chat_id="1")
+
+        self.assertTrue(repair.redraw)
+        self.assertEqual(await self.get_pairs(), {b: None})
+
+    async def test_add_to_draw(self):
+        assignment = dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        await models.save_assignment(self.game_id, assignment)
+        await models.create_participant(self.game_id, chat_id="6", name="Late")
+        late = await models.get_participant(self.game_id, chat_id="6")
+
+        repair = await models.add_to_draw(self.game_id, late.id)
+
+        # Somebody now gives to the new participant, who takes their recipient
+        giver = next(giver for giver in repair.changes if giver != late.id)
+        self.assertEqual(repair.changes, {giver: late.id, late.id: assignment[giver]})
+
+        pairs = await self.get_pairs()
+        self.assert_valid_draw(pairs)
+        self.assertEqual({**assignment, **repair.changes}, pairs)
+
+    async def test_add_to_draw_without_draw(self):
+        repair = await models.add_to_draw(self.game_id, self.ids[0])
+
+        self.assertEqual(repair.changes, {})
+        self.assertFalse(repair.redraw)
+
+    async def test_save_assignment_over_previous_one(self):
+        await models.save_assignment(
+            self.game_id, dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        )
+
+        # Every new recipient is somebody else's current recipient
+        assignment = dict(zip(self.ids, self.ids[-1:] + self.ids[:-1]))
+
+        self.assertTrue(await models.save_assignment(self.game_id, assignment))
+        self.assertEqual(await self.get_pairs(), assignment)
+
+    async def test_save_invalid_assignment_changes_nothing(self):
+        assignment = dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        await models.save_assignment(self.game_id, assignment)
+
+        # Two participants with the same recipient
+        self.assertFalse(
+            await models.save_assignment(
+                self.game_id, {self.ids[0]: self.ids[2], self.ids[1]: self.ids[2]}
+            )
+        )
+        self.assertEqual(await self.get_pairs(), assignment)
+
+    async def test_clean_recipients(self):
+        await models.save_assignment(
+            self.game_id, dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        )
+
+        self.assertEqual(await models.clean_recipients(self.game_id), len(self.ids))
+        self.assertTrue(
+            all(recipient is None for recipient in (await self.get_pairs()).values())
+        )
+
+        # Nothing left to clean
+        self.assertEqual(await models.clean_recipients(self.game_id), 0)
+
+    async def test_exclusions(self):
+        participant_1 = await models.get_participant(self.game_id, chat_id="1")
+        participant_2 = await models.get_participant(self.game_id, chat_id="2")
+
+        self.assertTrue(await models.add_exclusion(participant_1, participant_2))
+        self.assertFalse(await models.add_exclusion(participant_1, participant_2))
+        self.assertEqual(
+            sorted(await models.get_exclusion_pairs(self.game_id)),
+            sorted(
+                [
+                    (participant_1.id, participant_2.id),
+                    (participant_2.id, participant_1.id),
+                ]
+            ),
+        )
+
+        # Deleting a participant also deletes their rules
+        await models.delete_participant(self.game_id, chat_id="1")
+        self.assertEqual(await models.get_exclusion_pairs(self.game_id), [])
+
+    async def test_cache_hits(self):
+        participant = await models.get_participant(self.game_id, chat_id="1")
+        self.assertEqual(models.cache.misses, 1)
+
+        self.assertEqual(
+            await models.get_participant(self.game_id, chat_id="1"), participant
+        )
+        self.assertEqual(
+            await models.get_participant(
+                self.game_id, participant_name="Participant 1"
+            ),
+            participant,
+        )
+        self.assertEqual(models.cache.hits, 2)
+
+        # Changing the returned object does not change the cached one
+        participant.name = "Somebody else"
+        self.assertEqual(
+            (await models.get_participant(self.game_id, chat_id="1")).name,
+            "Participant 1",
+        )
+
+    async def test_cache_invalidation(self):
+        participant = await models.get_participant(self.game_id, chat_id="1")
+        participant.name = "John Smith"
+        await models.update_participant(participant)
+
+        self.assertEqual(
+            (await models.get_participant(self.game_id, chat_id="1")).name, "John Smith"
+        )
+        self.assertIsNone(
+            await models.get_participant(self.game_id, participant_name="Participant 1")
+        )
+
+        await models.save_assignment(
+            self.game_id, dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        )
+        recipient = await models.get_participant_recipient(participant)
+        self.assertEqual(recipient.id, self.ids[1])
+
+        await models.clean_recipients(self.game_id)
+        self.assertIsNone(await models.get_participant_recipient(participant))
+
+        await models.delete_participant(self.game_id, chat_id="1")
+        self.assertIsNone(await models.get_participant(self.game_id, chat_id="1"))
+
+    async def test_cache_size(self):
+        models.cache.max_size = 2
+
+        for chat_id in ["1", "2", "3"]:
+            await models.get_participant(self.game_id, chat_id=chat_id)
+
+        self.assertEqual(models.cache.stats()["size"], 2)
+        self.assertIsNone(models.cache.get(self.game_id, chat_id="1"))
+
+    async def test_games_are_separated(self):
+        other_game_id = (await models.get_or_create_game("Some other game")).id
+
+        # The same chat and name can play in both games
+        self.assertTrue(
+            await models.create_participant(
+                other_game_id, chat_id="1", name="Participant 1"
+            )
+        )
+        self.assertTrue(
+            await models.create_participant(
+                other_game_id, chat_id="2", name="Participant 2"
+            )
+        )
+
+        participant = await models.get_participant(other_game_id, chat_id="1")
+        self.assertEqual(participant.game_id, other_game_id)
+        self.assertNotEqual(
+            participant.id, (await models.get_participant(self.game_id, chat_id="1")).id
+        )
+        self.assertEqual(len(await models.get_all_participants(other_game_id)), 2)
+        self.assertEqual(await models.get_chat_game_id("1"), other_game_id)
+
+        # Cleaning one game does not touch the other one
+        await models.save_assignment(
+            self.game_id, dict(zip(self.ids, self.ids[1:] + self.ids[:1]))
+        )
+        self.assertEqual(await models.clean_recipients(other_game_id), 0)
+        self.assertIsNotNone(
+            await models.get_participant_recipient(
+                await models.get_participant(self.game_id, chat_id="1")
+            )
+        )
+        self.assertIsNone(await models.get_participant_recipient(participant))
+
+        # Nor can exclusions be made across games
+        self.assertFalse(
+            await models.add_exclusion(
+                participant, await models.get_participant(self.game_id, chat_id="2")
+            )
+        )
+
+
+class TestSearchNames(unittest.TestCase):
+    def setUp(self):
+        names = [f"Participante {i:05}" for i in range(10000)] + ["Ana", "Andrés"]
+        self.entries = sorted(
+            (normalize_name(name), name, i) for i, name in enumerate(names)
+        )
+
+    def search(self, text: str, limit: int = 10):
+        with patch(
+            "telegram_bot.models.get_close_matches", wraps=get_close_matches
+        ) as close_matches:
+            found = models.search_names(self.entries, text, limit)
+
+        return [name for _, name, _ in found], close_matches
+
+    def test_prefix_matches_skip_the_typo_search(self):
+        names, close_matches = self.search("partic", limit=3)
+
+        self.assertEqual(
+            names,
+            ["Participante 00000", "Participante 00001", "Participante 00002"],
+        )
+        close_matches.assert_not_called()
+
+    def test_typo_search_compares_few_names(self):
+        names, close_matches = self.search("Anna")
+
+        self.assertIn("Ana", names)
+        candidates = close_matches.call_args.args[1]
+        self.assertLessEqual(len(candidates), models.FUZZY_CANDIDATES)
+        self.assertNotIn("participante 00000", candidates)
+
+
+class TestConcurrentDrawRepairs(unittest.IsolatedAsyncioTestCase):
+    """Draw repairs against a database file, with a connection per session."""
+
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.engine = create_async_engine(
+            f"sqlite+aiosqlite:///{directory.name}/test.sqlite3"
+        )
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        for name, value in [
+            (
+                "AsyncSession",
+                async_sessionmaker(
+                    bind=self.engine, autoflush=False, expire_on_commit=False
+                ),
+            ),
+            ("cache", models.ParticipantCache()),
+            ("name_index", models.NameIndex()),
+        ]:
+            patcher = patch(f"telegram_bot.models.{name}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.game_id = (await models.get_or_create_game("Some game")).id
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def add(self, names):
+        for name in names:
+            await models.create_participant(self.game_id, chat_id=name, name=name)
+
+        return [
+            (await models.get_participant(self.game_id, chat_id=name)).id
+            for name in names
+        ]
+
+    async def get_pairs(self):
+        return {
+            participant.id: participant.recipient_id
+            for participant in await models.get_all_participants(self.game_id)
+        }
+
+    async def test_concurrent_changes_keep_one_draw(self):
+        ids = await self.add([f"p{i}" for i in range(4)])
+        await models.save_assignment(self.game_id, dict(zip(ids, ids[1:] + ids[:1])))
+        late = await self.add([f"late{i}" for i in range(8)])
+
+        repairs = await asyncio.gather(
+            *(
+                models.add_to_draw(self.game_id, participant_id)
+                for participant_id in late
+            ),
+            models.remove_participant(self.game_id, chat_id="p0"),
+        )
+
+        self.assertFalse(any(repair.redraw for repair in repairs))
+
+        pairs = await self.get_pairs()
+        self.assertEqual(len(pairs), 11)
+        self.assertNotIn(None, pairs.values())
+        self.assertEqual(sorted(pairs), sorted(pairs.values()))
+        self.assertTrue(all(giver != recipient for giver, recipient in pairs.items()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram.error import Forbidden, RetryAfter, TimedOut
+
+from telegram_bot.broadcast import Broadcaster, DeliveryStatus
+from telegram_bot.ratelimit import TokenBucket
+
+
+class FakeBot:
+    """Records the messages it sends and fails on demand per chat."""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+        self.active = 0
+        self.max_active = 0
+
+    async def send_message(self, chat_id, text):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            await asyncio.sleep(0.001)
+
+            if self.errors.get(chat_id):
+                raise self.errors[chat_id].pop(0)
+
+            self.sent.append((chat_id, text))
+        finally:
+            self.active -= 1
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refill(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        self.assertAlmostEqual(bucket.delay(), 0.5)
+
+        now[0] = 0.5
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+        # Never more than the capacity
+        now[0] = 100
+        self.assertTrue(bucket.try_acquire(2))
+        self.assertFalse(bucket.try_acquire())
+
+    def test_reserve(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=1, clock=lambda: now[0])
+
+        # Each reservation waits for the one before it
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.5)
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        self.assertFalse(bucket.try_acquire())
+
+        now[0] = 1.5
+        self.assertTrue(bucket.try_acquire())
+
+
+class TestBroadcaster(unittest.IsolatedAsyncioTestCase):
+    def broadcaster(self, bot, **kwargs):
+        kwargs.setdefault("global_rate", 1000)
+        kwargs.setdefault("chat_rate", 1000)
+        kwargs.setdefault("backoff", 0.001)
+
+        return Broadcaster(bot, **kwargs)
+
+    async def test_send_to_everyone(self):
+        bot = FakeBot()
+        messages = [(str(chat_id), "Hola") for chat_id in range(50)]
+
+        deliveries = await self.broadcaster(bot, workers=4).send(messages)
+
+        self.assertEqual(sorted(bot.sent), sorted(messages))
+        self.assertLessEqual(bot.max_active, 4)
+        self.assertTrue(
+            all(
+                delivery.status == DeliveryStatus.SENT
+                for delivery in deliveries.values()
+            )
+        )
+
+    async def test_errors(self):
+        bot = FakeBot(
+            errors={
+                "1": [RetryAfter(0)],
+                "2": [TimedOut(), TimedOut()],
+                "3": [Forbidden("Forbidden: bot was blocked by the user")],
+                "4": [TimedOut()] * 4,
+            }
+        )
+
+        deliveries = await self.broadcaster(bot).send(
+            [(str(chat_id), "Hola") for chat_id in range(5)]
+        )
+
+        self.assertEqual(deliveries["0"].status, DeliveryStatus.SENT)
+        self.assertEqual(deliveries["1"].status, DeliveryStatus.SENT)
+        self.assertEqual(deliveries["1"].attempts, 2)
+        self.assertEqual(deliveries["2"].status, DeliveryStatus.SENT)
+        self.assertEqual(deliveries["2"].attempts, 3)
+        self.assertEqual(deliveries["3"].status, DeliveryStatus.BLOCKED)
+        self.assertEqual(deliveries["4"].status, DeliveryStatus.FAILED)
+        self.assertIsInstance(deliveries["4"].error, TimedOut)
+
+    async def test_global_rate(self):
+        bot = FakeBot()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        # A burst of 100 messages and then 100 per second
+        await self.broadcaster(bot, global_rate=100, workers=20).send(
+            [(str(chat_id), "Hola") for chat_id in range(130)]
+        )
+
+        self.assertEqual(len(bot.sent), 130)
+        self.assertGreaterEqual(loop.time() - start, 0.25)
+
+    async def test_concurrent_sends_share_the_global_rate(self):
+        bot = FakeBot()
+        broadcaster = self.broadcaster(bot, global_rate=100, workers=20)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        # Two draws notified at once still get one burst and 100 per second
+        await asyncio.gather(
+            broadcaster.send([(f"a{chat_id}", "Hola") for chat_id in range(65)]),
+            broadcaster.send([(f"b{chat_id}", "Hola") for chat_id in range(65)]),
+        )
+
+        self.assertEqual(len(bot.sent), 130)
+        self.assertGreaterEqual(loop.time() - start, 0.25)
+
+    async def test_idle_chat_buckets_are_dropped(self):
+        broadcaster = self.broadcaster(FakeBot(), chat_rate=100)
+
+        await broadcaster.send([("1", "Hola"), ("2", "Hola")])
+        await asyncio.sleep(0.02)
+        await broadcaster.send([("3", "Hola")])
+
+        self.assertEqual(list(broadcaster._chat_buckets), ["3"])
@@ -0,0 +1,37 @@
+import tempfile
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, text
+
+from secret_santa.database import set_sqlite_pragmas
+
+
+class TestSQLitePragmas(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.engine = create_engine(f"sqlite:///{directory.name}/test.sqlite3")
+        self.addCleanup(self.engine.dispose)
+
+    def pragma(self, name):
+        with self.engine.connect() as connection:
+            return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+    def test_default_profile(self):
+        set_sqlite_pragmas(self.engine)
+
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma("busy_timeout"), 5000)
+        self.assertEqual(self.pragma("temp_store"), 2)  # MEMORY
+
+    def test_custom_profile(self):
+        set_sqlite_pragmas(self.engine, {"journal_mode": "DELETE", "busy_timeout": 10})
+
+        self.assertEqual(self.pragma("journal_mode"), "delete")
+        self.assertEqual(self.pragma("busy_timeout"), 10)
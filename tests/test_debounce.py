@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram_bot.debounce import Debouncer
+
+
+class TestDebouncer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.batches = []
+
+        async def callback(batch):
+            self.batches.append(batch)
+
+        self.debouncer = Debouncer(0.02, callback)
+
+    async def test_merges_events_of_a_key(self):
+        self.assertTrue(self.debouncer.add(1, "a"))
+        self.assertFalse(self.debouncer.add(1, "b"))
+        self.assertTrue(self.debouncer.add(2, "c"))
+        self.assertEqual(len(self.debouncer), 2)
+
+        await asyncio.sleep(0.05)
+
+        # Both came due together, the last value of each key wins
+        self.assertEqual(self.batches, [{1: "b", 2: "c"}])
+        self.assertEqual(self.debouncer.merged, 1)
+        self.assertEqual(len(self.debouncer), 0)
+
+    async def test_key_is_scheduled_again_after_it_ran(self):
+        self.debouncer.add(1)
+        await asyncio.sleep(0.05)
+        self.debouncer.add(1)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.batches, [{1: None}, {1: None}])
+
+    async def test_window_does_not_grow(self):
+        # Constant editing still gets a notice every window
+        for _ in range(6):
+            self.debouncer.add(1)
+            await asyncio.sleep(0.01)
+
+        await asyncio.sleep(0.03)
+
+        self.assertGreaterEqual(len(self.batches), 2)
+
+    async def test_shutdown_runs_pending(self):
+        self.debouncer.add(1, "a")
+
+        await self.debouncer.shutdown()
+
+        self.assertEqual(self.batches, [{1: "a"}])
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.batches), 1)
+
+    async def test_failing_callback_does_not_stop_it(self):
+        async def callback(batch):
+            self.batches.append(batch)
+            raise ValueError
+
+        self.debouncer.callback = callback
+
+        with self.assertLogs("telegram_bot.debounce"):
+            self.debouncer.add(1)
+            await asyncio.sleep(0.05)
+
+        self.debouncer.add(2)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.batches, [{1: None}, {2: None}])
+
+
+if __name__ == "__main__":
+    unittest.main()
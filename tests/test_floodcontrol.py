@@ -0,0 +1,105 @@
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram.ext import Application, ApplicationHandlerStop
+
+from telegram_bot.floodcontrol import FloodControl
+from telegram_bot.replies import ComposingApplication
+from telegram_bot.testing import FakeRequest, message_update
+
+
+class TestFloodControl(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = [0.0]
+
+    def flood_control(self, **kwargs):
+        return FloodControl(clock=lambda: self.now[0], **kwargs)
+
+    async def test_chat_burst_then_rate(self):
+        flood_control = self.flood_control(chat_rate=1, chat_burst=3)
+
+        admitted = [await flood_control.admit(1) for _ in range(5)]
+        self.assertEqual(admitted, [True, True, True, False, False])
+
+        # Another chat is not held back
+        self.assertTrue(await flood_control.admit(2))
+
+        self.now[0] = 1
+        self.assertTrue(await flood_control.admit(1))
+        self.assertFalse(await flood_control.admit(1))
+
+        self.assertEqual(flood_control.admitted, 5)
+        self.assertEqual(flood_control.dropped_chat, 3)
+
+    async def test_global_rate_delays_then_drops(self):
+        flood_control = self.flood_control(
+            chat_burst=10, global_rate=1000, max_delay=0.002
+        )
+
+        admitted = [await flood_control.admit(chat_id) for chat_id in range(1003)]
+
+        # The clock stands still: the bucket's 1000 tokens go first, then the
+        # updates wait until waiting would take too long
+        self.assertEqual(admitted.count(False), 1)
+        self.assertEqual(flood_control.delayed, 2)
+        self.assertEqual(flood_control.dropped_global, 1)
+
+    async def test_idle_chats_are_evicted(self):
+        flood_control = self.flood_control(chat_rate=1, chat_burst=2)
+
+        for chat_id in range(100):
+            await flood_control.admit(chat_id)
+        self.assertEqual(flood_control.stats()["chats"], 100)
+
+        # Their buckets are full again, the same as new ones
+        self.now[0] = 2
+        await flood_control.admit(0)
+        self.assertEqual(flood_control.stats()["chats"], 1)
+
+    async def test_no_chat_is_only_limited_globally(self):
+        flood_control = self.flood_control(chat_burst=1)
+
+        self.assertTrue(await flood_control.admit(None))
+        self.assertTrue(await flood_control.admit(None))
+        self.assertEqual(flood_control.stats()["chats"], 0)
+
+
+class TestFloodControlHandler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.request = FakeRequest()
+        self.app = (
+            Application.builder()
+            .application_class(ComposingApplication)
+            .token("1:TEST")
+            .request(self.request)
+            .get_updates_request(FakeRequest())
+            .build()
+        )
+        self.flood_control = FloodControl(chat_rate=0.001, chat_burst=2)
+        await self.app.initialize()
+
+    async def asyncTearDown(self):
+        await self.app.shutdown()
+
+    async def check(self, update_id, chat_id):
+        await self.flood_control.check(
+            message_update(update_id, chat_id, "Hola", self.app.bot), None
+        )
+
+    async def test_stops_and_warns_once(self):
+        await self.check(1, 10)
+        await self.check(2, 10)
+
+        for update_id in range(3, 6):
+            with self.assertRaises(ApplicationHandlerStop):
+                await self.check(update_id, 10)
+
+        self.assertEqual(self.request.counts["sendMessage"], 1)
+        self.assertEqual(self.flood_control.dropped_chat, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
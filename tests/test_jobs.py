@@ -0,0 +1,115 @@
+import asyncio
+import pickle
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from secret_santa.matching import InfeasibleAssignment
+from telegram_bot.jobs import DrawRunner, DrawRunnerClosed, DrawStatus
+
+
+class TestDrawRunner(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.runner = DrawRunner(executor=ThreadPoolExecutor(max_workers=1))
+        self.addCleanup(self.runner.shutdown)
+
+        self.ids = list(range(1, 11))
+
+    async def test_draw(self):
+        results = []
+
+        async def pipeline(job):
+            results.append(await self.runner.solve(job))
+
+        job = self.runner.submit(1, self.ids, [(1, 2)], pipeline)
+
+        self.assertTrue(self.runner.busy(1))
+        self.assertFalse(self.runner.busy(2))
+        await job.task
+
+        self.assertEqual(job.status, DrawStatus.DONE)
+        self.assertFalse(self.runner.busy(1))
+        self.assertIs(self.runner.get(1), job)
+        self.assertEqual(sorted(results[0]), self.ids)
+        self.assertNotEqual(results[0][1], 2)
+
+    async def test_one_draw_at_a_time(self):
+        release = asyncio.Event()
+
+        async def pipeline(job):
+            await release.wait()
+
+        job = self.runner.submit(1, self.ids, [], pipeline)
+
+        with self.assertRaises(RuntimeError):
+            self.runner.submit(1, self.ids, [], pipeline)
+
+        # Other games are not blocked
+        other_job = self.runner.submit(2, self.ids, [], pipeline)
+
+        release.set()
+        await job.task
+        await other_job.task
+
+    async def test_cancel(self):
+        started = asyncio.Event()
+
+        async def pipeline(job):
+            started.set()
+            await asyncio.Event().wait()
+
+        job = self.runner.submit(1, self.ids, [], pipeline)
+        await started.wait()
+
+        self.assertTrue(job.cancel())
+        await job.task
+
+        self.assertEqual(job.status, DrawStatus.CANCELLED)
+        self.assertFalse(job.cancel())
+
+    async def test_closed_runner(self):
+        async def pipeline(job):
+            pass
+
+        self.runner.shutdown()
+
+        with self.assertRaises(DrawRunnerClosed):
+            self.runner.submit(1, self.ids, [], pipeline)
+
+        # Nor is the pool made again
+        with self.assertRaises(DrawRunnerClosed):
+            self.runner.start()
+
+    async def test_failed_draw(self):
+        async def pipeline(job):
+            await self.runner.solve(job)
+
+        # Nobody can give a gift to participant 1
+        exclusions = [(giver, 1) for giver in self.ids]
+        job = self.runner.submit(1, self.ids, exclusions, pipeline)
+        await job.task
+
+        self.assertEqual(job.status, DrawStatus.FAILED)
+        self.assertIsInstance(job.error, InfeasibleAssignment)
+
+    async def test_process_pool(self):
+        runner = DrawRunner()
+        self.addCleanup(runner.shutdown)
+        runner.start()
+
+        async def pipeline(job):
+            self.assertEqual(sorted(await runner.solve(job)), self.ids)
+
+        job = runner.submit(1, self.ids, [], pipeline)
+        await job.task
+
+        self.assertEqual(job.status, DrawStatus.DONE)
+
+    def test_infeasible_assignment_pickles(self):
+        error = pickle.loads(pickle.dumps(InfeasibleAssignment([1, 2], [3])))
+
+        self.assertEqual(error.givers, [1, 2])
+        self.assertEqual(error.recipients, [3])
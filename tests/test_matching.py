@@ -0,0 +1,114 @@
+import unittest
+from itertools import permutations
+from pathlib import Path
+from random import Random
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from secret_santa.matching import solve, splice_in, splice_out, InfeasibleAssignment
+
+
+class TestMatching(unittest.TestCase):
+    def setUp(self):
+        self.rng = Random(1234)
+
+    def assert_follows_rules(self, ids, exclusions, assignment):
+        self.assertEqual(set(assignment), set(ids))
+        self.assertEqual(set(assignment.values()), set(ids))
+
+        for giver, recipient in assignment.items():
+            self.assertNotEqual(giver, recipient)
+            self.assertNotIn((giver, recipient), exclusions)
+
+    def test_without_exclusions(self):
+        ids = list(range(20))
+
+        self.assert_follows_rules(ids, set(), solve(ids, rng=self.rng))
+
+    def test_matches_brute_force(self):
+        for _ in range(500):
+            n = self.rng.randint(2, 6)
+            exclusions = {
+                (self.rng.randrange(n), self.rng.randrange(n))
+                for _ in range(self.rng.randint(0, n * n // 2))
+            }
+            feasible = any(
+                all(p[i] != i and (i, p[i]) not in exclusions for i in range(n))
+                for p in permutations(range(n))
+            )
+
+            if feasible:
+                assignment = solve(range(n), exclusions, rng=self.rng)
+                self.assert_follows_rules(range(n), exclusions, assignment)
+
+            else:
+                with self.assertRaises(InfeasibleAssignment) as context:
+                    solve(range(n), exclusions, rng=self.rng)
+
+                # The givers in the report can only give to the recipients in it
+                error = context.exception
+                self.assertLess(len(error.recipients), len(error.givers))
+
+    def test_teams(self):
+        # Nobody can give a gift to someone of their own team of 10
+        ids = list(range(1000))
+        exclusions = {(a, b) for a in ids for b in ids if a // 10 == b // 10}
+
+        self.assert_follows_rules(ids, exclusions, solve(ids, exclusions, rng=self.rng))
+
+    def test_infeasible_half(self):
+        # More than half of the people are in the same team
+        ids = list(range(30))
+        exclusions = {(a, b) for a in ids for b in ids if a < 16 and b < 16}
+
+        with self.assertRaises(InfeasibleAssignment) as context:
+            solve(ids, exclusions, rng=self.rng)
+
+        error = context.exception
+        self.assertLess(len(error.recipients), len(error.givers))
+        self.assertTrue(all(giver < 16 for giver in error.givers))
+
+    def apply(self, assignment, changes):
+        for giver, recipient in changes.items():
+            assignment[giver] = recipient
+
+    def test_splice_out(self):
+        ids = list(range(100))
+        exclusions = {(a, b) for a in ids for b in ids if a // 4 == b // 4}
+        assignment = solve(ids, exclusions, rng=self.rng)
+
+        # Remove people one by one, the rest keep a valid draw
+        for leaving in self.rng.sample(ids, 90):
+            recipient = assignment.pop(leaving)
+            giver = next(g for g, r in assignment.items() if r == leaving)
+            pairs = [(g, r) for g, r in assignment.items() if g != giver]
+            self.rng.shuffle(pairs)
+
+            changes = splice_out(giver, recipient, pairs, exclusions)
+
+            self.assertLessEqual(len(changes), 2)
+            self.apply(assignment, changes)
+            self.assert_follows_rules(list(assignment), exclusions, assignment)
+
+    def test_splice_out_pair_of_two(self):
+        # 1 and 2 gave to each other, 1 leaves
+        self.assertEqual(splice_out(2, 2, [(3, 4), (4, 3)]), {2: 4, 3: 2})
+        self.assertIsNone(splice_out(2, 2, [(3, 4), (4, 3)], [(2, 4), (2, 3)]))
+
+    def test_splice_in(self):
+        ids = list(range(10))
+        exclusions = {(a, b) for a in range(20) for b in range(20) if a // 5 == b // 5}
+        assignment = solve(ids, exclusions, rng=self.rng)
+
+        for joining in range(10, 20):
+            pairs = list(assignment.items())
+            self.rng.shuffle(pairs)
+
+            changes = splice_in(joining, pairs, exclusions)
+
+            self.assertEqual(len(changes), 2)
+            self.apply(assignment, changes)
+            self.assert_follows_rules(list(assignment), exclusions, assignment)
+
+        self.assertIsNone(splice_in(20, [(1, 2)], [(20, 2)]))
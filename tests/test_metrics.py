@@ -0,0 +1,162 @@
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import httpx
+from sqlalchemy import create_engine, text
+from telegram.ext import (
+    Application,
+    CommandHandler,
+    ConversationHandler,
+    MessageHandler,
+    filters,
+)
+
+from telegram_bot.metrics import (
+    InstrumentedRequest,
+    Metrics,
+    MetricsServer,
+    QueryMetrics,
+    instrument_handlers,
+)
+from telegram_bot.testing import FakeRequest, message_update
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        metrics = Metrics()
+        metrics.counter("requests_total", "Requests")
+        metrics.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+        metrics.gauges("queue", "Queue", lambda: {"size": 3})
+
+        metrics.inc("requests_total", method="GET")
+        metrics.inc("requests_total", method="GET")
+        for value in (0.05, 0.5, 5):
+            metrics.observe("latency_seconds", value, state='say "hi"')
+
+        self.assertEqual(metrics.get("requests_total", method="GET"), 2)
+        self.assertEqual(
+            metrics.render().splitlines(),
+            [
+                "# HELP requests_total Requests",
+                "# TYPE requests_total counter",
+                'requests_total{method="GET"} 2',
+                "# HELP latency_seconds Latency",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{state="say \\"hi\\"",le="0.1"} 1',
+                'latency_seconds_bucket{state="say \\"hi\\"",le="1"} 2',
+                'latency_seconds_bucket{state="say \\"hi\\"",le="+Inf"} 3',
+                'latency_seconds_sum{state="say \\"hi\\""} 5.55',
+                'latency_seconds_count{state="say \\"hi\\""} 3',
+                "# HELP queue_size Queue",
+                "# TYPE queue_size gauge",
+                "queue_size 3",
+            ],
+        )
+
+    def test_query_metrics(self):
+        metrics = Metrics()
+        engine = create_engine("sqlite://")
+        query_metrics = QueryMetrics(metrics, slow=0)
+        query_metrics.attach(engine)
+
+        with self.assertLogs("telegram_bot.metrics", "WARNING") as logs:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+
+        self.assertIn("SELECT 1", logs.output[0])
+        self.assertEqual(metrics.get("db_query_seconds").count, 1)
+        self.assertEqual(metrics.get("db_slow_queries_total"), 1)
+
+        query_metrics.detach()
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        self.assertEqual(metrics.get("db_query_seconds").count, 1)
+
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.metrics = Metrics()
+        self.request = FakeRequest()
+        self.app = (
+            Application.builder()
+            .token("1:TEST")
+            .request(InstrumentedRequest(self.request, self.metrics))
+            .get_updates_request(FakeRequest())
+            .build()
+        )
+
+        async def start(update, context):
+            await update.message.reply_text("¿Cómo te llamas?")
+            return 0
+
+        async def name(update, context):
+            return ConversationHandler.END
+
+        async def echo(update, context):
+            pass
+
+        self.app.add_handler(
+            ConversationHandler(
+                entry_points=[CommandHandler("hola", start)],
+                states={0: [MessageHandler(filters.TEXT, name)]},
+                fallbacks=[],
+            )
+        )
+        self.app.add_handler(MessageHandler(filters.TEXT, echo), group=1)
+        instrument_handlers(self.app, self.metrics, {0: "TYPING_NAME"})
+
+        await self.app.initialize()
+
+    async def asyncTearDown(self):
+        await self.app.shutdown()
+
+    async def test_handlers_by_state(self):
+        await self.app.process_update(message_update(1, 10, "/hola", self.app.bot))
+        await self.app.process_update(message_update(2, 10, "Ana", self.app.bot))
+
+        for state, handler in [
+            ("ENTRY", "start"),
+            ("TYPING_NAME", "name"),
+            ("NONE", "echo"),
+        ]:
+            self.assertGreaterEqual(
+                self.metrics.get("handler_seconds", state=state, handler=handler).count,
+                1,
+                state,
+            )
+        self.assertEqual(
+            self.metrics.get("handler_queries", state="ENTRY", handler="start").sum, 0
+        )
+
+    async def test_bot_api_calls(self):
+        await self.app.process_update(message_update(1, 10, "/hola", self.app.bot))
+
+        self.assertEqual(
+            self.metrics.get(
+                "telegram_api_seconds", method="sendMessage", status="200"
+            ).count,
+            1,
+        )
+        self.assertEqual(self.request.counts["sendMessage"], 1)
+
+    async def test_server(self):
+        server = MetricsServer(self.app, self.metrics, port=0)
+        await server.start()
+
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(f"http://127.0.0.1:{server.port}/metrics")
+                missing = await client.get(f"http://127.0.0.1:{server.port}/other")
+        finally:
+            await server.stop()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE handler_seconds histogram", response.text)
+        self.assertEqual(missing.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import tempfile
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from secret_santa.database import Base
+from secret_santa.migrations import MigrationError, upgrade
+
+# The participants table as the first version of the bot created it
+BASELINE_PARTICIPANTS = """
+CREATE TABLE participants (
+    id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    recipient_id INTEGER,
+    preferences TEXT,
+    chat_id VARCHAR NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (name),
+    UNIQUE (recipient_id),
+    FOREIGN KEY(recipient_id) REFERENCES participants (id),
+    UNIQUE (chat_id)
+)
+"""
+
+
+class TestUpgrade(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.engine = create_engine(f"sqlite:///{directory.name}/old.sqlite3")
+        self.addCleanup(self.engine.dispose)
+
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(BASELINE_PARTICIPANTS)
+            connection.execute(
+                text(
+                    "INSERT INTO participants (id, name, recipient_id, preferences, "
+                    "chat_id) VALUES (:id, :name, :recipient_id, NULL, :chat_id)"
+                ),
+                [
+                    {"id": 1, "name": "José", "recipient_id": 2, "chat_id": "10"},
+                    {"id": 2, "name": "Ana", "recipient_id": 1, "chat_id": "20"},
+                ],
+            )
+
+    def upgrade(self):
+        Base.metadata.create_all(self.engine)
+        upgrade(self.engine, "Niño Jesús Secreto")
+
+    def rows(self):
+        with self.engine.connect() as connection:
+            return connection.execute(
+                text(
+                    "SELECT p.id, g.name, p.name, p.normalized_name, p.recipient_id, "
+                    "p.chat_id FROM participants p JOIN games g ON g.id = p.game_id "
+                    "ORDER BY p.id"
+                )
+            ).all()
+
+    def test_baseline_database(self):
+        self.upgrade()
+
+        self.assertEqual(
+            self.rows(),
+            [
+                (1, "Niño Jesús Secreto", "José", "jose", 2, "10"),
+                (2, "Niño Jesús Secreto", "Ana", "ana", 1, "20"),
+            ],
+        )
+
+        indexes = {
+            index["name"] for index in inspect(self.engine).get_indexes("participants")
+        }
+        self.assertIn("ix_participants_chat_id", indexes)
+        self.assertIn("ix_participants_game_id_recipient_id", indexes)
+
+        # Unique per game now: the same chat can join another game
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO games (name) VALUES ('Otro')"))
+            connection.execute(
+                text(
+                    "INSERT INTO participants (game_id, name, normalized_name, chat_id) "
+                    "SELECT id, 'José', 'jose', '10' FROM games WHERE name = 'Otro'"
+                )
+            )
+
+        with self.assertRaises(IntegrityError), self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO participants (game_id, name, normalized_name, chat_id) "
+                    "SELECT id, 'JOSE', 'jose', '30' FROM games WHERE name = 'Otro'"
+                )
+            )
+
+    def test_exclusions_keep_pointing_at_participants(self):
+        self.upgrade()
+
+        with self.engine.connect() as connection:
+            sql = connection.execute(
+                text("SELECT sql FROM sqlite_master WHERE name = 'exclusions'")
+            ).scalar_one()
+
+        self.assertNotIn("participants_old", sql)
+
+    def test_running_again_changes_nothing(self):
+        self.upgrade()
+        rows = self.rows()
+
+        self.upgrade()
+
+        self.assertEqual(self.rows(), rows)
+
+    def test_names_that_clash_once_normalized(self):
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO participants (id, name, chat_id) "
+                    "VALUES (3, 'jose ', '30')"
+                )
+            )
+
+        with self.assertRaisesRegex(MigrationError, "José, jose "):
+            self.upgrade()
+
+        # Nothing was changed
+        columns = {
+            column["name"]
+            for column in inspect(self.engine).get_columns("participants")
+        }
+        self.assertNotIn("game_id", columns)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,7 +7,7 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import IntegrityError
 
-from secret_santa.models import Participant
+from secret_santa.models import Game, Participant, Exclusion, normalize_name
 from secret_santa.database import Base
 from tests.database import Session, engine
 
@@ -16,10 +16,17 @@ class TestParticipantCRUD(unittest.TestCase):
     def setUp(self):
         Base.metadata.create_all(bind=engine)
 
+        with Session() as session:
+            self.game = Game(name="Some game")
+            session.add(self.game)
+            session.commit()
+
         self.chat_id = "some_chat_id"
         self.name = "John Doe"
 
-        self.participant = Participant(name=self.name, chat_id=self.chat_id)
+        self.participant = Participant(
+            game_id=self.game.id, name=self.name, chat_id=self.chat_id
+        )
 
     def tearDown(self):
         engine.dispose()
@@ -63,7 +70,7 @@ class TestParticipantCRUD(unittest.TestCase):
 
         # Create a new Participant with the initial name
         participant = self.register_participant_on_db(
-            Participant(name=self.name, chat_id=self.chat_id)
+            Participant(game_id=self.game.id, name=self.name, chat_id=self.chat_id)
         )
 
         # Update the name of the Participant
@@ -84,7 +91,11 @@ class TestParticipantCRUD(unittest.TestCase):
         participant_1 = self.register_participant_on_db(self.participant)
 
         participant_2 = self.register_participant_on_db(
-            Participant(name=participant_2_name, chat_id=participant_2_chat_id)
+            Participant(
+                game_id=self.game.id,
+                name=participant_2_name,
+                chat_id=participant_2_chat_id,
+            )
         )
 
         # Update the name of the Participant
@@ -137,7 +148,11 @@ class TestParticipantCRUD(unittest.TestCase):
         # Create a new Participant with the initial name
         participant_1 = self.register_participant_on_db(self.participant)
         participant_2 = self.register_participant_on_db(
-            Participant(name=participant_2_name, chat_id=participant_2_chat_id)
+            Participant(
+                game_id=self.game.id,
+                name=participant_2_name,
+                chat_id=participant_2_chat_id,
+            )
         )
 
         self.assertIsNotNone(participant_1.id)
@@ -154,3 +169,65 @@ class TestParticipantCRUD(unittest.TestCase):
         with Session() as session:
             participant_1 = session.query(Participant).get(participant_1.id)
             self.assertEqual(participant_1.recipient, participant_2)
+
+    def test_create_exclusion(self):
+        participant_1 = self.register_participant_on_db(self.participant)
+        participant_2 = self.register_participant_on_db(
+            Participant(
+                game_id=self.game.id, name="John Smith", chat_id="some other chat id"
+            )
+        )
+
+        exclusion = Exclusion(
+            participant_id=participant_1.id, excluded_id=participant_2.id
+        )
+
+        with Session() as session:
+            session.add(exclusion)
+            session.commit()
+            session.refresh(exclusion)
+
+        self.assertIsNotNone(exclusion.id)
+
+        # The same rule can only be stored once
+        with self.assertRaises(IntegrityError):
+            with Session() as session:
+                session.add(
+                    Exclusion(
+                        participant_id=participant_1.id, excluded_id=participant_2.id
+                    )
+                )
+                session.commit()
+
+    def test_same_chat_in_two_games(self):
+        participant_1 = self.register_participant_on_db(self.participant)
+
+        with Session() as session:
+            other_game = Game(name="Some other game")
+            session.add(other_game)
+            session.commit()
+
+        participant_2 = self.register_participant_on_db(
+            Participant(game_id=other_game.id, name=self.name, chat_id=self.chat_id)
+        )
+
+        self.assertNotEqual(participant_1.id, participant_2.id)
+
+        # But only once in the same game
+        with self.assertRaises(IntegrityError):
+            self.register_participant_on_db(
+                Participant(game_id=self.game.id, name="Jane Doe", chat_id=self.chat_id)
+            )
+
+
+class TestNormalizedName(unittest.TestCase):
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("  José \t PÉREZ "), "jose perez")
+        self.assertEqual(normalize_name("María Fernanda"), "maria fernanda")
+
+    def test_set_from_name(self):
+        participant = Participant(name="José Pérez")
+        self.assertEqual(participant.normalized_name, "jose perez")
+
+        participant.name = "Ana  María"
+        self.assertEqual(participant.normalized_name, "ana maria")
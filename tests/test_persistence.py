@@ -0,0 +1,137 @@
+import asyncio
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram.ext import Application
+
+from secret_santa.database import Base, QueryCounter
+from telegram_bot import models, settings
+from telegram_bot.persistence import ChatState, SQLitePersistence
+from telegram_bot.testing import FakeRequest, message_update
+from tests.database import AsyncSession, async_engine
+
+import run_telegram_bot
+
+
+class TestSQLitePersistence(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        async with async_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+        patcher = patch("telegram_bot.models.AsyncSession", AsyncSession)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("telegram_bot.models.cache", models.ParticipantCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch("telegram_bot.models.name_index", models.NameIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.update_id = 0
+
+    async def asyncTearDown(self):
+        await async_engine.dispose()
+
+    async def test_round_trip(self):
+        persistence = SQLitePersistence(AsyncSession)
+
+        await persistence.update_chat_data(1, ChatState(game_id=3, choice="Ver"))
+        await persistence.update_chat_data(2, ChatState(game_id=3))
+        await persistence.drop_chat_data(2)
+        await persistence.update_conversation("main", (1, 1), settings.CHOOSING)
+        await persistence.update_conversation("main", (2, 2), settings.TYPING_NAME)
+        await persistence.update_conversation("main", (2, 2), None)
+
+        persistence = SQLitePersistence(AsyncSession)
+
+        self.assertEqual(
+            await persistence.get_chat_data(), {1: ChatState(game_id=3, choice="Ver")}
+        )
+        self.assertEqual(
+            await persistence.get_conversations("main"), {(1, 1): settings.CHOOSING}
+        )
+        self.assertEqual(await persistence.get_conversations("other"), {})
+
+    async def test_batched_writes(self):
+        persistence = SQLitePersistence(AsyncSession)
+
+        # As if the Application had handed over 100 changed chats
+        persistence._chats = {i: ChatState(game_id=i) for i in range(100)}
+
+        with QueryCounter(async_engine.sync_engine) as counter:
+            await persistence.flush()
+
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(len(await persistence.get_chat_data()), 100)
+
+    async def test_gathered_updates_share_a_transaction(self):
+        persistence = SQLitePersistence(AsyncSession)
+
+        # As Application.update_persistence hands them over
+        with QueryCounter(async_engine.sync_engine) as counter:
+            await asyncio.gather(
+                *(
+                    persistence.update_chat_data(i, ChatState(game_id=i))
+                    for i in range(5)
+                ),
+                persistence.update_conversation("main", (1, 1), settings.CHOOSING),
+                persistence.update_conversation("main", (2, 2), settings.CHOOSING),
+            )
+
+        # One upsert per table
+        self.assertEqual(counter.count, 2)
+        self.assertEqual(len(await persistence.get_chat_data()), 5)
+
+    def build_app(self) -> Application:
+        return run_telegram_bot.build_application(
+            Application.builder()
+            .token("1:TEST")
+            .request(FakeRequest())
+            .get_updates_request(FakeRequest())
+            .persistence(SQLitePersistence(AsyncSession))
+        )
+
+    async def send(self, app: Application, chat_id: int, text: str) -> list:
+        request = app.bot.request
+        sent = len(request.sent_messages)
+        self.update_id += 1
+
+        await app.process_update(message_update(self.update_id, chat_id, text, app.bot))
+
+        return [message["text"] for message in request.sent_messages[sent:]]
+
+    async def test_restart_mid_conversation(self):
+        app = self.build_app()
+        await app.initialize()
+
+        await self.send(app, 10, "/hola")
+        await self.send(app, 10, "Ana")
+        await self.send(app, 10, settings.KeyboardOptions.EDIT_PREFS.value)
+        await app.shutdown()
+
+        # A new process picks up the pending choice and the conversation state
+        app = self.build_app()
+        await app.initialize()
+
+        self.assertEqual(
+            app.chat_data[10].choice, settings.KeyboardOptions.EDIT_PREFS.value
+        )
+        replies = await self.send(app, 10, "Talla M")
+        await app.shutdown()
+
+        self.assertTrue(
+            replies[0].startswith(
+                "Muchas gracias Ana, acabo de actualizar tus preferencias en el juego"
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
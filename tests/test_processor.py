@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram import Bot
+
+from telegram_bot.processor import ChatUpdateProcessor
+from telegram_bot.testing import FakeRequest, message_update
+
+
+class TestChatUpdateProcessor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bot = Bot("1:TEST", request=FakeRequest())
+        self.handled = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle(self, update, delay: float):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+
+        try:
+            await asyncio.sleep(delay)
+            self.handled.append((update.effective_chat.id, update.message.text))
+        finally:
+            self.active -= 1
+
+    async def process(self, processor, messages, delay=lambda chat_id, i: 0.01):
+        updates = [
+            message_update(update_id, chat_id, str(i), self.bot)
+            for update_id, (chat_id, i) in enumerate(messages)
+        ]
+
+        await asyncio.gather(
+            *(
+                processor.process_update(
+                    update,
+                    self.handle(
+                        update,
+                        delay(update.effective_chat.id, int(update.message.text)),
+                    ),
+                )
+                for update in updates
+            )
+        )
+
+    async def test_order_within_chat(self):
+        processor = ChatUpdateProcessor(parallelism=4)
+
+        # The first message of each chat is the slowest
+        await self.process(
+            processor,
+            [(chat_id, i) for i in range(5) for chat_id in (1, 2, 3)],
+            delay=lambda chat_id, i: 0.02 if i == 0 else 0.001,
+        )
+
+        for chat_id in (1, 2, 3):
+            self.assertEqual(
+                [text for chat, text in self.handled if chat == chat_id],
+                [str(i) for i in range(5)],
+            )
+
+        self.assertEqual(self.max_active, 3)
+        self.assertEqual(processor.processed, 15)
+        self.assertEqual(processor.stats()["chats"], 0)
+
+    async def test_parallelism_cap(self):
+        processor = ChatUpdateProcessor(parallelism=2)
+
+        await self.process(processor, [(chat_id, 0) for chat_id in range(6)])
+
+        self.assertEqual(self.max_active, 2)
+        self.assertEqual(processor.waiting, 0)
+        # The first two start right away
+        self.assertEqual(processor.waiting_max, 4)
+        self.assertGreater(processor.wait_time_max, 0)
+
+    async def test_busy_chat_holds_one_slot(self):
+        processor = ChatUpdateProcessor(parallelism=2)
+
+        await self.process(
+            processor, [(1, i) for i in range(5)] + [(2, 0)], delay=lambda *_: 0.01
+        )
+
+        # Chat 2 did not wait for the five messages of chat 1
+        self.assertEqual(self.handled[1], (2, "0"))
+
+
+if __name__ == "__main__":
+    unittest.main()
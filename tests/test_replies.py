@@ -0,0 +1,141 @@
+import asyncio
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+)
+from telegram.ext import Application, MessageHandler, filters
+
+from telegram_bot.replies import ComposingApplication, ReplyComposer, reply
+from telegram_bot.testing import FakeRequest, message_update
+
+KEYBOARD = ReplyKeyboardMarkup([["Si", "No"]])
+REMOVE = ReplyKeyboardRemove()
+INLINE = InlineKeyboardMarkup([[InlineKeyboardButton("Ana", callback_data="a")]])
+
+
+class TestReplyComposer(unittest.TestCase):
+    def compose(self, *replies, **kwargs):
+        composer = ReplyComposer(**kwargs)
+
+        for chat_id, text, markup in replies:
+            composer.add(chat_id, text, markup)
+
+        return [tuple(message) for message in composer.messages]
+
+    def test_merges_texts_of_a_chat(self):
+        self.assertEqual(
+            self.compose((1, "a", REMOVE), (1, "b", None), (1, "c", KEYBOARD)),
+            [(1, "a\n\nb\n\nc", KEYBOARD)],
+        )
+        self.assertEqual(
+            self.compose((1, "a", KEYBOARD), (1, "b", None)),
+            [(1, "a\n\nb", KEYBOARD)],
+        )
+        self.assertEqual(
+            self.compose((1, "a", None), (2, "b", None), (1, "c", None)),
+            [(1, "a", None), (2, "b", None), (1, "c", None)],
+        )
+
+    def test_length_limit(self):
+        self.assertEqual(
+            self.compose((1, "a" * 6, None), (1, "b" * 3, None), limit=10),
+            [(1, "a" * 6, None), (1, "b" * 3, None)],
+        )
+        self.assertEqual(
+            self.compose((1, "a" * 5, None), (1, "b" * 3, None), limit=10),
+            [(1, "a" * 5 + "\n\n" + "b" * 3, None)],
+        )
+
+    def test_length_in_utf16(self):
+        # Each emoji takes two UTF-16 code units
+        self.assertEqual(
+            self.compose((1, "😀" * 3, None), (1, "b" * 3, None), limit=10),
+            [(1, "😀" * 3, None), (1, "b" * 3, None)],
+        )
+        self.assertEqual(
+            self.compose((1, "😀" * 2, None), (1, "b" * 3, None), limit=10),
+            [(1, "😀" * 2 + "\n\n" + "b" * 3, None)],
+        )
+
+    def test_inline_keyboard_ends_a_message(self):
+        self.assertEqual(
+            self.compose((1, "a", None), (1, "b", INLINE), (1, "c", None)),
+            [(1, "a\n\nb", INLINE), (1, "c", None)],
+        )
+        # Removing the keyboard and showing buttons take two messages
+        self.assertEqual(
+            self.compose((1, "a", REMOVE), (1, "b", INLINE)),
+            [(1, "a", REMOVE), (1, "b", INLINE)],
+        )
+
+
+class TestComposingApplication(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.request = FakeRequest()
+        self.app = (
+            Application.builder()
+            .application_class(ComposingApplication)
+            .token("1:TEST")
+            .request(self.request)
+            .get_updates_request(FakeRequest())
+            .build()
+        )
+        self.later = []
+
+        async def reply_later(update):
+            await asyncio.sleep(0.01)
+            await reply(update, "Después")
+
+        async def handle(update, context):
+            await reply(update, "Uno", reply_markup=REMOVE)
+            await reply(update, "Dos")
+            await reply(update, "Tres", reply_markup=KEYBOARD)
+            self.later.append(asyncio.create_task(reply_later(update)))
+
+        self.app.add_handler(MessageHandler(filters.TEXT, handle))
+        await self.app.initialize()
+
+    async def asyncTearDown(self):
+        await self.app.shutdown()
+
+    async def test_one_message_per_update(self):
+        await self.app.process_update(message_update(1, 10, "Hola", self.app.bot))
+
+        self.assertEqual(self.request.counts["sendMessage"], 1)
+        self.assertEqual(self.request.sent_messages[0]["text"], "Uno\n\nDos\n\nTres")
+        self.assertEqual(
+            self.request.sent_messages[0]["reply_markup"], KEYBOARD.to_dict()
+        )
+
+        # A task that outlives the update sends its reply by itself
+        await asyncio.gather(*self.later)
+        self.assertEqual(self.request.sent_messages[1]["text"], "Después")
+
+    async def test_failed_message_does_not_stop_the_rest(self):
+        composer = ReplyComposer()
+        composer.add(10, "Hola")
+        composer.add(20, "Hola")
+        composer.add(30, "Hola")
+        self.request.blocked.add("20")
+
+        with self.assertLogs("telegram_bot.replies", "ERROR"):
+            sent = await composer.flush(self.app.bot)
+
+        # The chat after the blocked one was still tried, and got it
+        self.assertEqual(sent, 2)
+        self.assertEqual(
+            [message["chat_id"] for message in self.request.sent_messages],
+            [10, 20, 30],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
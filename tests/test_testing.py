@@ -0,0 +1,42 @@
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram import Bot
+
+from telegram_bot.testing import FakeRequest, message_update
+
+
+class TestFakeRequest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.request = FakeRequest()
+        self.bot = Bot("1:TEST", request=self.request)
+        await self.bot.initialize()
+
+    async def asyncTearDown(self):
+        await self.bot.shutdown()
+
+    async def test_send_message(self):
+        message = await self.bot.send_message(chat_id=42, text="Hola")
+
+        self.assertEqual(message.chat.id, 42)
+        self.assertEqual(message.text, "Hola")
+        self.assertEqual(self.request.sent_messages[-1]["text"], "Hola")
+        self.assertEqual(self.request.counts["getMe"], 1)
+
+    async def test_message_update(self):
+        update = message_update(7, 42, "/juego Familia", self.bot)
+
+        self.assertEqual(update.update_id, 7)
+        self.assertEqual(update.effective_chat.id, 42)
+        self.assertEqual(update.message.text, "/juego Familia")
+        self.assertEqual(update.message.entities[0].length, len("/juego"))
+
+        await update.message.reply_text("Listo")
+        self.assertEqual(self.request.sent_messages[-1]["chat_id"], 42)
+
+
+if __name__ == "__main__":
+    unittest.main()
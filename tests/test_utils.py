@@ -0,0 +1,79 @@
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from telegram_bot.utils import (
+    MAX_MESSAGE_LENGTH,
+    MessageChunker,
+    create_keyboard,
+    create_page_keyboard,
+)
+
+
+class TestMessageChunker(unittest.TestCase):
+    def chunk(self, parts, **kwargs):
+        chunker = MessageChunker(**kwargs)
+
+        return chunker.add(parts) + chunker.flush()
+
+    def test_fits_in_one_message(self):
+        self.assertEqual(
+            self.chunk(["Ana", "Beto"], prefix="Hay 2: "), ["Hay 2: Ana, Beto"]
+        )
+        self.assertEqual(self.chunk([]), [])
+
+    def test_splits_between_parts(self):
+        names = [f"Participant {i}" for i in range(1000)]
+        messages = self.chunk(names, prefix="Hay 1000: ")
+
+        self.assertGreater(len(messages), 1)
+        self.assertTrue(all(len(message) <= MAX_MESSAGE_LENGTH for message in messages))
+        self.assertEqual(", ".join(messages), "Hay 1000: " + ", ".join(names))
+
+    def test_splits_long_part(self):
+        messages = self.chunk(["ab", "c" * 25, "d"], limit=10)
+
+        self.assertEqual(messages, ["ab", "cccccccccc", "cccccccccc", "ccccc, d"])
+
+    def test_messages_come_out_as_they_fill(self):
+        chunker = MessageChunker(limit=10)
+
+        self.assertEqual(chunker.add(["abcd", "efgh"]), [])
+        self.assertEqual(chunker.add(["ijkl"]), ["abcd, efgh"])
+        self.assertEqual(chunker.flush(), ["ijkl"])
+        self.assertEqual(chunker.flush(), [])
+
+
+class TestKeyboards(unittest.TestCase):
+    def test_keyboard_is_reused(self):
+        self.assertIs(create_keyboard(), create_keyboard())
+        self.assertIs(create_keyboard(["Si", "No"]), create_keyboard(["Si", "No"]))
+        self.assertIsNot(create_keyboard(["Si", "No"]), create_keyboard(["No", "Si"]))
+
+    def test_page_keyboard(self):
+        entries = [(f"p {i}", f"P {i}", i) for i in range(20)]
+
+        def rows(page):
+            keyboard = create_page_keyboard(entries, page, "delete").inline_keyboard
+
+            return [[button.callback_data for button in row] for row in keyboard]
+
+        self.assertEqual(
+            rows(0),
+            [[f"delete:pick:{i}"] for i in range(8)] + [["delete:page:1"]],
+        )
+        self.assertEqual(rows(1)[-1], ["delete:page:0", "delete:page:2"])
+        self.assertEqual(
+            rows(9),
+            [[f"delete:pick:{i}"] for i in range(16, 20)] + [["delete:page:1"]],
+        )
+        self.assertEqual(
+            create_page_keyboard(entries[:3], 0, "delete").inline_keyboard[-1][0].text,
+            "P 2",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import unittest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from telegram_bot.processor import ChatUpdateProcessor, UpdateQueue
+from telegram_bot.testing import FakeRequest, message_update_data
+from telegram_bot.webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+
+class TestWebhookServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.app = (
+            Application.builder()
+            .token("1:TEST")
+            .request(FakeRequest())
+            .get_updates_request(FakeRequest())
+            .update_queue(asyncio.Queue(maxsize=2))
+            .build()
+        )
+        await self.app.initialize()
+
+        self.server = WebhookServer(
+            self.app, secret_token="s3cret", listen="127.0.0.1", port=0
+        )
+        self.headers = {SECRET_TOKEN_HEADER: "s3cret"}
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+        await self.app.shutdown()
+
+    def body(self, update_id: int) -> bytes:
+        return json.dumps(message_update_data(update_id, 42, "/hola")).encode()
+
+    async def test_queue_update(self):
+        status, _, _ = await self.server.handle(
+            "POST", "/webhook", self.headers, self.body(1)
+        )
+
+        self.assertEqual(status, 200)
+        update = self.app.update_queue.get_nowait()
+        self.assertEqual(update.update_id, 1)
+        self.assertEqual(update.message.text, "/hola")
+
+    async def test_secret_token(self):
+        for headers in ({}, {SECRET_TOKEN_HEADER: "wrong"}):
+            status, _, _ = await self.server.handle(
+                "POST", "/webhook", headers, self.body(1)
+            )
+            self.assertEqual(status, 403)
+
+        self.assertTrue(self.app.update_queue.empty())
+
+    async def test_empty_secret_token(self):
+        for secret_token in (None, ""):
+            server = WebhookServer(self.app, secret_token=secret_token)
+            self.assertGreaterEqual(len(server.secret_token), 32)
+
+            for headers in ({}, {SECRET_TOKEN_HEADER: ""}):
+                status, _, _ = await server.handle(
+                    "POST", "/webhook", headers, self.body(1)
+                )
+                self.assertEqual(status, 403)
+
+        self.assertTrue(self.app.update_queue.empty())
+
+    async def test_bad_requests(self):
+        cases = [
+            ("POST", "/other", b"{}", 404),
+            ("GET", "/webhook", b"", 405),
+            ("POST", "/webhook", b"not json", 400),
+            ("POST", "/webhook", b"null", 400),
+        ]
+
+        for method, path, body, expected in cases:
+            status, _, _ = await self.server.handle(method, path, self.headers, body)
+            self.assertEqual(status, expected, (method, path, body))
+
+    async def test_backpressure(self):
+        statuses = [
+            (await self.server.handle("POST", "/webhook", self.headers, self.body(i)))
+            for i in range(3)
+        ]
+
+        self.assertEqual([status for status, _, _ in statuses], [200, 200, 503])
+        self.assertEqual(statuses[-1][1]["Retry-After"], "1")
+        self.assertEqual((self.server.received, self.server.rejected), (2, 1))
+
+    async def test_backpressure_with_concurrent_updates(self):
+        # The app empties its queue into tasks, the updates still count
+        # until they are handled
+        release = asyncio.Event()
+
+        async def slow(update, context):
+            await release.wait()
+
+        app = (
+            Application.builder()
+            .token("1:TEST")
+            .request(FakeRequest())
+            .get_updates_request(FakeRequest())
+            .concurrent_updates(ChatUpdateProcessor(8))
+            .update_queue(UpdateQueue(5))
+            .build()
+        )
+        app.add_handler(TypeHandler(Update, slow))
+        server = WebhookServer(app, secret_token="s3cret")
+
+        async with app:
+            await app.start()
+
+            try:
+                statuses = []
+                for i in range(50):
+                    status, _, _ = await server.handle(
+                        "POST", "/webhook", self.headers, self.body(i)
+                    )
+                    statuses.append(status)
+                    await asyncio.sleep(0)
+
+                self.assertEqual(app.update_queue.qsize(), 0)
+                self.assertEqual((server.received, server.rejected), (5, 45))
+                self.assertEqual(statuses[:5], [200] * 5)
+
+                # Handled updates make room again
+                release.set()
+                await asyncio.sleep(0.01)
+                status, _, _ = await server.handle(
+                    "POST", "/webhook", self.headers, self.body(50)
+                )
+                self.assertEqual(status, 200)
+            finally:
+                release.set()
+                await app.stop()
+
+    async def test_http(self):
+        await self.server.start()
+        url = f"http://127.0.0.1:{self.server.port}/webhook"
+
+        async with httpx.AsyncClient() as client:
+            # Both requests share one keep-alive connection
+            ok = await client.post(url, content=self.body(1), headers=self.headers)
+            forbidden = await client.post(url, content=self.body(2))
+
+        self.assertEqual(ok.status_code, 200)
+        self.assertEqual(forbidden.status_code, 403)
+        self.assertEqual(self.app.update_queue.qsize(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()